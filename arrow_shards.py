@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Écriture directe des segments audio dans des fichiers Arrow fragmentés (shards),
+au format attendu par `datasets.load_from_disk`.
+
+Chaque shard est un flux IPC Arrow (`data-00000-of-00008.arrow`, ...) contenant
+une ligne par segment :
+- `input_values` : échantillons audio (float32, ou int16 pour diviser la taille par deux)
+- `file` : nom de base du fichier source
+- `chunk` : numéro du segment dans le fichier source
+
+D'autres colonnes de métadonnées peuvent remplacer `file` / `chunk` (par
+exemple texte et variété pour les segments annotés de `eaf_to_csv.py`).
+
+Les fichiers `state.json` et `dataset_info.json` sont écrits comme le ferait
+`Dataset.save_to_disk`, si bien que le répertoire se charge avec
+`load_from_disk` sans conversion : les shards sont projetés en mémoire (memory-map)
+sans copie.
+
+Auteur : Daphne Teixeira
+"""
+
+import importlib.util
+import json
+import os
+import uuid
+
+import numpy as np
+import pyarrow as pa
+
+from audio_stream import to_int16
+
+# `datasets` (long à importer) n'est chargé qu'à la construction du schéma ;
+# son absence est signalée dès l'import, comme celle de pyarrow
+if importlib.util.find_spec('datasets') is None:
+    raise ImportError("No module named 'datasets'")
+
+# === PARAMÈTRES ===
+AUDIO_COLUMN = 'input_values'
+AUDIO_DTYPES = ('float32', 'int16')
+SHARD_PATTERN = 'data-{index:05d}-of-{total:05d}.arrow'
+
+
+def shard_filename(index, total):
+    """Nom d'un shard, identique à la convention de `Dataset.save_to_disk`"""
+    return SHARD_PATTERN.format(index=index, total=total)
+
+
+def get_features(audio_dtype='float32', columns=None):
+    """Schéma `datasets` des shards audio ; `columns` remplace les colonnes `file` et `chunk`"""
+    from datasets import Features, Sequence, Value
+
+    if audio_dtype not in AUDIO_DTYPES:
+        raise ValueError(f"Type audio non supporté : {audio_dtype} (attendu : {', '.join(AUDIO_DTYPES)})")
+    if columns is None:
+        columns = {'file': Value('string'), 'chunk': Value('int32')}
+    return Features({AUDIO_COLUMN: Sequence(Value(audio_dtype)), **columns})
+
+
+class ArrowShardWriter:
+    """
+    Écrit des segments audio, un par un, dans un shard Arrow.
+    Chaque segment est écrit dès sa réception : la mémoire utilisée ne dépend
+    pas du nombre de segments du shard.
+    """
+
+    def __init__(self, path, audio_dtype='float32', columns=None):
+        self.path = path
+        self.audio_dtype = audio_dtype
+        self.schema = get_features(audio_dtype, columns).arrow_schema
+        self.num_rows = 0
+        self._sink = pa.OSFile(path, 'wb')
+        self._writer = pa.ipc.new_stream(self._sink, self.schema)
+
+    def write(self, audio, source, chunk):
+        """Ajoute un segment (tableau numpy mono) au shard"""
+        self.write_row(audio, file=source, chunk=chunk)
+
+    def write_row(self, audio, **values):
+        """Ajoute un segment avec les valeurs de ses colonnes de métadonnées"""
+        if self.audio_dtype == 'int16':
+            audio = to_int16(audio)
+        else:
+            audio = np.asarray(audio, dtype=np.float32)
+
+        # Construction directe de la colonne liste à partir du tampon numpy
+        offsets = pa.array([0, len(audio)], type=pa.int32())
+        columns = [pa.ListArray.from_arrays(offsets, pa.array(audio))]
+        for field in list(self.schema)[1:]:
+            columns.append(pa.array([values[field.name]], type=field.type))
+        batch = pa.record_batch(columns, schema=self.schema)
+        self._writer.write_batch(batch)
+        self.num_rows += 1
+
+    def close(self):
+        self._writer.close()
+        self._sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_dataset_metadata(output_dir, shard_filenames, audio_dtype='float32', sample_rate=16000,
+                           columns=None, source='pre-process.py'):
+    """
+    Écrit `state.json` et `dataset_info.json` pour que `output_dir` soit
+    reconnu par `datasets.load_from_disk`, et renvoie True.
+
+    Sans aucun shard, `load_from_disk` échouerait (IndexError) : rien n'est
+    écrit, les métadonnées d'une exécution précédente (qui désigneraient des
+    shards supprimés) sont retirées, et la fonction renvoie False.
+    """
+    if not shard_filenames:
+        for filename in ('state.json', 'dataset_info.json'):
+            path = os.path.join(output_dir, filename)
+            if os.path.exists(path):
+                os.remove(path)
+        return False
+
+    from datasets import DatasetInfo
+
+    info = DatasetInfo(
+        description=f"Segments audio mono {sample_rate} Hz produits par {source}",
+        features=get_features(audio_dtype, columns),
+    )
+    info.write_to_directory(output_dir)
+
+    state = {
+        '_data_files': [{'filename': filename} for filename in shard_filenames],
+        '_fingerprint': uuid.uuid4().hex[:16],
+        '_format_columns': None,
+        '_format_kwargs': {},
+        '_format_type': None,
+        '_output_all_columns': False,
+        '_split': None,
+    }
+    with open(os.path.join(output_dir, 'state.json'), 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    return True
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+Chaîne de transcription de bout en bout, en mémoire :
+décodage → VAD → découpage en fenêtres → caractéristiques log-mel → transcription.
+
+Chaque étape est un générateur exécuté dans son propre thread et reliée à la
+suivante par une file bornée (`queue.Queue(maxsize)`). Quand une étape aval
+prend du retard, sa file d'entrée se remplit et l'étape amont se bloque. Les
+calculs lourds (décodage soxr, pyannote, feature extractor, `generate`)
+relâchent le GIL et se recouvrent.
+
+L'audio est décodé une seule fois (`audio_stream.py`, mono 16 kHz). La VAD a
+besoin de l'enregistrement entier : une file bornée en nombre d'éléments ne
+bornerait donc pas la mémoire (quatre enregistrements de plusieurs heures).
+Les enregistrements décodés sont comptés en échantillons (`SampleBudget`) : le
+décodage d'un fichier attend que le budget (`--max_buffered_seconds`) le
+permette, et l'enregistrement est libéré dès son découpage en fenêtres. En
+aval, seules des copies des fenêtres (au plus `chunk_length` secondes
+chacune) circulent, par lots de `batch_size`. La mémoire audio est ainsi
+bornée en secondes, quels que soient le nombre et la durée des fichiers (un
+enregistrement plus long que le budget est traité seul).
+Aucun fichier intermédiaire n'est écrit, sauf sur demande :
+- `--vad_dir` : parole concaténée et RTTM, comme `vad_pyannote.py`
+- `--output_dir` : un JSON par enregistrement, comme `whisper_infer.py`
+
+Exemple :
+    python asr_pipeline.py recordings/ --model_dir whisper-kriol-finetuned --output_dir transcriptions/
+
+Auteur : Daphne Teixeira
+"""
+
+import argparse
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+import instrumentation
+from audio_stream import read_resampled_blocks
+from instrumentation import stage, track_file
+from manifest import unique_stems
+from whisper_infer import (SAMPLE_RATE, CHUNK_LENGTH, BATCH_SIZE, BACKENDS, chunk_length_arg, collect_audio_files,
+                           extract_features, load_model, split_windows, transcribe_batch, write_transcription)
+
+# === PARAMÈTRES ===
+QUEUE_SIZE = 4  # Éléments en attente entre deux étapes (fichiers, puis lots de fenêtres)
+MAX_BUFFERED_SECONDS = 3600  # Audio décodé en attente de découpage (1 h à 16 kHz : 230 Mo en float32)
+MIN_SEGMENT_DURATION = 0.5
+
+_DONE = object()  # Fin de flux
+
+
+class _StageError:
+    """Exception levée dans une étape, transmise à l'étape suivante"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def threaded(stage, source, maxsize=QUEUE_SIZE):
+    """
+    Exécute le générateur `stage(source)` dans un thread et renvoie un
+    itérateur sur ses sorties, via une file de `maxsize` éléments. Une
+    exception dans l'étape est relancée chez le consommateur.
+    """
+    items = queue.Queue(maxsize)
+    stopped = threading.Event()
+
+    def put(item):
+        # Attente interruptible : si le consommateur abandonne, le thread se termine
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run():
+        try:
+            for item in stage(source):
+                if not put(item):
+                    return
+                del item  # Aucune référence gardée pendant le calcul de l'élément suivant
+        except BaseException as e:
+            put(_StageError(e))
+        put(_DONE)
+
+    threading.Thread(target=run, daemon=True, name=getattr(stage, "__name__", "stage")).start()
+
+    def iterate():
+        try:
+            while True:
+                item = items.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, _StageError):
+                    raise item.error
+                yield item
+                del item
+        finally:
+            stopped.set()
+
+    return iterate()
+
+
+class SampleBudget:
+    """
+    Nombre d'échantillons des enregistrements décodés mais pas encore découpés
+    en fenêtres. `acquire` attend que le budget le permette ; un enregistrement
+    plus long que le budget entier est admis quand plus rien n'est retenu.
+    """
+
+    def __init__(self, max_samples):
+        self.max_samples = max_samples
+        self.used = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def acquire(self, samples):
+        with self.condition:
+            while self.used and self.used + samples > self.max_samples and not self.closed:
+                self.condition.wait()
+            self.used += samples
+
+    def release(self, samples):
+        with self.condition:
+            self.used -= samples
+            self.condition.notify_all()
+
+    def close(self):
+        """Débloque les attentes (pipeline interrompu)"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+def expected_samples(path, sample_rate=SAMPLE_RATE):
+    """Longueur après rééchantillonnage, d'après l'en-tête (même arrondi que `read_resampled_blocks`)"""
+    info = sf.info(path)
+    if info.samplerate == sample_rate:
+        return info.frames
+    return int(np.ceil(info.frames * sample_rate / info.samplerate))
+
+
+# === ÉTAPES ===
+def decode_stage(sample_rate=SAMPLE_RATE, budget=None):
+    """
+    Décode chaque fichier une seule fois : génère (chemin, signal mono numpy).
+    Avec `budget`, la place de l'enregistrement est réservée avant le décodage
+    et libérée par `window_stage`.
+    """
+    def stage(paths):
+        for path in paths:
+            reserved = 0
+            try:
+                with track_file(path):
+                    if budget is not None:
+                        reserved = expected_samples(path, sample_rate)
+                        budget.acquire(reserved)
+                    audio = np.concatenate(list(read_resampled_blocks(path, sample_rate)) or [np.zeros(0, np.float32)])
+            except Exception as e:
+                if budget is not None:
+                    budget.release(reserved)
+                print(f"Erreur lors du chargement de {path} : {e}")
+                continue
+            if budget is not None:
+                budget.release(reserved - len(audio))  # Réservation ajustée à la longueur réelle
+            yield path, audio
+            del audio  # Libéré par window_stage, pas retenu pendant l'attente du fichier suivant
+    return stage
+
+
+def vad_stage(min_segment_duration=MIN_SEGMENT_DURATION, vad_dir=None, sample_rate=SAMPLE_RATE, backend="pyannote",
+              names=None, budget=None):
+    """
+    Détecte la parole : génère (chemin, signal, régions [(début, fin)]) ; écrit WAV + RTTM si `vad_dir`,
+    sous le nom donné par `names` (voir `vad_pyannote.output_names`) ou, à défaut, celui du fichier.
+    Un fichier en erreur est signalé et écarté (sorties partielles supprimées, place rendue à `budget`).
+    """
+    from vad_pyannote import detect_speech, remove_partial_outputs, save_vad_outputs
+
+    def stage(items):
+        for path, audio in items:
+            name = names[path] if names else os.path.basename(path)
+            try:
+                turns = detect_speech(audio, sample_rate, min_segment_duration, backend)
+                if vad_dir is not None and turns:
+                    save_vad_outputs(name, audio, turns, vad_dir, sample_rate)
+            except Exception as e:
+                print(f"Erreur lors de la détection de la parole dans {path} : {e}")
+                if vad_dir is not None:
+                    remove_partial_outputs(vad_dir, name)
+                if budget is not None:
+                    budget.release(len(audio))
+                del audio
+                continue
+            yield path, audio, [(start, end) for _, start, end in turns]
+            del audio
+    return stage
+
+
+def window_stage(batch_size=BATCH_SIZE, chunk_length=CHUNK_LENGTH, budget=None):
+    """
+    Découpe chaque signal en fenêtres Whisper (alignées sur la parole si la
+    VAD est active) et les regroupe en lots de `batch_size`, fichiers mélangés.
+    Chaque élément d'un lot est (chemin, début, fenêtre, nombre de fenêtres du fichier).
+    Les fenêtres mises en lot sont copiées : une fois toutes ses fenêtres
+    émises, l'enregistrement entier est libéré et rendu à `budget`, avant
+    l'attente du fichier suivant (un lot incomplet ne le retient pas).
+    """
+    def stage(items):
+        batch = []
+        for item in items:
+            path, audio = item[0], item[1]
+            turns = item[2] if len(item) > 2 else None
+            del item
+            try:
+                windows = list(split_windows(audio, chunk_length, turns))  # Vues sur l'enregistrement
+                if not windows:
+                    yield [(path, None, None, 0)]  # Fichier sans parole : transcription vide
+                    continue
+                for start, window in windows:
+                    batch.append((path, start, window.copy(), len(windows)))
+                    if len(batch) == batch_size:
+                        yield batch
+                        batch = []
+            finally:
+                samples = len(audio)
+                windows = window = audio = None  # Plus aucune vue sur l'enregistrement
+                if budget is not None:
+                    budget.release(samples)
+        if batch:
+            yield batch
+    return stage
+
+
+def feature_stage(processor):
+    """
+    Calcule les caractéristiques log-mel de chaque lot : génère (lot, input_features, erreur) ;
+    une erreur est transmise à `transcription_stage` au lieu d'interrompre le pipeline
+    """
+    def stage(batches):
+        for batch in batches:
+            windows = [(start, window) for _, start, window, _ in batch if window is not None]
+            input_features, error = None, None
+            try:
+                if windows:
+                    input_features = extract_features(windows, processor)
+            except Exception as e:
+                error = e
+            yield batch, input_features, error
+    return stage
+
+
+def transcription_stage(processor, model):
+    """
+    Transcrit chaque lot : génère (chemin, segments de la fenêtre, nombre de fenêtres du fichier, erreur).
+    Un lot en erreur marque chacune de ses fenêtres : seuls les fichiers concernés échouent.
+    """
+    def stage(items):
+        for batch, input_features, error in items:
+            results = [[] for _ in batch]
+            if error is None and input_features is not None:
+                try:
+                    results = transcribe_batch([(start, window) for _, start, window, _ in batch], processor, model,
+                                               input_features)
+                except Exception as e:
+                    error = e
+            for (path, _, _, count), segments in zip(batch, results):
+                yield path, segments, count, error
+    return stage
+
+
+# === ORCHESTRATION ===
+def run_pipeline(audio_files, processor, model, use_vad=True, min_segment_duration=MIN_SEGMENT_DURATION,
+                 batch_size=BATCH_SIZE, chunk_length=CHUNK_LENGTH, queue_size=QUEUE_SIZE,
+                 vad_dir=None, output_dir=None, vad_backend="pyannote", max_buffered_seconds=MAX_BUFFERED_SECONDS):
+    """
+    Génère (chemin, segments) pour chaque enregistrement dès que toutes ses
+    fenêtres sont transcrites. Avec `output_dir`, écrit aussi le JSON de
+    chaque enregistrement, sous un nom unique (`manifest.unique_stems`, comme
+    les sorties de la VAD). `max_buffered_seconds` borne l'audio décodé en
+    attente de découpage (voir `SampleBudget`). Un fichier en erreur (décodage,
+    VAD, transcription) est signalé et omis ; les autres sont traités.
+    """
+    for directory in (output_dir, vad_dir):
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    budget = SampleBudget(int(max_buffered_seconds * SAMPLE_RATE))
+    try:
+        yield from _run_stages(list(audio_files), processor, model, use_vad, min_segment_duration, batch_size,
+                               chunk_length, queue_size, vad_dir, output_dir, vad_backend, budget)
+    finally:
+        budget.close()  # Libère un décodage en attente si le consommateur s'arrête
+
+
+def _run_stages(audio_files, processor, model, use_vad, min_segment_duration, batch_size, chunk_length,
+                queue_size, vad_dir, output_dir, vad_backend, budget):
+    stream = threaded(decode_stage(budget=budget), audio_files, queue_size)
+    if use_vad:
+        from vad_pyannote import output_names
+
+        # Homonymes de sous-dossiers différents : suffixes _2, _3, ... au lieu d'écraser les sorties
+        names = output_names(audio_files) if vad_dir is not None else None
+        stream = threaded(vad_stage(min_segment_duration, vad_dir, backend=vad_backend, names=names, budget=budget),
+                          stream, queue_size)
+    stream = threaded(window_stage(batch_size, chunk_length, budget), stream, queue_size)
+    stream = threaded(feature_stage(processor), stream, queue_size)
+    stream = transcription_stage(processor, model)(stream)  # Thread principal : GPU
+
+    stems = dict(zip(audio_files, unique_stems(audio_files)))  # Chemin -> nom du JSON
+    segments = {}  # Chemin -> segments reçus
+    received = {}  # Chemin -> fenêtres reçues
+    errors = {}    # Chemin -> première erreur de transcription
+    for path, window_segments, count, error in stream:
+        segments.setdefault(path, []).extend(window_segments)
+        received[path] = received.get(path, 0) + 1
+        if error is not None:
+            errors.setdefault(path, error)
+        if count == 0 or received[path] == count:
+            file_segments = sorted(segments.pop(path), key=lambda s: s["start"])
+            del received[path]
+            if path in errors:
+                print(f"Erreur lors de la transcription de {path} : {errors.pop(path)}")
+                continue
+            if output_dir is not None:
+                write_transcription(path, file_segments, output_dir, stems[path])
+            yield path, file_segments
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcription de bout en bout en mémoire (VAD, fenêtres, Whisper)")
+    parser.add_argument("inputs", nargs="+", help="Fichiers WAV, répertoires ou listes de fichiers (.txt)")
+    parser.add_argument("--model_dir", type=str, default="whisper-kriol-finetuned", help="Dossier du modèle fine-tuné")
+    parser.add_argument("--output_dir", type=str, default=".", help="Dossier des fichiers JSON produits")
+    parser.add_argument("--vad_dir", type=str, default=None,
+                        help="Si fourni, écrit aussi la parole détectée (WAV) et les RTTM dans ce dossier")
+    parser.add_argument("--no_vad", action="store_true", help="Fenêtres de 30 s consécutives, sans VAD")
+    parser.add_argument("--vad_backend", choices=("pyannote", "energy", "hybrid"), default="pyannote",
+                        help="Détection de la parole (voir vad_pyannote.py)")
+    parser.add_argument("--min_segment_duration", type=float, default=MIN_SEGMENT_DURATION,
+                        help="Durée minimale d'une région de parole (secondes)")
+    parser.add_argument("--batch_size", type=int, default=BATCH_SIZE, help="Nombre de fenêtres par appel à generate")
+    parser.add_argument("--chunk_length", type=chunk_length_arg, default=CHUNK_LENGTH,
+                        help="Durée maximale d'une fenêtre (secondes, 30 au plus)")
+    parser.add_argument("--queue_size", type=int, default=QUEUE_SIZE, help="Taille des files entre étapes")
+    parser.add_argument("--max_buffered_seconds", type=float, default=MAX_BUFFERED_SECONDS,
+                        help="Audio décodé en attente de découpage en fenêtres (secondes)")
+    parser.add_argument("--backend", choices=BACKENDS, default="fp32",
+                        help="Backend d'inférence (int8 : quantification dynamique pour CPU)")
+    parser.add_argument("--num_threads", type=int, default=None,
+                        help="Nombre de threads torch sur CPU (par défaut : cœurs physiques)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args.profile_log, args.cprofile, backend=args.backend)
+
+    with stage("load"):
+        processor, model = load_model(args.model_dir, backend=args.backend, num_threads=args.num_threads)
+    started = time.perf_counter()
+    count = 0
+    for path, segments in run_pipeline(collect_audio_files(args.inputs), processor, model, not args.no_vad,
+                                       args.min_segment_duration, args.batch_size, args.chunk_length,
+                                       args.queue_size, args.vad_dir, args.output_dir, args.vad_backend,
+                                       args.max_buffered_seconds):
+        count += 1
+        print(f"[✓] {os.path.basename(path)} : {len(segments)} segments transcrits")
+    print(f"\n{count} enregistrements transcrits en {time.perf_counter() - started:.1f} s")
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Lecture audio en flux, partagée par les étapes de prétraitement
+(`pre-process.py`, `vad_pyannote.py`) : le fichier est lu par blocs, converti
+en mono et rééchantillonné à la volée, sans jamais être chargé en entier.
+
+`load_audio` charge au contraire un fichier entier, avec le même résultat que
+`librosa.load`, sans importer librosa ni scipy (plus d'une seconde au démarrage).
+
+Auteur : Daphne Teixeira
+"""
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+from instrumentation import add_audio, stage, timed
+
+
+def read_resampled_blocks(input_path, sample_rate=16000, block_duration=5):
+    """
+    Lit un fichier WAV par blocs de `block_duration` secondes, le convertit en
+    mono et le rééchantillonne à la volée (soxr en mode flux, la même
+    implémentation que librosa.resample). Seul un bloc est en mémoire à la fois.
+    Les temps de lecture et de rééchantillonnage sont comptés dans les étapes
+    `decode` et `resample` (voir `instrumentation.py`).
+    """
+    info = sf.info(input_path)
+    add_audio(info.frames / info.samplerate)
+    resampler = None
+    if info.samplerate != sample_rate:
+        resampler = soxr.ResampleStream(info.samplerate, sample_rate, 1, dtype='float32', quality='HQ')
+
+    blocksize = int(info.samplerate * block_duration)
+    blocks = sf.blocks(input_path, blocksize=blocksize, dtype='float32', always_2d=True)
+    for block in timed(blocks, 'decode'):
+        mono = block.mean(axis=1)
+        if resampler is not None:
+            with stage('resample'):
+                mono = resampler.resample_chunk(mono, last=False)
+        yield mono
+
+    # Vide le tampon interne du rééchantillonneur
+    if resampler is not None:
+        with stage('resample'):
+            tail = resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+        yield tail
+
+
+def resample(audio, orig_sr, target_sr):
+    """
+    Rééchantillonne un signal mono comme `librosa.resample` (soxr HQ), y
+    compris la longueur finale : ceil(n * target_sr / orig_sr) échantillons.
+    """
+    length = int(np.ceil(len(audio) * target_sr / orig_sr))
+    resampled = soxr.resample(audio, orig_sr, target_sr, quality='HQ')
+    if len(resampled) < length:
+        return np.pad(resampled, (0, length - len(resampled)))
+    return resampled[:length]
+
+
+def load_audio(input_path, sample_rate=None):
+    """
+    Charge un fichier entier en mono float32 et renvoie (signal, fréquence).
+    Avec `sample_rate`, le signal est rééchantillonné : même résultat que
+    `librosa.load(input_path, sr=sample_rate, mono=True)`.
+    """
+    with stage('decode'):
+        audio, sr = sf.read(input_path, dtype='float32', always_2d=True)
+        audio = audio.mean(axis=1)
+    if sample_rate is not None and sr != sample_rate:
+        with stage('resample'):
+            audio = resample(audio, sr, sample_rate)
+        sr = sample_rate
+    add_audio(len(audio) / sr)
+    return audio, sr
+
+
+def to_int16(audio):
+    """Convertit un signal float dans [-1, 1] en PCM 16 bits"""
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark de la normalisation de `simple_normalization.py` : compare la
+version d'origine (trois `re.sub`) au moteur `str.translate`, vérifie que les
+deux produisent exactement le même texte et affiche le débit en lignes/s.
+
+Les lignes viennent d'un CSV de transcriptions (`--csv`) ou, à défaut, sont
+générées aléatoirement (mots, ponctuation, accents, caractères parasites).
+
+Exemple :
+    python benchmark_normalization.py --csv whisper_kriol_cm.csv --repeat 5
+
+Auteur : Daphne Teixeira
+"""
+
+import argparse
+import csv
+import random
+import time
+
+from simple_normalization import COLUMN_NAME, normalize_batch, normalize_text, normalize_text_regex
+
+# === PARAMÈTRES ===
+N_ROWS = 100000
+ALPHABET = "abdefgiklmnñoprstuwyzáéíóú'"
+NOISE = ".,!?;:-\"()«»…/\t"
+
+
+def synthetic_rows(n_rows=N_ROWS, seed=0):
+    """Phrases aléatoires de 5 à 25 mots, avec ponctuation et caractères parasites"""
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n_rows):
+        words = []
+        for _ in range(rng.randint(5, 25)):
+            word = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 8)))
+            if rng.random() < 0.2:
+                word = word.capitalize()
+            if rng.random() < 0.15:
+                word += rng.choice(NOISE)
+            words.append(word)
+        rows.append(" ".join(words))
+    return rows
+
+
+def load_rows(csv_path, column=COLUMN_NAME):
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        return [row[column] for row in csv.DictReader(f)]
+
+
+def time_function(function, rows, repeat=3):
+    """Meilleur temps (secondes) sur `repeat` passages"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(rows)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro-benchmark de la normalisation des transcriptions")
+    parser.add_argument('--csv', type=str, default=None, help="CSV de transcriptions (sinon lignes synthétiques)")
+    parser.add_argument('--column', type=str, default=COLUMN_NAME, help="Colonne de texte du CSV")
+    parser.add_argument('--rows', type=int, default=N_ROWS, help="Nombre de lignes synthétiques")
+    parser.add_argument('--repeat', type=int, default=3, help="Nombre de passages (meilleur temps retenu)")
+    args = parser.parse_args()
+
+    rows = load_rows(args.csv, args.column) if args.csv else synthetic_rows(args.rows)
+
+    mismatches = sum(normalize_text(row) != normalize_text_regex(row) for row in rows)
+    if mismatches:
+        print(f"Attention : {mismatches} lignes normalisées différemment par les deux versions")
+
+    results = {
+        "re.sub (origine)": time_function(lambda r: [normalize_text_regex(t) for t in r], rows, args.repeat),
+        "str.translate": time_function(lambda r: [normalize_text(t) for t in r], rows, args.repeat),
+        "normalize_batch": time_function(normalize_batch, rows, args.repeat),
+    }
+    baseline = results["re.sub (origine)"]
+    print(f"{len(rows)} lignes, meilleur temps sur {args.repeat} passages :")
+    for name, seconds in results.items():
+        print(f"{name:>18} : {seconds:.3f} s  {len(rows) / seconds:,.0f} lignes/s  x{baseline / seconds:.2f}")
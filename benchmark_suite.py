@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+"""
+Suite de benchmarks hors ligne des étapes du pipeline, sans modèle téléchargé.
+
+Les données sont synthétiques et générées à chaque exécution :
+- des enregistrements imitant la parole (syllabes voisées à 100-250 Hz et
+  harmoniques, enveloppe syllabique d'environ 4 Hz, pauses bruitées), à 44,1 kHz
+  pour exercer aussi le rééchantillonnage
+- des fichiers EAF (deux tiers, dont une partiellement dupliquée) et des
+  transcriptions CSV correspondantes
+
+Les modèles réels sont remplacés par des substituts :
+- pyannote : VAD par seuil d'énergie renvoyant une timeline pyannote
+- Whisper : petit modèle initialisé aléatoirement (2 couches, d_model = 64),
+  feature extractor Whisper standard et petit tokenizer local
+
+Chaque benchmark tourne dans un processus neuf (pic de mémoire propre) et
+rapporte le temps, le débit en secondes d'audio par seconde et le pic de
+mémoire résidente (RSS). Un benchmark dont une dépendance manque est marqué
+`skipped` au lieu d'échouer ; un benchmark qui lève une exception, ou dont
+la sortie est vide ou incomplète (`segments` nul, `failures` non nul), est
+marqué `failed`, sans débit. Les résultats sont écrits en JSON, avec le
+commit courant, et peuvent être comparés à un fichier précédent.
+
+Exemple :
+    python benchmark_suite.py --output bench_new.json --compare bench_old.json
+    python benchmark_suite.py --only normalize_text whisper_generate --scale 2
+
+Auteur : Daphne Teixeira
+"""
+
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+# === PARAMÈTRES ===
+OUTPUT_JSON = "benchmark_results.json"
+NATIVE_RATE = 44100
+SAMPLE_RATE = 16000
+N_FILES = 4
+FILE_DURATION = 60  # Secondes par enregistrement synthétique (multipliées par --scale)
+WORDS = ["bu", "ka", "sibi", "n", "sta", "bon", "kuma", "ku", "bai", "pa", "skola", "mindjer", "omi", "kasa"]
+
+
+# === FIXTURES SYNTHÉTIQUES ===
+def synthetic_speech(duration, sample_rate=NATIVE_RATE, seed=0):
+    """
+    Signal imitant la parole et ses régions parlées [(début, fin)] en secondes :
+    tours de parole de 1 à 6 s séparés de pauses de 0,3 à 1,5 s.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(duration * sample_rate)
+    t = np.arange(n) / sample_rate
+
+    # Voix : fondamentale avec intonation lente, cinq harmoniques décroissantes
+    f0 = rng.uniform(100, 250) * (1 + 0.1 * np.sin(2 * np.pi * 0.5 * t))
+    phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t + rng.uniform(0, 2 * np.pi)), 0, None)
+
+    mask = np.zeros(n, dtype=np.float32)
+    turns = []
+    position = rng.uniform(0.2, 1.0)
+    while position < duration - 1:
+        end = min(duration, position + rng.uniform(1, 6))
+        mask[int(position * sample_rate):int(end * sample_rate)] = 1
+        turns.append((round(position, 3), round(end, 3)))
+        position = end + rng.uniform(0.3, 1.5)
+
+    audio = 0.3 * voiced * envelope * mask + 0.005 * rng.standard_normal(n)
+    return audio.astype(np.float32), turns
+
+
+def random_sentence(rng, n_words):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + rng.choice([".", ",", "?", "!"])
+
+
+def write_eaf(path, audio_filename, turns, texts):
+    """
+    Fichier ELAN minimal : une tier de transcription et une seconde tier dupliquant un tour sur trois.
+    Les attributs de schéma (`xsi:noNamespaceSchemaLocation`) sont exigés par `pympi.Elan.Eaf`.
+    """
+    slots, tiers = [], {"Transcription": [], "Locuteur2": []}
+    for i, ((start, end), text) in enumerate(zip(turns, texts)):
+        slots.append((f"ts{2 * i + 1}", int(start * 1000)))
+        slots.append((f"ts{2 * i + 2}", int(end * 1000)))
+        tiers["Transcription"].append((f"ts{2 * i + 1}", f"ts{2 * i + 2}", text))
+        if i % 3 == 0:
+            tiers["Locuteur2"].append((f"ts{2 * i + 1}", f"ts{2 * i + 2}", text))
+
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<ANNOTATION_DOCUMENT AUTHOR="" DATE="2024-01-01T00:00:00+00:00" FORMAT="3.0" VERSION="3.0" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xsi:noNamespaceSchemaLocation="http://www.mpi.nl/tools/elan/EAFv3.0.xsd">',
+        '  <HEADER MEDIA_FILE="" TIME_UNITS="milliseconds">',
+        f'    <MEDIA_DESCRIPTOR MEDIA_URL="file:///{audio_filename}" MIME_TYPE="audio/x-wav" '
+        f'RELATIVE_MEDIA_URL="./{audio_filename}"/>',
+        '  </HEADER>',
+        '  <TIME_ORDER>',
+    ]
+    lines += [f'    <TIME_SLOT TIME_SLOT_ID="{slot}" TIME_VALUE="{value}"/>' for slot, value in slots]
+    lines.append('  </TIME_ORDER>')
+    annotation_id = 0
+    for tier, annotations in tiers.items():
+        lines.append(f'  <TIER LINGUISTIC_TYPE_REF="default-lt" TIER_ID="{tier}">')
+        for ref1, ref2, text in annotations:
+            annotation_id += 1
+            lines.append(f'    <ANNOTATION><ALIGNABLE_ANNOTATION ANNOTATION_ID="a{annotation_id}" '
+                         f'TIME_SLOT_REF1="{ref1}" TIME_SLOT_REF2="{ref2}">'
+                         f'<ANNOTATION_VALUE>{text}</ANNOTATION_VALUE></ALIGNABLE_ANNOTATION></ANNOTATION>')
+        lines.append('  </TIER>')
+    lines.append('  <LINGUISTIC_TYPE GRAPHIC_REFERENCES="false" LINGUISTIC_TYPE_ID="default-lt" TIME_ALIGNABLE="true"/>')
+    lines.append('</ANNOTATION_DOCUMENT>')
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def make_fixtures(workdir, n_files=N_FILES, duration=FILE_DURATION, seed=0):
+    """Écrit le corpus synthétique (WAV, EAF, CSV) et renvoie sa description"""
+    import csv
+    import random
+
+    corpus_dir = os.path.join(workdir, "corpus")
+    os.makedirs(corpus_dir, exist_ok=True)
+    rng = random.Random(seed)
+    files = []
+    with open(os.path.join(workdir, "transcriptions.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["audio", "start", "end", "text", "variety"])
+        for i in range(n_files):
+            audio, turns = synthetic_speech(duration, seed=seed + i)
+            stem = f"locuteur_{i:02d}"
+            sf.write(os.path.join(corpus_dir, f"{stem}.wav"), audio, NATIVE_RATE)
+            texts = [random_sentence(rng, rng.randint(3, 15)) for _ in turns]
+            write_eaf(os.path.join(corpus_dir, f"{stem}.eaf"), f"{stem}.wav", turns, texts)
+            for (start, end), text in zip(turns, texts):
+                writer.writerow([f"{stem}.wav", start, end, text, "CM" if i % 2 == 0 else "GB"])
+            files.append({"stem": stem, "duration": duration, "turns": turns})
+    return {"corpus_dir": corpus_dir, "files": files, "audio_seconds": n_files * duration,
+            "speech_seconds": sum(end - start for f in files for start, end in f["turns"])}
+
+
+# === MODÈLES SUBSTITUTS ===
+class EnergyVADStub:
+    """Remplace le pipeline pyannote : régions dont l'énergie (trames de 20 ms) dépasse un seuil"""
+
+    def __call__(self, inputs):
+        from pyannote.core import Segment
+
+        audio = inputs["waveform"][0].numpy()
+        sample_rate = inputs["sample_rate"]
+        frame = int(0.02 * sample_rate)
+        n_frames = len(audio) // frame
+        energy = np.sqrt((audio[:n_frames * frame].reshape(n_frames, frame) ** 2).mean(axis=1))
+        active = np.convolve(energy > 0.02, np.ones(15), mode="same") > 0  # Comble les creux entre syllabes
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], active.astype(np.int8), [0]])))
+        segments = [Segment(float(start) * 0.02, float(end) * 0.02) for start, end in zip(edges[::2], edges[1::2])]
+
+        class Result:
+            def get_timeline(self):
+                return segments
+        return Result()
+
+
+def tiny_whisper():
+    """Petit modèle Whisper aléatoire et processor local (aucun téléchargement)"""
+    import string
+    from types import SimpleNamespace
+
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import (PreTrainedTokenizerFast, WhisperConfig, WhisperFeatureExtractor,
+                              WhisperForConditionalGeneration)
+
+    torch.manual_seed(0)
+    config = WhisperConfig(d_model=64, encoder_layers=2, decoder_layers=2, encoder_attention_heads=2,
+                           decoder_attention_heads=2, encoder_ffn_dim=128, decoder_ffn_dim=128)
+    model = WhisperForConditionalGeneration(config).eval()
+
+    vocab = {token: i for i, token in enumerate(["<pad>", "<|endoftext|>", "<unk>"] + list(string.printable))}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, pad_token="<pad>", eos_token="<|endoftext|>",
+                                        unk_token="<unk>")
+    processor = SimpleNamespace(feature_extractor=WhisperFeatureExtractor(), tokenizer=tokenizer)
+    return processor, model
+
+
+def _load_preprocess():
+    """`pre-process.py` n'est pas importable par son nom (tiret) : chargement par chemin"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pre-process.py")
+    spec = importlib.util.spec_from_file_location("pre_process", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _count_rows(paths, header=True):
+    """Nombre de lignes de données des fichiers texte `paths` (en-tête exclu)"""
+    rows = 0
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            rows += sum(1 for _ in f) - bool(header)
+    return rows
+
+
+# === BENCHMARKS ===
+# Chaque fonction renvoie au moins "seconds" et, pour les étapes audio, "audio_seconds".
+# Les étapes qui produisent des fichiers renvoient aussi "segments" (sorties écrites)
+# et "failures" (fichiers en échec), vérifiés avant de rapporter un débit.
+def bench_process_wav_files(workdir, fixtures):
+    preprocess = _load_preprocess()
+    output_dir = os.path.join(workdir, "preprocess_out")
+    started = time.perf_counter()
+    _, _, failed = preprocess.process_wav_files(fixtures["corpus_dir"], output_dir, incremental=False)
+    seconds = time.perf_counter() - started
+    return {"seconds": seconds, "audio_seconds": fixtures["audio_seconds"],
+            "segments": sum(filename.endswith(".wav") for filename in os.listdir(output_dir)), "failures": failed}
+
+
+def bench_apply_vad(workdir, fixtures, backend="pyannote"):
+    import vad_pyannote
+
+    vad_pyannote._pipeline = EnergyVADStub()
+    output_dir = os.path.join(workdir, f"vad_out_{backend}")
+    started = time.perf_counter()
+    vad_pyannote.apply_vad(fixtures["corpus_dir"], output_dir, incremental=False, backend=backend)
+    seconds = time.perf_counter() - started
+    # Chaque enregistrement synthétique contient de la parole : un RTTM manquant est un échec
+    rttm_dir = os.path.join(output_dir, "rttm")
+    rttm_files = [os.path.join(rttm_dir, f) for f in os.listdir(rttm_dir)] if os.path.isdir(rttm_dir) else []
+    return {"seconds": seconds, "audio_seconds": fixtures["audio_seconds"],
+            "segments": _count_rows(rttm_files, header=False), "failures": len(fixtures["files"]) - len(rttm_files)}
+
+
+def bench_apply_vad_energy(workdir, fixtures):
+    """VAD par énergie seule : le vrai backend, sans substitut"""
+    return bench_apply_vad(workdir, fixtures, backend="energy")
+
+
+def bench_apply_vad_hybrid(workdir, fixtures):
+    """Pré-filtre par énergie puis substitut pyannote sur les régions candidates"""
+    return bench_apply_vad(workdir, fixtures, backend="hybrid")
+
+
+def bench_normalize_text(workdir, fixtures):
+    from benchmark_normalization import synthetic_rows
+    from simple_normalization import normalize_text
+
+    rows = synthetic_rows(int(20000 * fixtures["scale"]))
+    started = time.perf_counter()
+    for row in rows:
+        normalize_text(row)
+    seconds = time.perf_counter() - started
+    return {"seconds": seconds, "rows": len(rows), "rows_per_second": len(rows) / seconds}
+
+
+def bench_extract_transcriptions(workdir, fixtures):
+    from eaf_to_csv import extract_transcriptions
+
+    csv_paths = [os.path.join(workdir, f"{f['stem']}.csv") for f in fixtures["files"]]
+    started = time.perf_counter()
+    for f, csv_path in zip(fixtures["files"], csv_paths):
+        extract_transcriptions(os.path.join(fixtures["corpus_dir"], f"{f['stem']}.eaf"), f"{f['stem']}.wav", "CM",
+                               csv_path)
+    return {"seconds": time.perf_counter() - started, "audio_seconds": fixtures["audio_seconds"],
+            "files": len(fixtures["files"]), "segments": _count_rows(csv_paths), "failures": 0}
+
+
+def bench_extract_corpus(workdir, fixtures):
+    from eaf_to_csv import extract_corpus
+
+    started = time.perf_counter()
+    segments, failed = extract_corpus(fixtures["corpus_dir"], os.path.join(workdir, "segments_out"))
+    return {"seconds": time.perf_counter() - started, "audio_seconds": fixtures["speech_seconds"],
+            "segments": segments, "failures": failed}
+
+
+def bench_collator(workdir, fixtures, n_batches=50, batch_size=16):
+    from whisper_trainer import DataCollatorSpeechSeq2SeqWithPadding
+
+    processor, _ = tiny_whisper()
+    collator = DataCollatorSpeechSeq2SeqWithPadding(processor, pad_to_multiple_of=8)
+    rng = np.random.default_rng(0)
+    n_batches = int(n_batches * fixtures["scale"])
+    batches = [[{"input_features": rng.standard_normal((80, 3000), dtype=np.float32),
+                 "labels": rng.integers(3, 100, rng.integers(5, 120)).tolist()} for _ in range(batch_size)]
+               for _ in range(n_batches)]
+    started = time.perf_counter()
+    for batch in batches:
+        collator(batch)
+    seconds = time.perf_counter() - started
+    # Chaque exemple correspond à une fenêtre Whisper de 30 s
+    return {"seconds": seconds, "audio_seconds": 30.0 * batch_size * n_batches,
+            "batches_per_second": n_batches / seconds, "label_padding_fraction": collator.reset_padding_stats()}
+
+
+def bench_whisper_features(workdir, fixtures, batch_size=8):
+    processor, _ = tiny_whisper()
+    windows = _whisper_windows(fixtures)
+    started = time.perf_counter()
+    for i in range(0, len(windows), batch_size):
+        processor.feature_extractor(windows[i:i + batch_size], sampling_rate=SAMPLE_RATE, return_tensors="np")
+    return {"seconds": time.perf_counter() - started, "audio_seconds": sum(len(w) for w in windows) / SAMPLE_RATE}
+
+
+def bench_whisper_generate(workdir, fixtures, batch_size=8, max_new_tokens=32):
+    import torch
+
+    processor, model = tiny_whisper()
+    windows = _whisper_windows(fixtures)
+    features = [torch.from_numpy(processor.feature_extractor(windows[i:i + batch_size], sampling_rate=SAMPLE_RATE,
+                                                             return_tensors="np").input_features)
+                for i in range(0, len(windows), batch_size)]
+    with torch.no_grad():
+        model.generate(features[0][:1], max_new_tokens=2)  # Chauffe
+        started = time.perf_counter()
+        for input_features in features:
+            model.generate(input_features, max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens)
+    return {"seconds": time.perf_counter() - started, "audio_seconds": sum(len(w) for w in windows) / SAMPLE_RATE,
+            "windows": len(windows), "tokens_per_window": max_new_tokens}
+
+
+def _whisper_windows(fixtures, chunk_length=30):
+    """Fenêtres de 30 s à 16 kHz découpées dans le premier enregistrement synthétique"""
+    audio, _ = synthetic_speech(fixtures["files"][0]["duration"], SAMPLE_RATE)
+    step = chunk_length * SAMPLE_RATE
+    return [audio[i:i + step] for i in range(0, len(audio), step)]
+
+
+BENCHMARKS = {
+    "process_wav_files": bench_process_wav_files,
+    "apply_vad": bench_apply_vad,
+    "apply_vad_energy": bench_apply_vad_energy,
+    "apply_vad_hybrid": bench_apply_vad_hybrid,
+    "normalize_text": bench_normalize_text,
+    "extract_transcriptions": bench_extract_transcriptions,
+    "extract_corpus": bench_extract_corpus,
+    "collator": bench_collator,
+    "whisper_features": bench_whisper_features,
+    "whisper_generate": bench_whisper_generate,
+}
+
+
+# === EXÉCUTION ===
+def _run_benchmark(name, workdir, fixtures):
+    """Exécuté dans un processus neuf : lance un benchmark et ajoute débit et pic de mémoire"""
+    try:
+        result = BENCHMARKS[name](workdir, fixtures)
+    except ImportError as e:
+        return {"skipped": f"dépendance manquante : {e}"}
+    except Exception as e:
+        # Consigné comme échec : les autres benchmarks tournent et le JSON est écrit
+        return {"failed": f"{type(e).__name__} : {e}"}
+    if result.get("failures") or result.get("segments") == 0:
+        return {"failed": f"sortie invalide : {result.get('segments')} segments, {result.get('failures')} échecs",
+                **{key: result[key] for key in ("segments", "failures") if key in result}}
+    if result.get("audio_seconds"):
+        result["audio_seconds_per_second"] = result["audio_seconds"] / result["seconds"]
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    result["peak_rss_mb"] = round(peak / 1024, 1)
+    return {key: round(value, 4) if isinstance(value, float) else value for key, value in result.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(names, workdir, scale=1.0):
+    fixtures = make_fixtures(workdir, duration=FILE_DURATION * scale)
+    fixtures["scale"] = scale
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for name in names:
+        print(f"=== {name} ===")
+        with context.Pool(1) as pool:
+            results[name] = pool.apply(_run_benchmark, (name, workdir, fixtures))
+        print(results[name])
+    return results
+
+
+def compare(results, previous):
+    """Affiche le rapport de débit et de mémoire par rapport à un fichier de résultats précédent"""
+    print(f"\nComparaison avec {previous.get('commit')} :")
+    for name, result in results.items():
+        old = previous.get("benchmarks", {}).get(name)
+        if not old or any(status in r for status in ("skipped", "failed") for r in (old, result)):
+            continue
+        speed = old["seconds"] / result["seconds"] if result["seconds"] else float("nan")
+        print(f"{name:>24} : vitesse x{speed:.2f}  RSS {old['peak_rss_mb']} -> {result['peak_rss_mb']} Mo")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks hors ligne du pipeline (données et modèles synthétiques)")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help="Benchmarks à exécuter")
+    parser.add_argument("--scale", type=float, default=1.0, help="Facteur de taille des données synthétiques")
+    parser.add_argument("--workdir", type=str, default=None, help="Répertoire des fixtures (par défaut : temporaire)")
+    parser.add_argument("--output", type=str, default=OUTPUT_JSON, help="Fichier JSON des résultats")
+    parser.add_argument("--compare", type=str, default=None, help="Fichier JSON d'une exécution précédente")
+    args = parser.parse_args()
+
+    if args.workdir is not None:
+        os.makedirs(args.workdir, exist_ok=True)
+        results = run_suite(args.only, args.workdir, args.scale)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = run_suite(args.only, workdir, args.scale)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "scale": args.scale,
+        "benchmarks": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nRésultats sauvegardés dans : {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(results, json.load(f))
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Comparaison des backends d'inférence de `whisper_infer.py` sur un jeu de test.
+
+Pour chaque backend (`fp32`, `int8`, `compile`), le script
+transcrit les segments d'un CSV de test (colonnes `audio`, `start`, `end`,
+`text`, comme produit par `eaf_to_csv.py`) et mesure :
+- le facteur temps réel (RTF = temps de calcul / durée audio, hors chargement)
+- le pic de mémoire résidente (RSS) du processus
+- le WER par rapport aux références, et l'écart (drift) par rapport au fp32
+- le WER entre les hypothèses du backend et celles du fp32 (désaccord)
+
+Chaque backend tourne dans un processus séparé pour que les pics de mémoire
+et les réglages de threads ne se mélangent pas. Un backend que la version
+installée de torch ne permet pas est signalé et ignoré.
+
+Exemple :
+    python benchmark_whisper_backends.py --model_dir whisper-kriol-finetuned \
+        --csv test_kriol.csv --audio_dir audio/ --backends fp32 int8 --num_threads 8
+
+Auteur : Daphne Teixeira
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import time
+
+from simple_normalization import normalize_text
+from wer import corpus_wer
+from whisper_infer import BACKENDS, unsupported_backend
+
+# === PARAMÈTRES ===
+model_dir = "whisper-kriol-finetuned"
+OUTPUT_JSON = "benchmark_backends.json"
+SAMPLE_RATE = 16000
+
+
+# === MESURE DU WER ===
+def normalized_wer(references, hypotheses):
+    """WER sur l'ensemble du corpus, après normalisation des deux côtés"""
+    return corpus_wer(references, hypotheses, normalize=normalize_text)
+
+
+# === CHARGEMENT DU JEU DE TEST ===
+def load_test_set(csv_path, audio_dir, limit=None):
+    """Lit le CSV de test et renvoie les lignes (audio, start, end, text)"""
+    rows = []
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            rows.append((os.path.join(audio_dir, row['audio']), float(row['start']), float(row['end']), row['text']))
+            if limit and len(rows) >= limit:
+                break
+    return rows
+
+
+def run_backend(model_dir, backend, rows, num_threads=None, batch_size=8):
+    """Exécuté dans un processus dédié : transcrit le jeu de test avec un backend"""
+    from whisper_infer import load_audio, load_model, transcribe_batch
+
+    started = time.perf_counter()
+    processor, model = load_model(model_dir, backend=backend, num_threads=num_threads)
+    load_time = time.perf_counter() - started
+
+    # Chaque enregistrement est décodé une seule fois, puis découpé en segments
+    cache = {}
+    segments = []
+    for audio_path, start, end, _ in rows:
+        if audio_path not in cache:
+            cache[audio_path] = load_audio(audio_path)
+        segments.append((0.0, cache[audio_path][int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]))
+    cache.clear()
+    audio_seconds = sum(len(audio) for _, audio in segments) / SAMPLE_RATE
+
+    # Un premier lot de chauffe (compilation, allocation) n'est pas compté
+    warmup_started = time.perf_counter()
+    transcribe_batch(segments[:batch_size], processor, model)
+    warmup_time = time.perf_counter() - warmup_started
+
+    hypotheses = []
+    started = time.perf_counter()
+    for i in range(0, len(segments), batch_size):
+        for window_segments in transcribe_batch(segments[i:i + batch_size], processor, model):
+            hypotheses.append(" ".join(s["text"] for s in window_segments))
+    compute_time = time.perf_counter() - started
+
+    return {
+        "backend": backend,
+        "segments": len(segments),
+        "audio_seconds": round(audio_seconds, 2),
+        "load_time_s": round(load_time, 2),
+        "warmup_time_s": round(warmup_time, 2),
+        "compute_time_s": round(compute_time, 2),
+        "rtf": round(compute_time / audio_seconds, 4) if audio_seconds else None,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "hypotheses": hypotheses,
+    }
+
+
+def compare_backends(model_dir, rows, backends, num_threads=None, batch_size=8):
+    """Lance chaque backend dans un processus neuf et calcule WER et écart au fp32"""
+    references = [text for _, _, _, text in rows]
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for backend in backends:
+        print(f"=== Backend {backend} ===")
+        reason = unsupported_backend(backend)
+        if reason:
+            print(f"Backend {backend} ignoré : {reason}")
+            continue
+        with context.Pool(1) as pool:
+            result = pool.apply(run_backend, (model_dir, backend, rows, num_threads, batch_size))
+        result["wer"] = round(normalized_wer(references, result["hypotheses"]), 4)
+        results.append(result)
+
+    baseline = next((r for r in results if r["backend"] == "fp32"), None)
+    for result in results:
+        if baseline is not None:
+            result["wer_drift"] = round(result["wer"] - baseline["wer"], 4)
+            result["disagreement_wer"] = round(normalized_wer(baseline["hypotheses"], result["hypotheses"]), 4)
+            result["speedup"] = round(baseline["rtf"] / result["rtf"], 2) if result["rtf"] else None
+        print(f"{result['backend']:>18} : RTF {result['rtf']}  RSS {result['peak_rss_mb']} Mo  "
+              f"WER {result['wer']}  drift {result.get('wer_drift')}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare les backends d'inférence Whisper (vitesse, mémoire, WER)")
+    parser.add_argument("--model_dir", type=str, default=model_dir, help="Dossier du modèle fine-tuné")
+    parser.add_argument("--csv", type=str, required=True, help="CSV de test (audio, start, end, text)")
+    parser.add_argument("--audio_dir", type=str, default=".", help="Répertoire des fichiers audio du CSV")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=["fp32", "int8"], help="Backends à comparer")
+    parser.add_argument("--num_threads", type=int, default=None,
+                        help="Nombre de threads torch sur CPU (par défaut : cœurs physiques)")
+    parser.add_argument("--batch_size", type=int, default=8, help="Nombre de segments par appel à generate")
+    parser.add_argument("--limit", type=int, default=None, help="Nombre maximal de segments évalués")
+    parser.add_argument("--output_json", type=str, default=OUTPUT_JSON, help="Fichier JSON des résultats")
+    args = parser.parse_args()
+
+    if "fp32" not in args.backends:
+        args.backends.insert(0, "fp32")  # Référence nécessaire pour mesurer l'écart
+
+    rows = load_test_set(args.csv, args.audio_dir, args.limit)
+    results = compare_backends(args.model_dir, rows, args.backends, args.num_threads, args.batch_size)
+    with open(args.output_json, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nRésultats sauvegardés dans : {args.output_json}")
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Index du corpus audio : empreintes des enregistrements, détection des
+doublons et liste d'exclusion, partagés par `vad_pyannote.py` et `pre-process.py`.
+
+Nos enregistrements existent en plusieurs copies dans différents répertoires
+de projet. Pour chaque fichier, l'index conserve :
+- `sha1` : empreinte du signal PCM décodé (identique pour un WAV et sa copie
+  FLAC, ou un fichier renommé ou déplacé)
+- `fingerprint` : empreinte perceptive des premières minutes, qui résiste au
+  rééchantillonnage, au réencodage et aux changements de gain. Le signal est
+  ramené à 8 kHz mono. Chaque trame de 0,1 s donne 32 bits : le signe de la
+  variation, dans le temps, de la différence d'énergie entre deux bandes de
+  fréquence voisines (33 bandes logarithmiques entre 300 et 3000 Hz). Deux
+  fichiers de même durée sont des doublons si moins de `MAX_BIT_ERROR_RATE`
+  de leurs bits diffèrent, au meilleur décalage de quelques trames.
+
+L'index est un fichier JSON réutilisé d'une exécution à l'autre (et d'un
+répertoire de projet à l'autre) : un fichier dont la taille et la date n'ont
+pas changé n'est pas relu. Les doublons sont écartés avant toute étape
+coûteuse (VAD, découpage). Le premier fichier d'un groupe de doublons (dans
+l'ordre de parcours) est conservé.
+
+Liste d'exclusion : motifs de noms de fichiers (locuteurs réservés au test),
+sous-chaînes ou motifs `fnmatch` (`*`, `?`, `[...]`), un par ligne dans un
+fichier texte (`#` pour les commentaires). Une copie d'un fichier exclu,
+même renommée ou réencodée, est exclue elle aussi : l'audio de test ne peut
+pas fuir dans le pré-entraînement.
+
+Utilisation autonome (liste des doublons d'un corpus) :
+    python corpus_index.py wav/ autre_projet/wav/ --index corpus_index.json
+
+Auteur : Daphne Teixeira
+"""
+
+import argparse
+import base64
+import bisect
+import fnmatch
+import hashlib
+import json
+import multiprocessing
+import os
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+from instrumentation import stage
+
+# === PARAMÈTRES ===
+INDEX_VERSION = 1
+EXCLUDED_SPEAKERS = ('Emilie_K', 'Fabiano')  # Locuteurs réservés au test (liste par défaut de pre-process.py)
+AUDIO_EXTENSIONS = ('.wav', '.flac')
+BLOCK_DURATION = 5           # Lecture par blocs (secondes)
+FINGERPRINT_RATE = 8000      # Fréquence du signal servant à l'empreinte perceptive
+FINGERPRINT_SECONDS = 400    # Durée prise en compte au début de chaque fichier
+FRAME_SIZE = 2048            # Trame d'analyse (0,256 s)
+HOP_SIZE = 800               # Pas entre trames (0,1 s)
+BANDS = np.geomspace(300, 3000, 34)  # 33 bandes -> 32 bits par trame
+SILENCE_DB = -60.0           # Trames plus faibles ignorées à la comparaison
+MAX_BIT_ERROR_RATE = 0.35    # Au-delà, deux empreintes sont considérées comme différentes
+MAX_OFFSET = 3               # Décalage maximal testé entre deux empreintes (trames)
+MIN_FRAMES = 50              # Trames non silencieuses communes requises (5 s)
+DURATION_TOLERANCE = 0.01    # Écart de durée relatif admis entre deux doublons (au moins 1 s)
+
+
+# === EXCLUSIONS ===
+def load_exclusions(path):
+    """Lit une liste de motifs d'exclusion (un par ligne, `#` pour les commentaires)"""
+    with open(path, encoding='utf-8') as f:
+        lines = (line.split('#', 1)[0].strip() for line in f)
+        return tuple(line for line in lines if line)
+
+def is_excluded(filename, patterns=EXCLUDED_SPEAKERS):
+    """Indique si un nom de fichier correspond à l'un des motifs (sous-chaîne ou motif fnmatch)"""
+    for pattern in patterns:
+        if any(char in pattern for char in '*?['):
+            if fnmatch.fnmatch(filename, pattern):
+                return True
+        elif pattern in filename:
+            return True
+    return False
+
+
+# === EMPREINTES ===
+def _band_matrix():
+    """Matrice (bins FFT -> bandes) pour les énergies par bande"""
+    frequencies = np.fft.rfftfreq(FRAME_SIZE, 1 / FINGERPRINT_RATE)
+    matrix = np.zeros((len(frequencies), len(BANDS) - 1), dtype=np.float32)
+    for band, (low, high) in enumerate(zip(BANDS[:-1], BANDS[1:])):
+        matrix[(frequencies >= low) & (frequencies < high), band] = 1.0
+    return matrix
+
+def perceptual_fingerprint(audio):
+    """
+    Empreinte perceptive d'un signal mono à `FINGERPRINT_RATE` : renvoie
+    (bits uint32 par trame, masque des trames non silencieuses).
+    """
+    if len(audio) < FRAME_SIZE + HOP_SIZE:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=bool)
+    frames = np.lib.stride_tricks.sliding_window_view(audio, FRAME_SIZE)[::HOP_SIZE]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE).astype(np.float32), axis=1)) ** 2
+    energy = spectrum.astype(np.float32) @ _band_matrix()
+    log_energy = np.log(energy + 1e-10)
+
+    # Bit (n, m) : signe de [E(n, m) - E(n, m+1)] - [E(n-1, m) - E(n-1, m+1)]
+    difference = log_energy[:, :-1] - log_energy[:, 1:]
+    bits = (difference[1:] - difference[:-1]) > 0
+    words = np.packbits(bits, axis=1, bitorder='little').view('<u4')[:, 0]
+
+    power = np.mean(frames[1:] ** 2, axis=1)
+    valid = 10 * np.log10(power + 1e-12) > SILENCE_DB
+    return words, valid
+
+def fingerprint_file(path):
+    """
+    Décode un fichier une seule fois, par blocs, et renvoie ses empreintes :
+    {'sha1', 'duration', 'fingerprint', 'valid'} (None si le fichier est illisible).
+    """
+    try:
+        with stage('fingerprint'):
+            info = sf.info(path)
+            digest = hashlib.sha1(f"{info.samplerate}:{info.channels}:".encode())
+            resampler = soxr.ResampleStream(info.samplerate, FINGERPRINT_RATE, 1, dtype='float32')
+            limit = FINGERPRINT_SECONDS * info.samplerate
+            read = 0
+            pieces = []
+            for block in sf.blocks(path, blocksize=BLOCK_DURATION * info.samplerate, dtype='int16', always_2d=True):
+                digest.update(np.ascontiguousarray(block).tobytes())
+                if read < limit:
+                    mono = block[:limit - read].mean(axis=1, dtype=np.float32) / 32768.0
+                    pieces.append(resampler.resample_chunk(mono, last=False))
+                    read += len(block)
+            pieces.append(resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+            words, valid = perceptual_fingerprint(np.concatenate(pieces))
+    except Exception as e:
+        print(f"Empreinte impossible pour {os.path.basename(path)} : {e}")
+        return None
+    return {
+        'sha1': digest.hexdigest(),
+        'duration': info.frames / info.samplerate,
+        'fingerprint': base64.b64encode(words.astype('<u4').tobytes()).decode('ascii'),
+        'valid': base64.b64encode(np.packbits(valid).tobytes()).decode('ascii'),
+        'frames': len(words),
+    }
+
+def _decode_fingerprint(entry):
+    words = np.frombuffer(base64.b64decode(entry['fingerprint']), dtype='<u4')
+    valid = np.unpackbits(np.frombuffer(base64.b64decode(entry['valid']), dtype=np.uint8))[:entry['frames']]
+    return words, valid.astype(bool)
+
+def bit_error_rate(first, second, max_offset=MAX_OFFSET, min_frames=MIN_FRAMES):
+    """
+    Taux de bits différents entre deux empreintes (bits, masque), au meilleur
+    décalage ; 1.0 si elles ont trop peu de trames non silencieuses en commun.
+    """
+    (words_a, valid_a), (words_b, valid_b) = first, second
+    # Les fichiers courts sont comparés sur toutes leurs trames non silencieuses
+    required = min(min_frames, int(0.8 * min(valid_a.sum(), valid_b.sum())))
+    best = 1.0
+    for offset in range(-max_offset, max_offset + 1):
+        a = slice(max(offset, 0), None)
+        b = slice(max(-offset, 0), None)
+        length = min(len(words_a[a]), len(words_b[b]))
+        mask = valid_a[a][:length] & valid_b[b][:length]
+        count = int(mask.sum())
+        if count == 0 or count < required:
+            continue
+        differences = np.bitwise_xor(words_a[a][:length][mask], words_b[b][:length][mask])
+        errors = int(np.unpackbits(differences.view(np.uint8)).sum())
+        best = min(best, errors / (32 * count))
+    return best
+
+
+# === INDEX ===
+class CorpusIndex:
+    """
+    Empreintes des fichiers audio, conservées dans un fichier JSON.
+
+    Utilisation type :
+        index = CorpusIndex('corpus_index.json')
+        index.update(paths, workers=8)                  # empreintes des fichiers nouveaux ou modifiés
+        skipped = index.find_duplicates(paths, patterns)
+        index.save()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # Chemin absolu -> empreintes, taille et date
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == INDEX_VERSION:
+                self.entries = data.get('entries', {})
+
+    def entry(self, path):
+        """Empreintes à jour de `path`, ou None (fichier nouveau, modifié ou illisible)"""
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is None:
+            return None
+        stat = os.stat(path)
+        if stat.st_size != entry['size'] or stat.st_mtime_ns != entry['mtime_ns']:
+            return None
+        return entry
+
+    def update(self, paths, workers=1):
+        """Calcule les empreintes des fichiers nouveaux ou modifiés ; renvoie leur nombre"""
+        missing = [path for path in dict.fromkeys(paths) if self.entry(path) is None]
+        if workers > 1 and len(missing) > 1:
+            with multiprocessing.Pool(processes=workers) as pool:
+                results = pool.map(fingerprint_file, missing, chunksize=1)
+        else:
+            results = map(fingerprint_file, missing)
+        for path, result in zip(missing, results):
+            if result is None:
+                continue
+            stat = os.stat(path)
+            result.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            self.entries[os.path.abspath(path)] = result
+        return len(missing)
+
+    def prune(self):
+        """Retire les entrées dont le fichier a disparu ; renvoie leur nombre"""
+        missing = [path for path in self.entries if not os.path.exists(path)]
+        for path in missing:
+            del self.entries[path]
+        return len(missing)
+
+    def find_duplicates(self, paths, patterns=()):
+        """
+        Fichiers de `paths` à écarter, sous la forme {chemin: (raison, fichier lié)} :
+        - ('excluded', None) : nom correspondant à la liste d'exclusion
+        - ('excluded', original) : copie d'un fichier exclu
+        - ('duplicate', original) : copie d'un fichier conservé (le premier du groupe)
+        """
+        paths = list(dict.fromkeys(paths))
+        parent = list(range(len(paths)))
+
+        def root(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        # Comparaisons limitées aux fichiers de durée voisine (liste triée par durée)
+        by_sha1 = {}
+        durations = []  # (durée, indice), triée
+        fingerprints = {}
+        for i, path in enumerate(paths):
+            entry = self.entry(path)
+            if entry is None:
+                continue
+            if entry['sha1'] in by_sha1:
+                parent[root(i)] = root(by_sha1[entry['sha1']])
+                continue
+            by_sha1[entry['sha1']] = i
+            duration = entry['duration']
+            tolerance = max(1.0, DURATION_TOLERANCE * duration)
+            fingerprints[i] = _decode_fingerprint(entry)
+            start = bisect.bisect_left(durations, (duration - tolerance, -1))
+            for other_duration, j in durations[start:]:
+                if other_duration > duration + tolerance:
+                    break
+                if root(i) != root(j) and bit_error_rate(fingerprints[i], fingerprints[j]) <= MAX_BIT_ERROR_RATE:
+                    parent[root(i)] = root(j)
+            bisect.insort(durations, (duration, i))
+
+        groups = {}
+        for i in range(len(paths)):
+            groups.setdefault(root(i), []).append(paths[i])
+
+        skipped = {}
+        for members in groups.values():
+            excluded = [path for path in members if is_excluded(os.path.basename(path), patterns)]
+            for path in members:
+                if excluded:
+                    skipped[path] = ('excluded', None if path in excluded else excluded[0])
+                elif path != members[0]:
+                    skipped[path] = ('duplicate', members[0])
+        return skipped
+
+    def save(self):
+        """Écrit l'index de façon atomique (fichier temporaire puis renommage)"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'entries': self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def filter_corpus(paths, index_path=None, patterns=(), workers=1):
+    """
+    Écarte les fichiers exclus et, avec un index, les doublons. Renvoie
+    (fichiers conservés, {chemin écarté: (raison, fichier lié)}), dans l'ordre de `paths`.
+    Sans index, seuls les noms sont comparés à la liste d'exclusion.
+    """
+    if index_path is None:
+        skipped = {path: ('excluded', None) for path in paths if is_excluded(os.path.basename(path), patterns)}
+    else:
+        index = CorpusIndex(index_path)
+        computed = index.update(paths, workers)
+        index.prune()
+        index.save()
+        if computed:
+            print(f"Index du corpus : {computed} empreintes calculées ({index_path})")
+        skipped = index.find_duplicates(paths, patterns)
+    return [path for path in paths if path not in skipped], skipped
+
+def collect_audio_files(directories):
+    """Fichiers audio (WAV, FLAC) des répertoires, parcourus récursivement dans un ordre stable"""
+    files = []
+    for directory in directories:
+        for root, dirs, filenames in os.walk(directory):
+            dirs.sort()
+            files.extend(os.path.join(root, f) for f in sorted(filenames) if f.lower().endswith(AUDIO_EXTENSIONS))
+    return files
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index d'empreintes du corpus : doublons et fichiers exclus")
+    parser.add_argument("directories", nargs="+", help="Répertoires à indexer (parcourus récursivement)")
+    parser.add_argument("--index", type=str, default="corpus_index.json", help="Fichier d'index (réutilisé)")
+    parser.add_argument("--exclude_list", type=str, default=None,
+                        help="Fichier de motifs d'exclusion (par défaut : " + ", ".join(EXCLUDED_SPEAKERS) + ")")
+    parser.add_argument("--exclude", action="append", default=[], help="Motif d'exclusion supplémentaire")
+    parser.add_argument("--workers", type=int, default=1, help="Nombre de processus pour le calcul des empreintes")
+    args = parser.parse_args()
+
+    patterns = (load_exclusions(args.exclude_list) if args.exclude_list else EXCLUDED_SPEAKERS) + tuple(args.exclude)
+    files = collect_audio_files(args.directories)
+    kept, skipped = filter_corpus(files, args.index, patterns, args.workers)
+    for path, (reason, original) in skipped.items():
+        print(f"[{'doublon' if reason == 'duplicate' else 'exclu'}] {path}" + (f"  <-  {original}" if original else ""))
+    print(f"{len(files)} fichiers, {len(kept)} conservés, "
+          f"{sum(reason == 'duplicate' for reason, _ in skipped.values())} doublons, "
+          f"{sum(reason == 'excluded' for reason, _ in skipped.values())} exclus")
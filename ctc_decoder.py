@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+"""
+Décodage des sorties CTC (wav2vec2) : recherche en faisceau sur les préfixes
+(prefix beam search) avec fusion d'un modèle de langue n-gramme de caractères
+Kriol. C'est la première passe dont les sorties (colonne `input`) sont
+ensuite corrigées par Gervasio (`gervasio_infer.py`).
+
+- Modèle de langue : n-grammes de caractères (ordre 6 par défaut, lissage par
+  décompte absolu interpolé), appris sur les transcriptions normalisées par
+  `simple_normalization.py`. Il tient dans un petit `.npz` compressé.
+- Décodage : à chaque trame, seuls les caractères assez probables
+  (`token_min_logp`) sont envisagés. Les extensions de tous les préfixes par
+  tous ces caractères, blancs et répétitions compris, sont calculées d'un
+  bloc avec NumPy, score du modèle de langue inclus (`alpha` × log-proba +
+  `beta` par caractère). Les trames dominées par le blanc ne coûtent qu'une
+  opération vectorisée.
+- Lots : les fichiers sont répartis sur un pool de processus, et le modèle de
+  langue est chargé une fois par worker.
+
+Entrées : tableaux `.npy` de logits ou log-probabilités (trames × vocabulaire)
+avec le `vocab.json` du tokenizer CTC, ou fichiers WAV avec `--model_dir`
+(un `Wav2Vec2ForCTC` fine-tuné).
+
+Exemples :
+    python ctc_decoder.py lm --input whisper_kriol_cm_normalized.csv --column text --output kriol_lm.npz
+    python ctc_decoder.py decode logits/ --vocab vocab.json --lm kriol_lm.npz --output first_pass.tsv --workers 8
+    python gervasio_infer.py first_pass.tsv --column input
+
+Auteur : Daphne Teixeira
+"""
+
+import argparse
+import collections
+import csv
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from simple_normalization import PUNCTUATION, normalize_text
+
+# === PARAMÈTRES ===
+ORDER = 6               # Ordre du modèle de langue (caractères)
+DISCOUNT = 0.75         # Décompte absolu du lissage
+BEAM_WIDTH = 32         # Préfixes conservés à chaque trame
+ALPHA = 0.5             # Poids du modèle de langue
+BETA = 1.0              # Bonus par caractère émis (compense la pénalité de longueur du modèle de langue)
+TOKEN_MIN_LOGP = -8.0   # Caractères moins probables ignorés à chaque trame
+BEAM_PRUNE = 20.0       # Extensions à plus de BEAM_PRUNE du meilleur score abandonnées
+UNK_LOGPROB = -10.0     # Log-proba d'un caractère absent du corpus du modèle de langue
+CACHE_SIZE = 100000     # Contextes gardés en cache (probabilités du modèle de langue)
+BLANK_TOKEN = "<pad>"   # Blanc CTC des tokenizers wav2vec2
+WORD_DELIMITER = "|"    # Séparateur de mots du vocabulaire CTC
+SAMPLE_RATE = 16000
+
+
+def lm_text(text):
+    """Texte d'apprentissage du modèle de langue : normalisé, sans la ponctuation isolée"""
+    return " ".join(word for word in normalize_text(text).split() if word not in PUNCTUATION)
+
+
+def log_softmax(logits):
+    """Log-probabilités par trame (sans effet sur des log-probabilités déjà normalisées)"""
+    logits = np.asarray(logits, dtype=np.float32)
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
+
+
+# === MODÈLE DE LANGUE ===
+class CharNgramLM:
+    """
+    Modèle de langue n-gramme de caractères. Les symboles sont les
+    caractères de `alphabet`, suivis de la fin de phrase (`eos`) ; le début de
+    phrase (`bos`) n'apparaît que dans les contextes.
+
+    P(c | h) = max(n(h, c) - D, 0) / n(h) + D × N(h) / n(h) × P(c | h')
+    où h' est h sans son premier caractère et N(h) le nombre de symboles
+    distincts vus après h ; l'ordre 0 est uniforme.
+    """
+
+    def __init__(self, alphabet, counts, discount=DISCOUNT, cache_size=CACHE_SIZE):
+        self.alphabet = list(alphabet)
+        self.symbols = {char: index for index, char in enumerate(self.alphabet)}
+        self.eos = len(self.alphabet)
+        self.bos = self.eos + 1
+        self.counts = counts  # counts[n] : contexte (tuple de n symboles) -> comptes des symboles suivants
+        self.order = len(counts)
+        self.discount = discount
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()  # Contexte -> log-probabilités
+
+    @classmethod
+    def build(cls, texts, order=ORDER, discount=DISCOUNT):
+        """Apprend le modèle sur des textes (déjà passés par `lm_text`)"""
+        texts = [text for text in texts if text]
+        alphabet = sorted({char for text in texts for char in text})
+        symbols = {char: index for index, char in enumerate(alphabet)}
+        eos, bos = len(alphabet), len(alphabet) + 1
+        counts = [collections.defaultdict(lambda: np.zeros(eos + 1, dtype=np.uint32)) for _ in range(order)]
+        for text in texts:
+            sequence = [bos] * (order - 1) + [symbols[char] for char in text] + [eos]
+            for position in range(order - 1, len(sequence)):
+                for n in range(order):
+                    context = tuple(sequence[position - n:position])
+                    if n > 1 and context[0] == bos and context[1] == bos:
+                        continue  # Contexte de début déjà compté à un ordre inférieur
+                    counts[n][context][sequence[position]] += 1
+        return cls(alphabet, [dict(table) for table in counts], discount)
+
+    def save(self, path):
+        arrays = {"alphabet": np.array(json.dumps(self.alphabet, ensure_ascii=False)),
+                  "discount": np.array(self.discount)}
+        for n, table in enumerate(self.counts):
+            contexts = list(table)
+            arrays[f"contexts_{n}"] = np.array(contexts, dtype=np.int32).reshape(len(contexts), n)
+            arrays[f"counts_{n}"] = np.stack([table[context] for context in contexts]) if contexts \
+                else np.zeros((0, self.eos + 1), dtype=np.uint32)
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            alphabet = json.loads(str(data["alphabet"]))
+            order = sum(1 for key in data.files if key.startswith("contexts_"))
+            counts = [dict(zip(map(tuple, data[f"contexts_{n}"].tolist()), data[f"counts_{n}"]))
+                      for n in range(order)]
+            return cls(alphabet, counts, float(data["discount"]))
+
+    def context(self, symbols):
+        """Contexte (order - 1 derniers symboles, complété par `bos`) d'une suite de symboles"""
+        context = tuple(symbols[-(self.order - 1):]) if self.order > 1 else ()
+        return (self.bos,) * (self.order - 1 - len(context)) + context
+
+    def log_probs(self, context):
+        """Log-probabilités de tous les symboles (caractères puis `eos`) après `context`"""
+        # Contexte raccourci tant qu'il commence par `bos` répété (comptes stockés à l'ordre minimal)
+        while len(context) > 1 and context[0] == self.bos and context[1] == self.bos:
+            context = context[1:]
+        cached = self._cache.get(context)
+        if cached is not None:
+            self._cache.move_to_end(context)
+            return cached
+        # L'ordre inférieur passe lui aussi par le cache : il est partagé par de nombreux contextes
+        if context:
+            lower = np.exp(self.log_probs(context[1:]), dtype=np.float64)
+        else:
+            lower = np.full(self.eos + 1, 1.0 / (self.eos + 1))
+        counts = self.counts[len(context)].get(context)
+        if counts is None:
+            probabilities = lower
+        else:
+            probabilities = (np.maximum(counts - self.discount, 0)
+                             + self.discount * np.count_nonzero(counts) * lower) / counts.sum()
+        result = np.log(probabilities).astype(np.float32)
+        self._cache[context] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def score(self, text):
+        """Log-probabilité d'un texte (fin de phrase comprise)"""
+        symbols = [self.symbols.get(char) for char in text]
+        total = 0.0
+        history = []
+        for symbol in symbols + [self.eos]:
+            log_probs = self.log_probs(self.context(history))
+            total += UNK_LOGPROB if symbol is None else float(log_probs[symbol])
+            if symbol is not None:
+                history.append(symbol)
+        return total
+
+
+# === DÉCODEUR ===
+def load_vocab(path):
+    """Vocabulaire d'un tokenizer CTC (`vocab.json` : token -> identifiant), sous forme de liste"""
+    with open(path, encoding="utf-8") as f:
+        vocab = json.load(f)
+    tokens = [None] * (max(vocab.values()) + 1)
+    for token, index in vocab.items():
+        tokens[index] = token
+    return tokens
+
+
+class CTCDecoder:
+    """Décodeur CTC glouton ou par faisceau, avec fusion optionnelle d'un `CharNgramLM`"""
+
+    def __init__(self, vocab, lm=None, alpha=ALPHA, beta=BETA, beam_width=BEAM_WIDTH,
+                 token_min_logp=TOKEN_MIN_LOGP, beam_prune=BEAM_PRUNE, blank_token=BLANK_TOKEN,
+                 word_delimiter=WORD_DELIMITER):
+        self.vocab = list(vocab)
+        self.blank = self.vocab.index(blank_token) if blank_token in self.vocab else 0
+        self.chars = [" " if token == word_delimiter else (token or "") for token in self.vocab]
+        # Tokens émissibles : un caractère ou le séparateur (pas de blanc ni de <unk>, <s>, </s>...)
+        self.emittable = np.array([index for index, char in enumerate(self.chars)
+                                   if index != self.blank and len(char) == 1])
+        self.lm = lm
+        self.alpha = alpha
+        self.beta = beta if lm is not None else 0.0
+        self.beam_width = beam_width
+        self.token_min_logp = token_min_logp
+        self.beam_prune = beam_prune
+        if lm is not None:
+            # Identifiant CTC -> symbole du modèle de langue (-1 : caractère inconnu du modèle)
+            self.lm_symbols = np.array([lm.symbols.get(char, -1) for char in self.chars])
+            self._scores = collections.OrderedDict()  # Contexte -> scores de fusion par token
+
+    def text(self, ids):
+        return " ".join("".join(self.chars[index] for index in ids).split())
+
+    def greedy(self, log_probs):
+        """Décodage glouton : argmax par trame, fusion des répétitions, suppression des blancs"""
+        best = np.asarray(log_probs).argmax(axis=-1)
+        keep = np.ones(len(best), dtype=bool)
+        keep[1:] = best[1:] != best[:-1]
+        return self.text(int(index) for index in best[keep & (best != self.blank)])
+
+    def _lm_context(self, prefix):
+        symbols = [int(self.lm_symbols[index]) for index in prefix[-(self.lm.order - 1):]] if self.lm.order > 1 else []
+        # Un caractère inconnu du modèle de langue coupe l'historique
+        if -1 in symbols:
+            symbols = symbols[len(symbols) - symbols[::-1].index(-1):]
+        return self.lm.context(symbols)
+
+    def _fusion_scores(self, prefix):
+        """alpha × log P_LM(token | préfixe) + beta, pour chaque token CTC, et le score de fin de phrase"""
+        context = self._lm_context(prefix)
+        cached = self._scores.get(context)
+        if cached is not None:
+            self._scores.move_to_end(context)
+            return cached
+        log_probs = self.lm.log_probs(context)
+        scores = np.where(self.lm_symbols >= 0, log_probs[self.lm_symbols], UNK_LOGPROB)
+        cached = (self.alpha * scores + self.beta, self.alpha * float(log_probs[self.lm.eos]))
+        self._scores[context] = cached
+        while len(self._scores) > CACHE_SIZE:
+            self._scores.popitem(last=False)
+        return cached
+
+    def decode(self, logits):
+        """Recherche en faisceau sur les préfixes ; renvoie le meilleur texte"""
+        log_probs = log_softmax(logits)
+        beams = [()]                    # Préfixes (identifiants CTC, répétitions fusionnées)
+        p_blank = np.zeros(1)           # log P(préfixe, dernière trame = blanc)
+        p_char = np.full(1, -np.inf)    # log P(préfixe, dernière trame = dernier caractère)
+        fusion = np.zeros(1)            # Score cumulé du modèle de langue et des bonus
+        last = np.full(1, -1)           # Dernier caractère de chaque préfixe (-1 : préfixe vide)
+        prefix_scores = {}              # Préfixe -> scores de fusion (un préfixe survit sur plusieurs trames)
+
+        def fusion_scores(prefix):
+            scores = prefix_scores.get(prefix)
+            if scores is None:
+                scores = prefix_scores[prefix] = self._fusion_scores(prefix)
+            return scores
+
+        for row in log_probs:
+            total = np.logaddexp(p_blank, p_char)
+            # Sans nouveau caractère : blanc, ou répétition fusionnée du dernier caractère
+            stay_blank = total + row[self.blank]
+            stay_char = np.where(last >= 0, p_char + row[last], -np.inf)
+
+            candidates = self.emittable[row[self.emittable] >= self.token_min_logp]
+            if len(candidates) == 0:
+                # Trame dominée par le blanc : aucun préfixe ne change
+                p_blank, p_char = stay_blank, stay_char
+                continue
+
+            # Extensions de tous les préfixes par tous les candidats : un caractère répété
+            # n'est un nouveau caractère qu'après un blanc
+            repeat = candidates[None, :] == last[:, None]
+            extend = np.where(repeat, p_blank[:, None], total[:, None]) + row[candidates][None, :]
+            if self.lm is not None:
+                extend_fusion = fusion[:, None] + np.stack([fusion_scores(prefix)[0][candidates]
+                                                            for prefix in beams])
+            else:
+                extend_fusion = np.broadcast_to(fusion[:, None], extend.shape)
+            stay_scores = np.logaddexp(stay_blank, stay_char) + fusion
+            extend_scores = extend + extend_fusion
+
+            # Élagage vectorisé : seuil relatif au meilleur score, puis les beam_width meilleures extensions
+            best = max(stay_scores.max(), extend_scores.max())
+            flat = np.flatnonzero(extend_scores.ravel() >= best - self.beam_prune)
+            if len(flat) > self.beam_width:
+                flat = flat[np.argpartition(-extend_scores.ravel()[flat], self.beam_width)[:self.beam_width]]
+
+            # Fusion des préfixes identiques (extension d'un préfixe = préfixe déjà présent)
+            merged = {prefix: [stay_blank[k], stay_char[k], fusion[k]] for k, prefix in enumerate(beams)}
+            for k, c in zip(*np.unravel_index(flat, extend.shape)):
+                prefix = beams[k] + (int(candidates[c]),)
+                entry = merged.get(prefix)
+                if entry is None:
+                    merged[prefix] = [-np.inf, extend[k, c], extend_fusion[k, c]]
+                else:
+                    entry[1] = np.logaddexp(entry[1], extend[k, c])
+
+            beams = list(merged)
+            states = np.array(list(merged.values()), dtype=np.float64)
+            scores = np.logaddexp(states[:, 0], states[:, 1]) + states[:, 2]
+            if len(beams) > self.beam_width:
+                keep = np.argpartition(-scores, self.beam_width)[:self.beam_width]
+                beams = [beams[k] for k in keep]
+                states = states[keep]
+            p_blank, p_char, fusion = states[:, 0], states[:, 1], states[:, 2]
+            last = np.array([prefix[-1] if prefix else -1 for prefix in beams])
+
+        scores = np.logaddexp(p_blank, p_char) + fusion
+        if self.lm is not None:
+            scores = scores + np.array([fusion_scores(prefix)[1] for prefix in beams])
+        return self.text(beams[int(np.argmax(scores))])
+
+
+# === DÉCODAGE PAR LOTS ===
+# Le décodeur est construit une seule fois par worker (voir init_worker)
+_decoder = None
+
+def build_decoder(vocab, lm_path=None, greedy=False, **params):
+    lm = CharNgramLM.load(lm_path) if lm_path and not greedy else None
+    return CTCDecoder(vocab, lm, **params), greedy
+
+def init_worker(vocab, lm_path, greedy, params):
+    global _decoder
+    _decoder = build_decoder(vocab, lm_path, greedy, **params)
+
+def _decode_task(item):
+    """Décode un fichier `.npy` ou un tableau déjà calculé : renvoie (nom, texte)"""
+    name, logits = item
+    if isinstance(logits, str):
+        logits = np.load(logits)
+    decoder, greedy = _decoder
+    return name, decoder.greedy(logits) if greedy else decoder.decode(logits)
+
+def collect_inputs(inputs):
+    """Développe les entrées (fichiers, répertoires) en une liste de fichiers `.npy` ou WAV"""
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, filenames in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, f) for f in sorted(filenames) if f.lower().endswith((".npy", ".wav")))
+        else:
+            files.append(path)
+    return files
+
+def ctc_log_probs(paths, model_dir, device=None):
+    """Génère (chemin, log-probabilités) pour des fichiers WAV, avec un `Wav2Vec2ForCTC` fine-tuné"""
+    import torch
+    from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
+
+    from audio_stream import load_audio
+
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    processor = Wav2Vec2Processor.from_pretrained(model_dir)
+    model = Wav2Vec2ForCTC.from_pretrained(model_dir).to(device).eval()
+    for path in paths:
+        audio, _ = load_audio(path, SAMPLE_RATE)
+        inputs = processor(audio, sampling_rate=SAMPLE_RATE, return_tensors="pt")
+        with torch.no_grad():
+            logits = model(inputs.input_values.to(device)).logits[0]
+        yield path, torch.log_softmax(logits.float(), dim=-1).cpu().numpy()
+
+def decode_files(items, vocab, lm_path=None, greedy=False, workers=1, **params):
+    """
+    Décode des couples (nom, fichier `.npy` ou tableau de logits) et génère
+    (nom, texte) dans l'ordre des entrées, sur `workers` processus.
+    """
+    if workers <= 1:
+        init_worker(vocab, lm_path, greedy, params)
+        yield from map(_decode_task, items)
+        return
+    with multiprocessing.Pool(processes=workers, initializer=init_worker,
+                              initargs=(vocab, lm_path, greedy, params)) as pool:
+        yield from pool.imap(_decode_task, items, chunksize=1)
+
+def build_lm(input_path, output_path, column="text", order=ORDER, discount=DISCOUNT):
+    """Apprend le modèle de langue sur une colonne de transcriptions (CSV ou TSV) et l'écrit en `.npz`"""
+    delimiter = "\t" if input_path.lower().endswith(".tsv") else ","
+    with open(input_path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f, delimiter=delimiter)
+        if column not in reader.fieldnames:
+            raise ValueError(f"Colonne {column} absente de {input_path} (colonnes : {', '.join(reader.fieldnames)})")
+        texts = [lm_text(row[column] or "") for row in reader]
+    lm = CharNgramLM.build(texts, order, discount)
+    lm.save(output_path)
+    contexts = sum(len(table) for table in lm.counts)
+    print(f"Modèle de langue (ordre {order}, {len(lm.alphabet)} caractères, {contexts} contextes) "
+          f"sauvegardé dans : {output_path}")
+    return lm
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Décodage CTC par faisceau avec un modèle de langue n-gramme Kriol")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    lm_parser = commands.add_parser("lm", help="Apprend le modèle de langue sur des transcriptions")
+    lm_parser.add_argument("--input", type=str, required=True, help="CSV ou TSV de transcriptions")
+    lm_parser.add_argument("--column", type=str, default="text", help="Colonne des transcriptions")
+    lm_parser.add_argument("--output", type=str, default="kriol_lm.npz", help="Modèle de langue (.npz)")
+    lm_parser.add_argument("--order", type=int, default=ORDER, help="Ordre des n-grammes de caractères")
+    lm_parser.add_argument("--discount", type=float, default=DISCOUNT, help="Décompte absolu du lissage")
+
+    decode_parser = commands.add_parser("decode", help="Décode des logits CTC (.npy) ou des fichiers WAV")
+    decode_parser.add_argument("inputs", nargs="+", help="Fichiers .npy / .wav ou répertoires")
+    decode_parser.add_argument("--vocab", type=str, default=None,
+                               help="vocab.json du tokenizer CTC (par défaut : celui de --model_dir)")
+    decode_parser.add_argument("--model_dir", type=str, default=None,
+                               help="Wav2Vec2ForCTC fine-tuné, pour décoder directement des fichiers WAV")
+    decode_parser.add_argument("--lm", type=str, default=None, help="Modèle de langue (.npz) ; sans : faisceau seul")
+    decode_parser.add_argument("--output", type=str, default="first_pass.tsv",
+                               help="TSV de sortie (colonnes file, input), lisible par gervasio_infer.py")
+    decode_parser.add_argument("--greedy", action="store_true", help="Décodage glouton (argmax), sans faisceau")
+    decode_parser.add_argument("--beam_width", type=int, default=BEAM_WIDTH, help="Préfixes conservés par trame")
+    decode_parser.add_argument("--alpha", type=float, default=ALPHA, help="Poids du modèle de langue")
+    decode_parser.add_argument("--beta", type=float, default=BETA, help="Bonus par caractère émis")
+    decode_parser.add_argument("--token_min_logp", type=float, default=TOKEN_MIN_LOGP,
+                               help="Log-proba minimale d'un caractère envisagé à chaque trame")
+    decode_parser.add_argument("--workers", type=int, default=1, help="Nombre de processus de décodage")
+    args = parser.parse_args()
+
+    if args.command == "lm":
+        build_lm(args.input, args.output, args.column, args.order, args.discount)
+    else:
+        vocab_path = args.vocab or (os.path.join(args.model_dir, "vocab.json") if args.model_dir else None)
+        if vocab_path is None:
+            parser.error("--vocab ou --model_dir est requis")
+        files = collect_inputs(args.inputs)
+        wav_files = [path for path in files if path.lower().endswith(".wav")]
+        if wav_files and len(wav_files) != len(files):
+            parser.error("Entrées mélangées : décodez séparément les .npy et les .wav")
+        if wav_files:
+            if args.model_dir is None:
+                parser.error("--model_dir est requis pour décoder des fichiers WAV")
+            # Inférence au fil de l'eau dans le processus principal, décodage en parallèle dans le pool
+            items = ctc_log_probs(wav_files, args.model_dir)
+        else:
+            items = [(path, path) for path in files]
+
+        with open(args.output, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(["file", "input"])
+            count = 0
+            for name, text in decode_files(items, load_vocab(vocab_path), args.lm, args.greedy, args.workers,
+                                           alpha=args.alpha, beta=args.beta, beam_width=args.beam_width,
+                                           token_min_logp=args.token_min_logp):
+                writer.writerow([os.path.basename(name), text])
+                count += 1
+        print(f"{count} fichiers décodés, transcriptions sauvegardées dans : {args.output}")
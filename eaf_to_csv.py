@@ -5,30 +5,110 @@ Chaque ligne contient : chemin vers l'audio, temps de début, temps de fin, tran
 
 Ce script est à modifier pour changer le tag dialectal à 'GB' pour les corpus correspondants.
 
+Mode répertoire (`--eaf_dir`) : tous les fichiers .eaf d'un corpus sont lus en
+parallèle et les segments annotés sont directement découpés dans l'audio :
+- le WAV associé (média lié dans l'EAF, ou même nom que l'EAF) est ouvert une
+  seule fois, et seuls les intervalles annotés sont lus (lecture par `seek`)
+- chaque segment est converti en mono et rééchantillonné à 16 kHz
+- les annotations qui se chevauchent entre tiers (doublons, traductions
+  alignées) sont dédoublonnées : la première tier est conservée (le mode
+  fichier unique, lui, écrit toujours toutes les annotations de toutes les tiers)
+- la variété est lue dans `--dialect_map` (ex. `Casamance=CM`), déduite du
+  chemin (dossier ou nom contenant `CM` / `GB`), ou vaut `--dialect`
+- sortie : un WAV par segment et un manifeste `segments.csv`, ou des shards
+  Arrow (`--output_format arrow`) chargeables avec `datasets.load_from_disk`
+
+Exemple :
+    python eaf_to_csv.py --eaf_dir corpus/ --output_dir kriol_segments --workers 8 \
+        --dialect_map Casamance=CM Bissau=GB --output_format arrow
+
 Auteur : Daphne Teixeira
 """
 
 import pympi
+import argparse
+import bisect
 import csv
 import os
+import re
+import shutil
+
+import soundfile as sf
+import soxr
+
+import instrumentation
+from instrumentation import add_audio, stage, track_file
+from manifest import unique_stems
+from worker_pool import run_tasks
+
+try:
+    from arrow_shards import ArrowShardWriter, shard_filename, write_dataset_metadata
+except ImportError:  # pyarrow et datasets ne sont requis que pour --output_format arrow
+    ArrowShardWriter = None
 
 # === PARAMÈTRES ===
 EAF_FILE = 'Emilie_K.eaf'  # Nom du fichier EAF
 AUDIO_FILENAME = 'Emilie_K.wav'  # Fichier audio correspondant
 OUTPUT_CSV = 'whisper_kriol_cm.csv'  # Nom du fichier CSV de sortie
 DIALECT_TAG = 'CM'  # Tag de variété : 'CM' pour Casamance, 'GB' pour Guinée-Bissau
+DIALECT_TAGS = ('CM', 'GB')  # Tags reconnus dans les chemins en mode répertoire
+SAMPLE_RATE = 16000  # Fréquence des segments produits
+MIN_OVERLAP = 0.5  # Chevauchement (fraction du plus court) au-delà duquel deux annotations sont des doublons
+SEGMENTS_CSV = 'segments.csv'  # Manifeste des segments en sortie WAV
 
 # === EXTRACTION DES DONNÉES ===
 
+def deduplicate_annotations(annotations, min_overlap=MIN_OVERLAP):
+    """
+    Supprime les annotations qui recouvrent une annotation déjà retenue sur au
+    moins `min_overlap` de la plus courte des deux. Les annotations
+    (début, fin, texte) sont parcourues tier par tier : en cas de doublon,
+    celle de la première tier est conservée. Renvoie la liste triée par début.
+    """
+    kept = []    # Annotations retenues, triées par début
+    starts = []  # Débuts des annotations retenues (recherche dichotomique)
+    longest = 0
+    for start, end, text in annotations:
+        i = bisect.bisect_left(starts, end)
+        duplicate = False
+        # Seules les annotations commençant moins de `longest` avant `start` peuvent la recouvrir
+        for j in range(i - 1, -1, -1):
+            kept_start, kept_end, _ = kept[j]
+            if kept_start + longest <= start:
+                break
+            shared = min(end, kept_end) - max(start, kept_start)
+            if shared > 0 and shared >= min_overlap * min(end - start, kept_end - kept_start):
+                duplicate = True
+                break
+        if not duplicate:
+            kept.insert(i, (start, end, text))
+            starts.insert(i, start)
+            longest = max(longest, end - start)
+    return kept
+
+def read_annotations(eaf, tiers=None, min_overlap=MIN_OVERLAP):
+    """Lit les annotations non vides (ms) des tiers d'un `pympi.Elan.Eaf` et les dédoublonne"""
+    annotations = []
+    for tier in eaf.get_tier_names():
+        if tiers and tier not in tiers:
+            continue
+        for annotation in eaf.get_annotation_data_for_tier(tier):
+            start, end, text = annotation[:3]
+            if text.strip() and end > start:  # Ne pas inclure les annotations vides
+                annotations.append((start, end, text.strip()))
+    return deduplicate_annotations(annotations, min_overlap)
+
 def extract_transcriptions(eaf_file, audio_filename, dialect_tag, output_csv):
     eaf = pympi.Elan.Eaf(eaf_file)
-    
+
     with open(output_csv, mode='w', newline='', encoding='utf-8') as csv_file:
         writer = csv.writer(csv_file)
         writer.writerow(['audio', 'start', 'end', 'text', 'variety'])
 
+        # Sortie historique : toutes les annotations de toutes les tiers, sans dédoublonnage
         for tier in eaf.get_tier_names():
-            for start, end, text in eaf.get_annotation_data_for_tier(tier):
+            for annotation in eaf.get_annotation_data_for_tier(tier):
+                start, end, text = annotation[:3]
                 if text.strip():  # Ne pas inclure les annotations vides
                     writer.writerow([
                         audio_filename,
@@ -40,6 +120,232 @@ def extract_transcriptions(eaf_file, audio_filename, dialect_tag, output_csv):
 
     print(f"Fichier CSV créé avec succès : {output_csv}")
 
+# === MODE RÉPERTOIRE ===
+
+def collect_eaf_files(eaf_dir):
+    """
+    Renvoie la liste triée des couples (chemin EAF, nom de base de sortie).
+    Deux fichiers de même nom dans des sous-dossiers différents reçoivent un
+    suffixe `_2`, `_3`, ... qui ne reprend jamais le nom d'un autre fichier
+    (`manifest.unique_stems`, comme dans `pre-process.py`).
+    """
+    eaf_files = []
+    for root, dirs, files in os.walk(eaf_dir):
+        dirs.sort()
+        eaf_files.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith('.eaf'))
+
+    return list(zip(eaf_files, unique_stems(eaf_files)))
+
+def infer_dialect(relative_path, dialect_map=None, default=DIALECT_TAG):
+    """
+    Variété d'un fichier à partir de son chemin relatif au corpus : d'abord
+    `dialect_map` (sous-chaîne du chemin -> tag, sans casse), puis un mot du
+    chemin égal à un tag connu (`corpus_GB/...`, `.../CM/...`), sinon `default`.
+    """
+    path = relative_path.lower()
+    for key, tag in (dialect_map or {}).items():
+        if key.lower() in path:
+            return tag
+    words = set(re.split(r'[^a-z0-9]+', path))
+    for tag in DIALECT_TAGS:
+        if tag.lower() in words:
+            return tag
+    return default
+
+def find_audio(eaf_path, eaf, audio_dir=None):
+    """Cherche le WAV d'un EAF : médias liés dans l'en-tête, puis fichier de même nom"""
+    candidates = []
+    for media in eaf.media_descriptors:
+        for attribute in ('RELATIVE_MEDIA_URL', 'MEDIA_URL'):
+            url = media.get(attribute)
+            if url:
+                candidates.append(os.path.basename(url.replace('file://', '')))
+    candidates.append(os.path.splitext(os.path.basename(eaf_path))[0] + '.wav')
+
+    search_dirs = [os.path.dirname(eaf_path)] + ([audio_dir] if audio_dir else [])
+    for filename in candidates:
+        if not filename.lower().endswith('.wav'):
+            continue
+        for directory in search_dirs:
+            path = os.path.join(directory, filename)
+            if os.path.exists(path):
+                return path
+    return None
+
+def read_segments(audio_path, annotations, sample_rate=SAMPLE_RATE):
+    """
+    Ouvre le WAV une seule fois et génère, pour chaque annotation
+    (début, fin, texte) en ms, le segment correspondant en mono à
+    `sample_rate` Hz. Seuls les intervalles annotés sont lus.
+    """
+    with sf.SoundFile(audio_path) as f:
+        for start, end, text in annotations:
+            first = min(int(start * f.samplerate / 1000), f.frames)
+            last = min(int(end * f.samplerate / 1000), f.frames)
+            if last <= first:
+                continue
+            with stage('decode'):
+                f.seek(first)
+                audio = f.read(last - first, dtype='float32', always_2d=True).mean(axis=1)
+            if f.samplerate != sample_rate:
+                with stage('resample'):
+                    audio = soxr.resample(audio, f.samplerate, sample_rate, quality='HQ')
+            add_audio((last - first) / f.samplerate)
+            yield start, end, text, audio
+
+def segment_columns():
+    """Colonnes de métadonnées des shards Arrow de segments annotés"""
+    from datasets import Value
+
+    return {
+        'text': Value('string'),
+        'variety': Value('string'),
+        'file': Value('string'),
+        'start': Value('float32'),
+        'end': Value('float32'),
+    }
+
+def process_eaf(eaf_path, stem, output_dir, dialect, audio_dir=None, tiers=None, sample_rate=SAMPLE_RATE,
+                shard_path=None, audio_dtype='float32'):
+    """
+    Découpe les segments annotés d'un EAF. Écrit un WAV par segment dans
+    `output_dir/stem/`, ou tous les segments dans le shard `shard_path`.
+    Renvoie (lignes du manifeste, erreur ou None).
+    """
+    rows = []
+    try:
+        with track_file(eaf_path):
+            with stage('parse'):
+                eaf = pympi.Elan.Eaf(eaf_path)
+                audio_path = find_audio(eaf_path, eaf, audio_dir)
+                if audio_path is None:
+                    return rows, "fichier audio introuvable"
+                annotations = read_annotations(eaf, tiers)
+            source = os.path.basename(audio_path)
+
+            if shard_path is not None:
+                with ArrowShardWriter(shard_path, audio_dtype, columns=segment_columns()) as writer:
+                    for start, end, text, audio in read_segments(audio_path, annotations, sample_rate):
+                        with stage('write'):
+                            writer.write_row(audio, text=text, variety=dialect, file=source,
+                                             start=start / 1000.0, end=end / 1000.0)
+                        rows.append([shard_path, start / 1000.0, end / 1000.0, text, dialect])
+                return rows, None
+
+            segment_dir = os.path.join(output_dir, stem)
+            os.makedirs(segment_dir, exist_ok=True)
+            for index, (start, end, text, audio) in enumerate(read_segments(audio_path, annotations, sample_rate)):
+                filename = f"{stem}_{index:04d}.wav"
+                with stage('write'):
+                    sf.write(os.path.join(segment_dir, filename), audio, sample_rate)
+                rows.append([os.path.join(stem, filename), start / 1000.0, end / 1000.0, text, dialect, source])
+    except Exception as e:
+        return rows, str(e)
+    return rows, None
+
+def remove_partial_outputs(output_dir, stem, shard_path=None):
+    """Supprime les sorties d'un EAF en échec : son shard, ou son dossier de segments WAV"""
+    if shard_path is not None:
+        if os.path.exists(shard_path):
+            os.remove(shard_path)
+    else:
+        shutil.rmtree(os.path.join(output_dir, stem), ignore_errors=True)
+
+def _process_eaf_task(args):
+    """Point d'entrée des workers : dépaquette les arguments de `process_eaf`"""
+    return process_eaf(*args)
+
+def extract_corpus(eaf_dir, output_dir, dialect_map=None, default_dialect=DIALECT_TAG, audio_dir=None,
+                   tiers=None, sample_rate=SAMPLE_RATE, workers=1, output_format='wav', audio_dtype='float32'):
+    """
+    Traite tous les fichiers .eaf de `eaf_dir` (récursivement), sur `workers`
+    processus (voir `worker_pool.py` : un worker tué ne bloque pas le reste),
+    et écrit le jeu de segments dans `output_dir`. Les sorties partielles d'un
+    fichier en échec (segments WAV ou shard) sont supprimées. Renvoie le couple
+    (segments écrits, fichiers en échec).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    files = collect_eaf_files(eaf_dir)
+
+    if output_format == 'arrow':
+        if ArrowShardWriter is None:
+            raise ImportError("Dépendances manquantes pour la sortie Arrow. "
+                              "Veuillez les installer avec : pip install pyarrow datasets")
+        # Supprime les shards d'une exécution précédente (leur nombre peut changer)
+        for filename in os.listdir(output_dir):
+            if filename.startswith('data-') and filename.endswith('.arrow'):
+                os.remove(os.path.join(output_dir, filename))
+
+    tasks = []
+    for index, (eaf_path, stem) in enumerate(files):
+        dialect = infer_dialect(os.path.relpath(eaf_path, eaf_dir), dialect_map, default_dialect)
+        shard_path = None
+        if output_format == 'arrow':
+            shard_path = os.path.join(output_dir, shard_filename(index, len(files)))
+        tasks.append((eaf_path, stem, output_dir, dialect, audio_dir, tiers, sample_rate, shard_path, audio_dtype))
+
+    shards = []
+    segments = 0
+    failed = 0
+    with open(os.path.join(output_dir, SEGMENTS_CSV), 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        if output_format != 'arrow':
+            writer.writerow(['audio', 'start', 'end', 'text', 'variety', 'source'])
+        else:
+            writer.writerow(['shard', 'start', 'end', 'text', 'variety'])
+        for task, result, error in run_tasks(_process_eaf_task, tasks, workers):
+            rows, error = result if error is None else ([], error)
+            if error is not None:
+                print(f"Erreur lors du traitement de {os.path.basename(task[0])} : {error}")
+                failed += 1
+                remove_partial_outputs(output_dir, task[1], task[7])
+                continue
+            writer.writerows(rows)
+            segments += len(rows)
+            if task[7] is not None:
+                shards.append(os.path.basename(task[7]))
+
+    if output_format == 'arrow':
+        if not write_dataset_metadata(output_dir, shards, audio_dtype, sample_rate, columns=segment_columns(),
+                                      source='eaf_to_csv.py'):
+            print(f"Aucun shard écrit : {output_dir} ne contient pas de dataset chargeable avec load_from_disk.")
+
+    print(f"\n{len(files)} fichiers EAF, {segments} segments écrits, {failed} échecs.")
+    print(f"Segments sauvegardés dans : {output_dir}")
+    return segments, failed
+
+def parse_dialect_map(pairs):
+    """Convertit ['Casamance=CM', 'Bissau=GB'] en dictionnaire"""
+    dialect_map = {}
+    for pair in pairs or []:
+        key, _, tag = pair.partition('=')
+        if not tag:
+            raise ValueError(f"Correspondance de variété invalide : {pair} (attendu : motif=TAG)")
+        dialect_map[key] = tag
+    return dialect_map
+
 # === EXÉCUTION ===
 if __name__ == '__main__':
-    extract_transcriptions(EAF_FILE, AUDIO_FILENAME, DIALECT_TAG, OUTPUT_CSV)
+    parser = argparse.ArgumentParser(description="Conversion ELAN (.eaf) en CSV ou en jeu de segments audio")
+    parser.add_argument('--eaf_dir', type=str, default=None,
+                        help="Répertoire de fichiers .eaf (mode répertoire) ; sinon EAF_FILE seul")
+    parser.add_argument('--output_dir', type=str, default='kriol_segments', help="Répertoire des segments produits")
+    parser.add_argument('--audio_dir', type=str, default=None, help="Répertoire supplémentaire où chercher les WAV")
+    parser.add_argument('--dialect', type=str, default=DIALECT_TAG, help="Variété par défaut")
+    parser.add_argument('--dialect_map', nargs='*', default=None,
+                        help="Correspondances motif=TAG appliquées au chemin de chaque EAF")
+    parser.add_argument('--tiers', nargs='*', default=None, help="Tiers à lire (par défaut : toutes)")
+    parser.add_argument('--workers', type=int, default=1, help="Nombre de processus")
+    parser.add_argument('--output_format', choices=['wav', 'arrow'], default='wav',
+                        help="WAV + segments.csv, ou shards Arrow pour datasets.load_from_disk")
+    parser.add_argument('--audio_dtype', choices=['float32', 'int16'], default='float32',
+                        help="Type des échantillons dans les shards Arrow")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args.profile_log, args.cprofile)
+
+    if args.eaf_dir is None:
+        extract_transcriptions(EAF_FILE, AUDIO_FILENAME, args.dialect, OUTPUT_CSV)
+    else:
+        extract_corpus(args.eaf_dir, args.output_dir, parse_dialect_map(args.dialect_map), args.dialect,
+                       args.audio_dir, args.tiers, SAMPLE_RATE, args.workers, args.output_format, args.audio_dtype)
@@ -7,12 +7,39 @@ Pré-requis :
 - Un fichier TSV (ou CSV) avec deux colonnes : `input` (brut CTC) et `target` (transcription Kriol corrigée)
 - Modèle Gervasio disponible sur Hugging Face
 
+Les entrées et les cibles passent par le normaliseur de `simple_normalization.py`,
+le même que pour l'entraînement et l'évaluation de Whisper.
+
+Préparation des données :
+- Tokenisation par lots, sans padding : le prompt et la cible sont tokenisés
+  séparément, puis concaténés (cible terminée par le token EOS)
+- Seuls les tokens de la cible contribuent à la perte (prompt masqué à -100)
+- Par défaut, padding dynamique au plus long exemple du lot (arrondi au
+  multiple de 8), exemples regroupés par longueur
+- Avec `--packing`, les exemples d'un lot sont concaténés en une seule ligne
+  sans padding ; les `position_ids` repartent de 0 à chaque exemple. Seule
+  l'implémentation FlashAttention 2 s'en sert pour interdire l'attention d'un
+  exemple à l'autre (eager et sdpa les ignoreraient) : le modèle est alors
+  chargé avec `attn_implementation="flash_attention_2"`, ce qui demande le
+  paquet `flash-attn` et un GPU compatible
+- Le débit (tokens/s, hors padding) est ajouté à chaque entrée du journal
+
+torch et transformers ne sont importés qu'à l'exécution : `gervasio_infer.py`
+importe le prompt d'ici sans charger de bibliothèque lourde.
+
+Exemple :
+    python gervasio_finetune_pipeline.py --train_file kriol_finetune.tsv --packing --batch_size 16
+
 Auteur : Daphne Teixeira
 """
 
-from transformers import AutoTokenizer, AutoModelForCausalLM, TrainingArguments, Trainer, DataCollatorForLanguageModeling
-from datasets import load_dataset, Dataset
-import torch
+import argparse
+import functools
+import time
+
+import instrumentation
+from instrumentation import stage
+from simple_normalization import normalize_text
 
 # === PARAMÈTRES ===
 model_checkpoint = "PORTULAN/gervasio-7b-portuguese-ptpt-decoder"
@@ -21,50 +48,149 @@ output_dir = "gervasio-kriol-finetuned"
 epochs = 5
 batch_size = 2
 max_length = 128
+PAD_TO_MULTIPLE_OF = 8
+PROMPT_TEMPLATE = "Corrige le Kriol :\nInput: {input}\nOutput:"
 
-# === TOKENISEUR ET MODÈLE ===
-tokenizer = AutoTokenizer.from_pretrained(model_checkpoint)
-model = AutoModelForCausalLM.from_pretrained(model_checkpoint)
+# === PRÉPARATION DES PROMPTS ===
+def build_prompt(text):
+    """Prompt de correction pour une transcription brute, normalisée"""
+    return PROMPT_TEMPLATE.format(input=normalize_text(text))
 
-# === CHARGEMENT DU DATASET ===
-dataset = load_dataset("csv", data_files={"train": train_file}, delimiter="\t")
+def preprocess_batch(batch, tokenizer, max_length=max_length):
+    """
+    Tokenise un lot d'exemples (`dataset.map(..., batched=True)`) sans padding.
+    Les labels valent -100 sur le prompt : seule la cible est apprise.
+    """
+    prompt_ids = tokenizer([build_prompt(text) for text in batch["input"]]).input_ids
+    target_ids = tokenizer([" " + normalize_text(text) for text in batch["target"]],
+                           add_special_tokens=False).input_ids
 
-# === PRÉPARATION DES PROMPTS ===
-def preprocess_function(example):
-    prompt = f"Corrige le Kriol :\nInput: {example['input']}\nOutput:"
-    full_text = prompt + " " + example["target"]
-    tokenized = tokenizer(full_text, truncation=True, max_length=max_length, padding="max_length")
-    tokenized["labels"] = tokenized["input_ids"].copy()
-    return tokenized
-
-encoded = dataset.map(preprocess_function, batched=False)
-
-# === ENTRAÎNEMENT ===
-args = TrainingArguments(
-    output_dir=output_dir,
-    per_device_train_batch_size=batch_size,
-    num_train_epochs=epochs,
-    logging_dir=f"{output_dir}/logs",
-    save_strategy="epoch",
-    logging_strategy="epoch",
-    evaluation_strategy="no",
-    save_total_limit=1,
-    fp16=torch.cuda.is_available(),
-    report_to="none"
-)
-
-data_collator = DataCollatorForLanguageModeling(tokenizer, mlm=False)
-
-trainer = Trainer(
-    model=model,
-    args=args,
-    train_dataset=encoded["train"],
-    tokenizer=tokenizer,
-    data_collator=data_collator
-)
-
-trainer.train()
-model.save_pretrained(output_dir)
-tokenizer.save_pretrained(output_dir)
-
-print("\nFine-tuning terminé. Modèle sauvegardé dans :", output_dir)
+    input_ids, labels = [], []
+    for prompt, target in zip(prompt_ids, target_ids):
+        target = target + [tokenizer.eos_token_id]
+        input_ids.append((prompt + target)[:max_length])
+        labels.append(([-100] * len(prompt) + target)[:max_length])
+    return {
+        "input_ids": input_ids,
+        "attention_mask": [[1] * len(ids) for ids in input_ids],
+        "labels": labels,
+    }
+
+def has_target(example):
+    """Écarte les exemples dont la cible a entièrement disparu à la troncature"""
+    return any(label != -100 for label in example["labels"])
+
+# === ENTRAÎNEUR AVEC MESURE DU DÉBIT ===
+@functools.lru_cache(maxsize=None)
+def throughput_trainer_class():
+    """Crée à la demande `ThroughputTrainer` (transformers n'est importé qu'ici)"""
+    from transformers import Trainer
+
+    class ThroughputTrainer(Trainer):
+        """Trainer qui ajoute le débit d'entraînement (tokens réels par seconde) au journal"""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._tokens = 0          # Tokens vus depuis le dernier log (tenseur sur l'appareil, sans synchronisation)
+            self._last_log = None
+
+        def training_step(self, model, inputs, *args, **kwargs):
+            if self._last_log is None:
+                self._last_log = time.perf_counter()
+            attention_mask = inputs.get("attention_mask")
+            if attention_mask is not None:
+                self._tokens = self._tokens + attention_mask.sum()
+            else:  # Lignes empaquetées : aucun token de padding
+                self._tokens = self._tokens + inputs["input_ids"].numel()
+            return super().training_step(model, inputs, *args, **kwargs)
+
+        def log(self, logs, *args, **kwargs):
+            if "loss" in logs and self._last_log is not None:
+                now = time.perf_counter()
+                logs["tokens_per_second"] = round(float(self._tokens) / (now - self._last_log), 1)
+                self._tokens = 0
+                self._last_log = now
+            super().log(logs, *args, **kwargs)
+
+    return ThroughputTrainer
+
+# === EXÉCUTION ===
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fine-tuning de Gervasio pour la post-correction du Kriol")
+    parser.add_argument("--train_file", type=str, default=train_file, help="TSV avec colonnes input et target")
+    parser.add_argument("--output_dir", type=str, default=output_dir, help="Dossier du modèle fine-tuné")
+    parser.add_argument("--epochs", type=int, default=epochs, help="Nombre d'époques")
+    parser.add_argument("--batch_size", type=int, default=batch_size, help="Exemples par lot (par ligne empaquetée avec --packing)")
+    parser.add_argument("--max_length", type=int, default=max_length, help="Longueur maximale d'un exemple (tokens)")
+    parser.add_argument("--packing", action="store_true",
+                        help="Concatène les exemples d'un lot sans padding (FlashAttention 2, frontières par position_ids)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    import torch
+    from transformers import (AutoTokenizer, AutoModelForCausalLM, TrainingArguments,
+                              DataCollatorForSeq2Seq, DataCollatorWithFlattening)
+    from transformers.utils import is_flash_attn_2_available
+
+    if args.packing and not is_flash_attn_2_available():
+        parser.error("--packing exige FlashAttention 2 (pip install flash-attn, GPU CUDA) : "
+                     "sans lui, les exemples empaquetés se verraient les uns les autres")
+    instrumentation.configure(args.profile_log, args.cprofile, packing=args.packing)
+
+    # === TOKENISEUR ET MODÈLE ===
+    with stage("load"):
+        tokenizer = AutoTokenizer.from_pretrained(model_checkpoint)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        # Lignes empaquetées : seul FlashAttention 2 découpe l'attention selon les position_ids
+        attn_implementation = "flash_attention_2" if args.packing else None
+        model = AutoModelForCausalLM.from_pretrained(model_checkpoint, attn_implementation=attn_implementation)
+    # Le cache KV est inutile à l'entraînement ; actif, il empêcherait aussi transformers
+    # de déduire les frontières des exemples empaquetés à partir des position_ids
+    model.config.use_cache = False
+
+    # === CHARGEMENT DU DATASET ===
+    from datasets import load_dataset
+
+    with stage("tokenize"):
+        dataset = load_dataset("csv", data_files={"train": args.train_file}, delimiter="\t")
+        encoded = dataset.map(preprocess_batch, batched=True, remove_columns=dataset["train"].column_names,
+                              fn_kwargs={"tokenizer": tokenizer, "max_length": args.max_length})
+        encoded = encoded.filter(has_target)
+
+    # === ENTRAÎNEMENT ===
+    training_args = TrainingArguments(
+        output_dir=args.output_dir,
+        per_device_train_batch_size=args.batch_size,
+        num_train_epochs=args.epochs,
+        logging_dir=f"{args.output_dir}/logs",
+        save_strategy="epoch",
+        logging_strategy="epoch",
+        eval_strategy="no",
+        save_total_limit=1,
+        fp16=torch.cuda.is_available(),
+        group_by_length=not args.packing,  # Lots d'exemples de longueurs voisines : moins de padding
+        report_to="none"
+    )
+
+    if args.packing:
+        data_collator = DataCollatorWithFlattening(return_position_ids=True, separator_id=-100)
+    else:
+        data_collator = DataCollatorForSeq2Seq(tokenizer, padding=True, pad_to_multiple_of=PAD_TO_MULTIPLE_OF,
+                                               label_pad_token_id=-100)
+
+    trainer = throughput_trainer_class()(
+        model=model,
+        args=training_args,
+        train_dataset=encoded["train"],
+        processing_class=tokenizer,
+        data_collator=data_collator
+    )
+
+    with stage("train"):
+        trainer.train()
+    with stage("write"):
+        model.save_pretrained(args.output_dir)
+        tokenizer.save_pretrained(args.output_dir)
+
+    print("\nFine-tuning terminé. Modèle sauvegardé dans :", args.output_dir)
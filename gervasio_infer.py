@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Post-correction de transcriptions Kriol (sorties CTC ou Whisper) avec le
+modèle Gervasio fine-tuné par `gervasio_finetune_pipeline.py`.
+
+Le modèle est chargé une seule fois, puis les textes sont corrigés par lots :
+- les entrées sont normalisées (`simple_normalization.py`) et dédoublonnées ;
+  un cache LRU renvoie directement les corrections déjà calculées (les
+  énoncés courts et répétés sont nombreux dans nos transcriptions)
+- les textes restants sont triés par longueur, puis regroupés en lots avec
+  padding à gauche
+- le préfixe constant du prompt (`Corrige le Kriol :\\nInput:`) est encodé une
+  seule fois au chargement ; son cache KV est recopié pour chaque lot au lieu
+  d'être recalculé
+
+Entrées acceptées par la ligne de commande :
+- `.txt` : un texte par ligne, corrections écrites une par ligne
+- `.csv` / `.tsv` : colonne `--column`, corrections ajoutées dans une colonne `corrected`
+- `.json` produit par `whisper_infer.py` : champs `corrected` ajoutés à la
+  transcription et à chaque segment
+
+Exemple :
+    python gervasio_infer.py transcriptions.tsv --column input --output corrected.tsv --batch_size 16
+
+Auteur : Daphne Teixeira
+"""
+
+import argparse
+import collections
+import copy
+import csv
+import json
+import os
+
+from gervasio_finetune_pipeline import PROMPT_TEMPLATE, build_prompt
+from simple_normalization import normalize_text
+
+# === PARAMÈTRES ===
+model_dir = "gervasio-kriol-finetuned"
+BATCH_SIZE = 16
+MAX_NEW_TOKENS = 128
+CACHE_SIZE = 100000  # Nombre de corrections conservées dans le cache LRU
+CHUNK_SIZE = 1024    # Lignes lues à la fois dans les fichiers d'entrée
+PROMPT_PREFIX = PROMPT_TEMPLATE.split("{input}")[0].rstrip()  # "Corrige le Kriol :\nInput:"
+
+
+class KriolCorrector:
+    """
+    Correcteur résident : modèle, cache KV du préfixe et cache LRU des corrections.
+    torch et transformers ne sont importés qu'à la construction ; `device` vaut
+    par défaut "cuda" si un GPU est disponible, "cpu" sinon.
+    """
+
+    def __init__(self, model_dir=model_dir, device=None, batch_size=BATCH_SIZE,
+                 max_new_tokens=MAX_NEW_TOKENS, cache_size=CACHE_SIZE):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.batch_size = batch_size
+        self.max_new_tokens = max_new_tokens
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()  # Texte normalisé -> correction
+        self.hits = 0
+        self.misses = 0
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        dtype = torch.float16 if device != "cpu" else torch.float32
+        self.model = AutoModelForCausalLM.from_pretrained(model_dir, torch_dtype=dtype).to(device)
+        self.model.eval()
+
+        # Cache KV du préfixe commun, calculé une fois
+        self.prefix_ids = self.tokenizer(PROMPT_PREFIX).input_ids
+        with torch.no_grad():
+            prefix = torch.tensor([self.prefix_ids], device=self.model.device)
+            self.prefix_cache = self.model(input_ids=prefix, use_cache=True).past_key_values
+
+    def correct(self, texts):
+        """Corrige une liste de textes ; renvoie les corrections dans le même ordre"""
+        normalized = [normalize_text(text) for text in texts]
+        corrections = {"": ""}  # Corrections de cet appel, indépendantes des évictions du cache
+        missing = []
+        for text in dict.fromkeys(normalized):
+            if text in self.cache:
+                self.cache.move_to_end(text)
+                corrections[text] = self.cache[text]
+                self.hits += 1
+            elif text:
+                missing.append(text)
+                self.misses += 1
+
+        # Tri par longueur : des lots homogènes limitent le padding
+        missing.sort(key=len)
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            corrections.update(zip(batch, self._generate(batch)))
+
+        results = [corrections[text] for text in normalized]
+        for text in missing:
+            self._remember(text, corrections[text])
+        return results
+
+    def _remember(self, text, correction):
+        self.cache[text] = correction
+        self.cache.move_to_end(text)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _generate(self, texts):
+        """Génère les corrections d'un lot de textes normalisés (padding à gauche)"""
+        import torch
+
+        prompts = self.tokenizer([build_prompt(text) for text in texts]).input_ids
+        n_prefix = len(self.prefix_ids)
+        # Le préfixe en cache n'est utilisable que si chaque prompt se tokenise en commençant par lui
+        use_prefix = all(ids[:n_prefix] == self.prefix_ids for ids in prompts)
+        suffixes = [ids[n_prefix:] for ids in prompts] if use_prefix else prompts
+
+        width = max(len(ids) for ids in suffixes)
+        pad_id = self.tokenizer.pad_token_id
+        input_ids = [[pad_id] * (width - len(ids)) + ids for ids in suffixes]
+        attention_mask = [[0] * (width - len(ids)) + [1] * len(ids) for ids in suffixes]
+
+        kwargs = {}
+        if use_prefix:
+            # Disposition [préfixe][padding][suffixe] : les positions suivent le masque d'attention
+            input_ids = [self.prefix_ids + ids for ids in input_ids]
+            attention_mask = [[1] * n_prefix + mask for mask in attention_mask]
+            cache = copy.deepcopy(self.prefix_cache)
+            cache.batch_repeat_interleave(len(texts))
+            kwargs["past_key_values"] = cache
+
+        input_ids = torch.tensor(input_ids, device=self.model.device)
+        attention_mask = torch.tensor(attention_mask, device=self.model.device)
+        with torch.no_grad():
+            output_ids = self.model.generate(input_ids=input_ids, attention_mask=attention_mask,
+                                             max_new_tokens=self.max_new_tokens, num_beams=1, do_sample=False,
+                                             pad_token_id=pad_id, **kwargs)
+        generated = output_ids[:, input_ids.shape[1]:]
+        return [text.strip() for text in self.tokenizer.batch_decode(generated, skip_special_tokens=True)]
+
+    def cache_info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.cache)}
+
+
+# === FICHIERS D'ENTRÉE ===
+def _chunks(items, chunk_size=CHUNK_SIZE):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def correct_text_file(corrector, input_path, output_path):
+    with open(input_path, encoding="utf-8") as f_in, open(output_path, "w", encoding="utf-8") as f_out:
+        for lines in _chunks(line.rstrip("\n") for line in f_in):
+            for correction in corrector.correct(lines):
+                f_out.write(correction + "\n")
+
+def correct_table(corrector, input_path, output_path, column):
+    delimiter = "\t" if input_path.lower().endswith(".tsv") else ","
+    with open(input_path, newline="", encoding="utf-8") as f_in, \
+         open(output_path, "w", newline="", encoding="utf-8") as f_out:
+        reader = csv.DictReader(f_in, delimiter=delimiter)
+        if column not in reader.fieldnames:
+            raise ValueError(f"Colonne {column} absente de {input_path} (colonnes : {', '.join(reader.fieldnames)})")
+        writer = csv.DictWriter(f_out, fieldnames=reader.fieldnames + ["corrected"], delimiter=delimiter)
+        writer.writeheader()
+        for rows in _chunks(reader):
+            for row, correction in zip(rows, corrector.correct([row[column] for row in rows])):
+                row["corrected"] = correction
+                writer.writerow(row)
+
+def correct_transcription_json(corrector, input_path, output_path):
+    """Ajoute les corrections à un JSON de `whisper_infer.py` (segments et transcription complète)"""
+    with open(input_path, encoding="utf-8") as f:
+        data = json.load(f)
+    segments = data.get("segments", [])
+    for segment, correction in zip(segments, corrector.correct([s["text"] for s in segments])):
+        segment["corrected"] = correction
+    data["corrected_transcription"] = " ".join(s["corrected"] for s in segments if s["corrected"])
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+def default_output(input_path):
+    stem, extension = os.path.splitext(input_path)
+    return f"{stem}_corrected{extension}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post-correction de transcriptions Kriol avec Gervasio")
+    parser.add_argument("inputs", nargs="+", help="Fichiers .txt, .csv, .tsv ou .json (whisper_infer.py)")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Fichier de sortie (une seule entrée) ; par défaut <nom>_corrected.<ext>")
+    parser.add_argument("--model_dir", type=str, default=model_dir, help="Dossier du modèle fine-tuné")
+    parser.add_argument("--column", type=str, default="text", help="Colonne à corriger (CSV / TSV)")
+    parser.add_argument("--batch_size", type=int, default=BATCH_SIZE, help="Textes par appel à generate")
+    parser.add_argument("--max_new_tokens", type=int, default=MAX_NEW_TOKENS, help="Longueur maximale d'une correction")
+    parser.add_argument("--cache_size", type=int, default=CACHE_SIZE, help="Taille du cache LRU des corrections")
+    args = parser.parse_args()
+
+    if args.output and len(args.inputs) > 1:
+        parser.error("--output n'est possible qu'avec une seule entrée")
+
+    corrector = KriolCorrector(args.model_dir, batch_size=args.batch_size, max_new_tokens=args.max_new_tokens,
+                               cache_size=args.cache_size)
+    for input_path in args.inputs:
+        output_path = args.output or default_output(input_path)
+        extension = os.path.splitext(input_path)[1].lower()
+        if extension in (".csv", ".tsv"):
+            correct_table(corrector, input_path, output_path, args.column)
+        elif extension == ".json":
+            correct_transcription_json(corrector, input_path, output_path)
+        else:
+            correct_text_file(corrector, input_path, output_path)
+        print(f"Corrections sauvegardées dans : {output_path}")
+    print("Cache des corrections :", corrector.cache_info())
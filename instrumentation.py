@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation optionnelle, partagée par les scripts de la chaîne
+(`pre-process.py`, `vad_pyannote.py`, `eaf_to_csv.py`, `whisper_infer.py`,
+`asr_pipeline.py` et les scripts d'entraînement).
+
+Elle est désactivée par défaut : tant qu'aucun journal n'est configuré,
+`stage()` et `track_file()` ne mesurent rien et n'écrivent rien.
+
+Activation :
+- `--profile_log mesures.jsonl` (ou la variable d'environnement
+  `KRIOL_PROFILE_LOG`) : journal JSON-lines des temps par fichier et par étape
+- `--cprofile profil.prof` (ou `KRIOL_CPROFILE`) : profil cProfile du
+  processus principal, lisible avec `python -m pstats` ou snakeviz. Pour
+  py-spy, le pid de chaque processus figure dans le journal
+  (`py-spy record --pid <pid>`)
+
+Le journal contient une ligne JSON par enregistrement :
+- `start` / `end` : début et fin du script (arguments, durée totale, temps
+  cumulé par étape du processus principal, mémoire de pointe)
+- `file` : un fichier traité (durée de calcul, durée audio, facteur temps
+  réel `rtf` = calcul / audio, temps par étape, mémoire de pointe)
+- `stage` : une étape mesurée hors d'un fichier (ex. un lot de fenêtres
+  passé à `generate`)
+
+Étapes usuelles : `decode`, `resample`, `vad`, `features`, `generate`, `write`.
+Les workers (multiprocessing) écrivent dans le même journal : le chemin est
+transmis par variable d'environnement et chaque ligne est ajoutée en un seul
+`write`.
+
+Résumé d'un journal :
+    python instrumentation.py mesures.jsonl
+
+Auteur : Daphne Teixeira
+"""
+
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows : pas de mesure de la mémoire de pointe
+    resource = None
+
+# === PARAMÈTRES ===
+LOG_ENV = "KRIOL_PROFILE_LOG"
+CPROFILE_ENV = "KRIOL_CPROFILE"
+
+_log_path = None      # Chemin du journal ("" : instrumentation désactivée), lu à la demande
+_script = None
+_started = None
+_profiler = None
+_cprofile_path = None
+_totals = {}          # Étape -> secondes cumulées dans ce processus
+_local = threading.local()  # Fichier en cours, propre à chaque thread
+
+
+# === CONFIGURATION ===
+def add_arguments(parser):
+    """Ajoute les options `--profile_log` et `--cprofile` à un `argparse.ArgumentParser`"""
+    parser.add_argument("--profile_log", type=str, default=None,
+                        help="Journal JSON-lines des temps par fichier et par étape (instrumentation.py)")
+    parser.add_argument("--cprofile", type=str, default=None,
+                        help="Écrit un profil cProfile du processus principal dans ce fichier (.prof)")
+    return parser
+
+def configure(log_path=None, cprofile_path=None, script=None, **params):
+    """
+    Active l'instrumentation pour ce processus et ses workers. Sans argument,
+    les variables d'environnement `KRIOL_PROFILE_LOG` / `KRIOL_CPROFILE` sont
+    utilisées. `params` est recopié dans l'enregistrement `start`.
+    """
+    global _log_path, _script, _started, _profiler, _cprofile_path
+    log_path = log_path or os.environ.get(LOG_ENV)
+    cprofile_path = cprofile_path or os.environ.get(CPROFILE_ENV)
+    _script = script or os.path.basename(sys.argv[0])
+    _started = time.perf_counter()
+
+    if log_path:
+        _log_path = os.path.abspath(log_path)
+        os.environ[LOG_ENV] = _log_path  # Transmis aux workers lancés par spawn / forkserver
+        write_record("start", argv=sys.argv[1:], **params)
+    if cprofile_path and _profiler is None:
+        import cProfile
+        _cprofile_path = cprofile_path
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    if log_path or cprofile_path:
+        atexit.register(finish)
+
+def enabled():
+    global _log_path
+    if _log_path is None:
+        _log_path = os.path.abspath(os.environ[LOG_ENV]) if os.environ.get(LOG_ENV) else ""
+    return bool(_log_path)
+
+def finish():
+    """Écrit l'enregistrement `end` et le profil cProfile (appelé automatiquement à la sortie)"""
+    global _profiler, _started
+    if _started is not None and enabled():
+        write_record("end", seconds=round(time.perf_counter() - _started, 3),
+                     stages={name: round(seconds, 6) for name, seconds in _totals.items()},
+                     **peak_memory())
+        _started = None
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_cprofile_path)
+        print(f"Profil cProfile sauvegardé dans : {_cprofile_path}")
+        _profiler = None
+
+# === MESURES ===
+def peak_memory():
+    """Mémoire de pointe du processus (RSS) et, si CUDA est initialisé, du GPU, en Mo"""
+    memory = {}
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory["peak_rss_mb"] = round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    torch = sys.modules.get("torch")  # Jamais importé ici : seulement s'il est déjà chargé
+    if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+        memory["peak_gpu_mb"] = round(torch.cuda.max_memory_allocated() / 2 ** 20, 1)
+    return memory
+
+def _rates(seconds, audio_seconds):
+    if not audio_seconds:
+        return {}
+    return {"audio_seconds": round(audio_seconds, 3), "rtf": round(seconds / audio_seconds, 6)}
+
+def write_record(kind, **fields):
+    """Ajoute un enregistrement au journal (une ligne JSON, un seul `write`)"""
+    if not enabled():
+        return
+    record = {"type": kind, "script": _script or os.path.basename(sys.argv[0]), "pid": os.getpid(),
+              "time": round(time.time(), 3)}
+    record.update(fields)
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with open(_log_path, "a", encoding="utf-8") as f:
+        f.write(line)
+
+@contextlib.contextmanager
+def stage(name, audio_seconds=None, **fields):
+    """
+    Mesure le temps d'une étape. Dans un bloc `track_file`, le temps est
+    ajouté à l'enregistrement du fichier ; sinon, un enregistrement `stage`
+    est écrit (avec le RTF si `audio_seconds` est fourni).
+    """
+    if not enabled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _totals[name] = _totals.get(name, 0.0) + elapsed
+        current = getattr(_local, "file", None)
+        if current is not None:
+            current["stages"][name] = current["stages"].get(name, 0.0) + elapsed
+        else:
+            write_record("stage", stage=name, seconds=round(elapsed, 6), **_rates(elapsed, audio_seconds),
+                         **fields, **peak_memory())
+
+@contextlib.contextmanager
+def track_file(path, **fields):
+    """
+    Regroupe les étapes exécutées dans le bloc (dans ce thread) en un
+    enregistrement `file` : temps total, temps par étape, durée audio
+    (voir `add_audio`), RTF et mémoire de pointe.
+    """
+    if not enabled():
+        yield
+        return
+    record = {"audio_seconds": 0.0, "stages": {}}
+    previous = getattr(_local, "file", None)
+    _local.file = record
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        fields["error"] = str(e)
+        raise
+    finally:
+        _local.file = previous
+        elapsed = time.perf_counter() - start
+        write_record("file", file=path, seconds=round(elapsed, 6), **_rates(elapsed, record["audio_seconds"]),
+                     stages={name: round(seconds, 6) for name, seconds in record["stages"].items()},
+                     **fields, **peak_memory())
+
+def add_audio(seconds):
+    """Ajoute `seconds` secondes d'audio au fichier en cours (sans effet hors `track_file`)"""
+    current = getattr(_local, "file", None)
+    if current is not None:
+        current["audio_seconds"] += seconds
+
+def timed(iterable, name):
+    """Itère sur `iterable` en comptant le temps passé à produire chaque élément dans l'étape `name`"""
+    if not enabled():
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+# === RÉSUMÉ D'UN JOURNAL ===
+def summarize(log_path):
+    """
+    Agrège un journal : temps cumulé, durée audio et RTF par étape, nombre
+    de fichiers et mémoire de pointe (maximum sur tous les processus).
+    """
+    stages = {}
+    files = 0
+    audio = 0.0
+    seconds = 0.0
+    peak = 0.0
+    with open(log_path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            peak = max(peak, record.get("peak_rss_mb", 0.0))
+            if record["type"] == "file":
+                files += 1
+                audio += record.get("audio_seconds", 0.0)
+                seconds += record["seconds"]
+                items = [(name, value, record.get("audio_seconds", 0.0)) for name, value in record["stages"].items()]
+            elif record["type"] == "stage":
+                items = [(record["stage"], record["seconds"], record.get("audio_seconds", 0.0))]
+            else:
+                continue
+            for name, value, audio_seconds in items:
+                total = stages.setdefault(name, {"seconds": 0.0, "audio_seconds": 0.0, "calls": 0})
+                total["seconds"] += value
+                total["audio_seconds"] += audio_seconds
+                total["calls"] += 1
+
+    for total in stages.values():
+        total["rtf"] = total["seconds"] / total["audio_seconds"] if total["audio_seconds"] else None
+    return {"files": files, "seconds": seconds, "audio_seconds": audio,
+            "rtf": seconds / audio if audio else None, "peak_rss_mb": peak, "stages": stages}
+
+def print_summary(summary):
+    print(f"{summary['files']} fichiers, {summary['audio_seconds']:.1f} s d'audio, "
+          f"{summary['seconds']:.1f} s de calcul (total des fichiers), mémoire de pointe {summary['peak_rss_mb']:.0f} Mo")
+    if summary["rtf"] is not None:
+        print(f"RTF par fichier : {summary['rtf']:.4f}")
+    print(f"\n{'Étape':<12} {'Appels':>8} {'Secondes':>10} {'Audio (s)':>10} {'RTF':>9}")
+    for name, total in sorted(summary["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        rtf = f"{total['rtf']:.4f}" if total["rtf"] is not None else "-"
+        print(f"{name:<12} {total['calls']:>8} {total['seconds']:>10.2f} {total['audio_seconds']:>10.1f} {rtf:>9}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Résumé d'un journal d'instrumentation (JSON-lines)")
+    parser.add_argument("log", help="Journal écrit avec --profile_log")
+    parser.add_argument("--json", action="store_true", help="Affiche le résumé en JSON")
+    args = parser.parse_args()
+
+    summary = summarize(args.log)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print_summary(summary)
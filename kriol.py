@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Point d'entrée unique des scripts du dépôt, sous forme de sous-commandes.
+
+Chaque sous-commande exécute le script correspondant exactement comme s'il
+était lancé directement : mêmes options, même `--help`, mêmes sorties. Le
+script n'est importé qu'une fois la commande choisie, et les scripts
+n'importent torch, transformers, pyannote ou datasets qu'au moment où ils
+en ont besoin. La liste des commandes et les commandes sans modèle
+(`normalize`, `eaf`, `preprocess`, `vad --backend energy`, `profile`...)
+démarrent donc en bien moins d'une seconde.
+
+Les scripts restent utilisables seuls (`python vad_pyannote.py ...`) et
+importables comme modules (`from simple_normalization import normalize_text`).
+
+Exemples :
+    python kriol.py --help
+    python kriol.py vad --input_dir wav/ --output_dir vad/ --backend energy
+    python kriol.py transcribe enregistrements/ --output_dir transcriptions
+    python kriol.py train-whisper --dataset_dir kriol_features
+
+Auteur : Daphne Teixeira
+"""
+
+import os
+import runpy
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# === SOUS-COMMANDES ===
+# Commande -> (script, description)
+COMMANDS = {
+    "eaf": ("eaf_to_csv.py", "Conversion ELAN (.eaf) en CSV ou en jeu de segments audio"),
+    "normalize": ("simple_normalization.py", "Normalisation orthographique d'un CSV de transcriptions"),
+    "vad": ("vad_pyannote.py", "Détection de la parole (pyannote, énergie ou hybride) : WAV + RTTM"),
+    "preprocess": ("pre-process.py", "Rééchantillonnage et découpage des WAV pour wav2vec2"),
+    "index": ("corpus_index.py", "Index d'empreintes du corpus : doublons et fichiers exclus"),
+    "features": ("whisper_tokenizer.py", "Caractéristiques log-mel et labels Whisper (avec cache)"),
+    "train-whisper": ("whisper_trainer.py", "Fine-tuning de Whisper"),
+    "train-wav2vec": ("train_wav2vec.py", "Pré-entraînement auto-supervisé de wav2vec2"),
+    "train-gervasio": ("gervasio_finetune_pipeline.py", "Fine-tuning de Gervasio pour la post-correction"),
+    "transcribe": ("whisper_infer.py", "Transcription de fichiers avec un Whisper fine-tuné"),
+    "pipeline": ("asr_pipeline.py", "Chaîne complète en mémoire : VAD, fenêtres, transcription"),
+    "serve": ("whisper_server.py", "Serveur HTTP de transcription (lots dynamiques)"),
+    "decode": ("ctc_decoder.py", "Décodage CTC par faisceau avec modèle de langue n-gramme"),
+    "correct": ("gervasio_infer.py", "Post-correction de transcriptions avec Gervasio"),
+    "benchmark": ("benchmark_suite.py", "Benchmarks hors ligne des étapes du pipeline"),
+    "benchmark-backends": ("benchmark_whisper_backends.py", "Comparaison des backends d'inférence Whisper"),
+    "benchmark-normalization": ("benchmark_normalization.py", "Comparaison des normaliseurs de texte"),
+    "profile": ("instrumentation.py", "Résumé d'un journal --profile_log"),
+}
+
+
+def usage():
+    width = max(len(command) for command in COMMANDS)
+    lines = ["usage: kriol.py <commande> [options]", "",
+             "Commandes (`kriol.py <commande> --help` pour leurs options) :"]
+    lines += [f"  {command:<{width}}  {description}" for command, (_, description) in COMMANDS.items()]
+    return "\n".join(lines)
+
+
+def run(command, argv):
+    """Exécute le script de `command` comme programme principal, avec les arguments `argv`"""
+    script, _ = COMMANDS[command]
+    path = os.path.join(ROOT, script)
+    module = os.path.splitext(script)[0]
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    sys.argv = [path] + list(argv)
+    if module.isidentifier():
+        # alter_sys : le script devient `__main__`, ce dont dépendent les pools de workers
+        runpy.run_module(module, run_name="__main__", alter_sys=True)
+    else:
+        runpy.run_path(path, run_name="__main__")  # pre-process.py : nom non importable
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage())
+        return 0
+    command = argv[0]
+    if command not in COMMANDS:
+        print(f"Commande inconnue : {command}\n\n{usage()}", file=sys.stderr)
+        return 2
+    run(command, argv[1:])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Manifeste persistant pour les relances incrémentales des étapes de prétraitement
+(`pre-process.py`, `vad_pyannote.py`).
+
+Le manifeste est un fichier JSON placé dans le répertoire de sortie. Pour chaque
+fichier d'entrée (clé = chemin relatif au répertoire d'entrée), il mémorise la
+taille, la date de modification, éventuellement une empreinte SHA-1 du contenu,
+ainsi que la liste des fichiers produits. Les paramètres de traitement sont
+enregistrés avec le manifeste : s'ils changent, toutes les entrées sont
+considérées comme obsolètes.
+
+Auteur : Daphne Teixeira
+"""
+
+import collections
+import hashlib
+import json
+import os
+
+# === PARAMÈTRES ===
+MANIFEST_FILENAME = '.manifest.json'
+MANIFEST_VERSION = 1
+HASH_BLOCK_SIZE = 1 << 20  # Lecture par blocs de 1 Mo pour le calcul d'empreinte
+
+
+def unique_stems(paths):
+    """
+    Nom de base de sortie de chaque chemin, dans l'ordre donné. Deux fichiers
+    de même nom dans des sous-dossiers différents reçoivent un suffixe `_2`,
+    `_3`, ... ; les noms d'origine sont réservés d'abord, pour qu'un suffixe ne
+    reprenne jamais le nom d'un autre fichier (`x.wav`, `x_2.wav`, `b/x.wav`
+    donnent `x`, `x_2`, `x_3`).
+    """
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    used = set(stems)
+    seen = set()
+    unique = []
+    for stem in stems:
+        name = stem
+        if stem in seen:
+            suffix = 2
+            while f"{stem}_{suffix}" in used:
+                suffix += 1
+            name = f"{stem}_{suffix}"
+            used.add(name)
+        seen.add(stem)
+        unique.append(name)
+    return unique
+
+
+def file_sha1(path):
+    """Calcule l'empreinte SHA-1 du contenu d'un fichier, lu par blocs"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Suivi des entrées déjà traitées dans un répertoire de sortie.
+
+    Utilisation type :
+        manifest = Manifest(output_dir, params={...})
+        if not manifest.is_up_to_date(key, input_path):
+            manifest.forget(key)          # supprime les anciennes sorties
+            ...                           # traitement
+            manifest.record(key, input_path, outputs)
+        manifest.prune(current_keys)      # sources disparues
+        manifest.save()
+    """
+
+    def __init__(self, output_dir, params, use_hash=False, force=False, filename=MANIFEST_FILENAME):
+        self.output_dir = output_dir
+        self.params = params
+        self.use_hash = use_hash
+        self.path = os.path.join(output_dir, filename)
+        self.entries = {}
+        self.shared_stems = set()
+
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.entries = data.get('entries', {})
+                # Nom de base attribué à plusieurs entrées par une version précédente : sorties mélangées
+                stems = collections.Counter(entry['stem'] for entry in self.entries.values() if 'stem' in entry)
+                self.shared_stems = {stem for stem, count in stems.items() if count > 1}
+                # Des paramètres différents invalident toutes les sorties existantes.
+                # Les entrées sont gardées (incomplètes) pour pouvoir nettoyer leurs sorties.
+                if force or data.get('params') != params:
+                    for entry in self.entries.values():
+                        entry['complete'] = False
+
+    def is_up_to_date(self, key, input_path, stem=None):
+        """Indique si `input_path` a déjà été traité avec les paramètres courants"""
+        entry = self.entries.get(key)
+        if entry is None or not entry.get('complete'):
+            return False
+        if stem is not None and (entry.get('stem') != stem or stem in self.shared_stems):
+            return False
+
+        stat = os.stat(input_path)
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime_ns == entry['mtime_ns']:
+            return True
+
+        # Date modifiée (copie, touch...) : le contenu tranche si l'empreinte est disponible
+        if self.use_hash and entry.get('sha1') and file_sha1(input_path) == entry['sha1']:
+            entry['mtime_ns'] = stat.st_mtime_ns
+            return True
+        return False
+
+    def record(self, key, input_path, outputs, stem=None, complete=True):
+        """
+        Enregistre les sorties produites pour `key`. Une entrée incomplète
+        (échec en cours de traitement) garde la trace de ses sorties partielles
+        pour qu'elles soient nettoyées à la prochaine tentative.
+        """
+        stat = os.stat(input_path)
+        entry = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'outputs': [os.path.relpath(p, self.output_dir) for p in outputs],
+            'complete': complete,
+        }
+        if stem is not None:
+            entry['stem'] = stem
+        if self.use_hash and complete:
+            entry['sha1'] = file_sha1(input_path)
+        self.entries[key] = entry
+
+    def forget(self, key):
+        """Supprime du disque les sorties associées à `key` et retire l'entrée"""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return 0
+        removed = 0
+        for relative_path in entry.get('outputs', []):
+            path = os.path.join(self.output_dir, relative_path)
+            if os.path.exists(path):
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def prune(self, current_keys):
+        """Supprime les sorties dont le fichier source a disparu ; renvoie le nombre d'entrées retirées"""
+        current_keys = set(current_keys)
+        orphans = [key for key in self.entries if key not in current_keys]
+        for key in orphans:
+            self.forget(key)
+        return len(orphans)
+
+    def save(self):
+        """Écrit le manifeste de façon atomique (fichier temporaire puis renommage)"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'params': self.params,
+                'entries': self.entries,
+            }, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
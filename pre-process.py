@@ -1,97 +1,389 @@
 import os
+import re
 import wave
 import argparse
 import numpy as np
 from pydub import AudioSegment
 import soundfile as sf
-import librosa
+
+import instrumentation
+from audio_stream import load_audio, read_resampled_blocks, to_int16
+from corpus_index import EXCLUDED_SPEAKERS, filter_corpus, load_exclusions
+from instrumentation import stage, track_file
+from manifest import Manifest, unique_stems
+from worker_pool import run_tasks
+
+try:
+    from arrow_shards import ArrowShardWriter, shard_filename, write_dataset_metadata
+except ImportError:  # pyarrow et datasets ne sont requis que pour --output_format arrow
+    ArrowShardWriter = None
 
 def check_dependencies():
     """Vérifie si toutes les dépendances nécessaires sont installées"""
-    required = ['numpy', 'pydub', 'soundfile', 'librosa']
+    required = ['numpy', 'pydub', 'soundfile', 'soxr']
     missing = []
     for package in required:
         try:
             __import__(package)
         except ImportError:
             missing.append(package)
-    
+
     # Si des dépendances sont manquantes, lève une erreur
     if missing:
         raise ImportError(f"Dépendances manquantes : {', '.join(missing)}. "
                          f"Veuillez les installer avec : pip install {' '.join(missing)}")
 
-def process_wav_files(input_dir, output_dir, min_duration=10, max_duration=20, sample_rate=16000):
+def collect_wav_files(input_dir):
+    """
+    Parcourt récursivement le répertoire d'entrée et renvoie la liste triée
+    des couples (chemin d'entrée, nom de base de sortie).
+
+    Le tri et l'attribution des noms de sortie se font ici, dans le processus
+    principal, pour que les noms restent identiques quel que soit le nombre
+    de workers. Deux fichiers portant le même nom dans des sous-dossiers
+    différents reçoivent un suffixe `_2`, `_3`, ... au lieu de s'écraser
+    (voir `manifest.unique_stems`).
+    """
+    wav_files = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith('.wav'):
+                wav_files.append(os.path.join(root, filename))
+
+    return list(zip(wav_files, unique_stems(wav_files)))
+
+def split_into_chunks(blocks, sample_rate=16000, min_duration=10, max_duration=20, overlap_duration=2):
+    """
+    Regroupe un flux de blocs mono (déjà à `sample_rate`) en segments de
+    `max_duration` secondes avec `overlap_duration` secondes de recouvrement.
+    Chaque segment est renvoyé dès qu'il est complet ; la mémoire utilisée
+    dépend donc de la taille d'un segment et non de la durée de l'enregistrement.
+    Le dernier segment partiel est conservé s'il dure au moins `min_duration`.
+    """
+    chunk_size = int(sample_rate * max_duration)  # Taille d’un segment en échantillons
+    overlap = int(sample_rate * overlap_duration)  # Recouvrement en échantillons
+    buffer = np.zeros(0, dtype=np.float32)
+    emitted = False
+
+    for block in blocks:
+        buffer = np.concatenate([buffer, block])
+        while len(buffer) >= chunk_size:
+            yield buffer[:chunk_size]
+            emitted = True
+            # Décale le point de départ en prenant en compte le recouvrement
+            buffer = buffer[chunk_size - overlap:]
+
+    # Fin de fichier : ne garde la queue que si elle apporte du signal nouveau
+    has_new_audio = len(buffer) > overlap or not emitted
+    if has_new_audio and len(buffer) / sample_rate >= min_duration:
+        yield buffer
+
+def iter_file_chunks(input_path, min_duration=10, max_duration=20, sample_rate=16000, streaming=False):
+    """
+    Génère les segments d'un fichier sous forme de couples (numéro, signal).
+    Le numéro vaut None quand le fichier, plus court que `max_duration`,
+    est conservé en un seul morceau.
+
+    Avec `streaming=True`, le fichier est lu et rééchantillonné par blocs au
+    lieu d'être chargé entièrement en mémoire ; les segments produits sont
+    identiques à ceux du mode par défaut.
+    """
+    if streaming:
+        # Lecture par blocs : la durée est connue grâce à l'en-tête du fichier
+        info = sf.info(input_path)
+        duration = info.frames / info.samplerate
+        blocks = read_resampled_blocks(input_path, sample_rate)
+    else:
+        # Charge le fichier audio en mono et le rééchantillonne à 16 kHz si besoin
+        # (même résultat que librosa.load + librosa.resample, sans importer librosa)
+        audio, sr = load_audio(input_path, sample_rate)
+
+        # Calcule la durée en secondes
+        duration = len(audio) / sample_rate
+        blocks = [audio]
+
+    if duration <= max_duration:
+        # Si le fichier est plus court que max_duration, le renvoie tel quel
+        yield None, np.concatenate(list(blocks) or [np.zeros(0, dtype=np.float32)])
+    else:
+        # Sinon, le découpe en segments de longueur maximale
+        chunks = split_into_chunks(blocks, sample_rate, min_duration, max_duration)
+        for chunk_num, chunk in enumerate(chunks):
+            yield chunk_num, chunk
+
+def write_recording(input_path, output_path, sample_rate=16000, streaming=False, audio_dtype='float32'):
+    """
+    Écrit un enregistrement entier, rééchantillonné mais non découpé, dans un
+    tableau numpy (`.npy`) que `wav2vec_data.py` projette en mémoire pour en
+    tirer des extraits aléatoires. Le contenu est identique en mode `streaming`
+    (écriture bloc par bloc dans le tableau projeté). Le fichier est écrit sous
+    un nom temporaire puis renommé : une écriture interrompue n'est jamais lue.
+    """
+    convert = to_int16 if audio_dtype == 'int16' else (lambda audio: audio.astype(np.float32))
+    tmp_path = output_path + '.tmp'
+    if streaming:
+        # Longueur connue d'avance grâce à l'en-tête (même arrondi que load_audio)
+        info = sf.info(input_path)
+        length = info.frames
+        if info.samplerate != sample_rate:
+            length = int(np.ceil(info.frames * sample_rate / info.samplerate))
+        output = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=audio_dtype, shape=(length,))
+        position = 0
+        for block in read_resampled_blocks(input_path, sample_rate):
+            block = block[:length - position]
+            with stage('write'):
+                output[position:position + len(block)] = convert(block)
+            position += len(block)
+        output.flush()
+        del output
+    else:
+        audio, sr = load_audio(input_path, sample_rate)
+        with stage('write'):
+            with open(tmp_path, 'wb') as f:
+                np.save(f, convert(audio))
+    os.replace(tmp_path, output_path)
+
+def process_file(input_path, output_stem, output_dir, min_duration=10, max_duration=20, sample_rate=16000,
+                 streaming=False, output_format='wav', audio_dtype='float32'):
+    """
+    Traite un seul fichier WAV et renvoie le quadruplet
+    (traités, exclus, échecs, liste des fichiers écrits).
+    Avec `output_format='npy'`, l'enregistrement est écrit en entier dans un
+    seul fichier `.npy` au lieu d'être découpé en segments WAV.
+
+    Toute exception est interceptée ici : un fichier corrompu est compté comme
+    un échec sans interrompre le reste du traitement (ni le pool de workers).
+    """
+    filename = os.path.basename(input_path)
+    outputs = []  # Fichiers écrits pour cette entrée
+    try:
+        with track_file(input_path):
+            if output_format == 'npy':
+                output_path = os.path.join(output_dir, f"{output_stem}.npy")
+                write_recording(input_path, output_path, sample_rate, streaming, audio_dtype)
+                return 1, 0, 0, [output_path]
+            chunks = iter_file_chunks(input_path, min_duration, max_duration, sample_rate, streaming)
+            for chunk_num, chunk in chunks:
+                suffix = "" if chunk_num is None else f"_chunk{chunk_num}"
+                output_path = os.path.join(output_dir, f"{output_stem}{suffix}.wav")
+                with stage('write'):
+                    sf.write(output_path, chunk, sample_rate)
+                outputs.append(output_path)
+
+    except Exception as e:
+        print(f"Erreur lors du traitement de {filename} : {str(e)}")
+        return len(outputs), 0, 1, outputs
+
+    return len(outputs), 0, 0, outputs
+
+def process_shard(shard_path, files, min_duration=10, max_duration=20, sample_rate=16000,
+                  streaming=False, audio_dtype='float32'):
+    """
+    Écrit les segments d'un groupe de fichiers dans un seul shard Arrow et
+    renvoie le quadruplet (segments écrits, exclus, échecs, [shard]).
+    `files` est une liste de couples (chemin d'entrée, nom de base de sortie).
+    """
+    processed_files = excluded_files = failed_files = 0
+    with ArrowShardWriter(shard_path, audio_dtype) as writer:
+        for input_path, output_stem in files:
+            filename = os.path.basename(input_path)
+            try:
+                with track_file(input_path):
+                    chunks = iter_file_chunks(input_path, min_duration, max_duration, sample_rate, streaming)
+                    for chunk_num, chunk in chunks:
+                        with stage('write'):
+                            writer.write(chunk, output_stem, 0 if chunk_num is None else chunk_num)
+                        processed_files += 1
+            except Exception as e:
+                print(f"Erreur lors du traitement de {filename} : {str(e)}")
+                failed_files += 1
+    return processed_files, excluded_files, failed_files, [shard_path]
+
+def group_into_shards(files, shard_size_mb=500, sample_rate=16000, audio_dtype='float32'):
+    """
+    Répartit les fichiers (dans l'ordre) en groupes dont la taille de sortie
+    estimée, d'après l'en-tête de chaque WAV, ne dépasse pas `shard_size_mb`.
+    """
+    bytes_per_sample = 2 if audio_dtype == 'int16' else 4
+    max_bytes = shard_size_mb * 1024 * 1024
+    groups, current, current_bytes = [], [], 0
+    for input_path, output_stem in files:
+        try:
+            info = sf.info(input_path)
+            estimate = info.frames / info.samplerate * sample_rate * bytes_per_sample
+        except Exception:
+            estimate = 0  # Fichier illisible : l'erreur sera signalée au traitement
+        if current and current_bytes + estimate > max_bytes:
+            groups.append(current)
+            current, current_bytes = [], 0
+        current.append((input_path, output_stem))
+        current_bytes += estimate
+    if current:
+        groups.append(current)
+    return groups
+
+def _process_task(args):
+    """Point d'entrée des workers : dépaquette les arguments de `process_file`"""
+    return process_file(*args)
+
+def _process_shard_task(args):
+    """Point d'entrée des workers en sortie Arrow : dépaquette les arguments de `process_shard`"""
+    return process_shard(*args)
+
+def remove_partial_outputs(output_dir, output_stem):
+    """
+    Supprime les sorties d'un fichier dont le traitement a été abandonné
+    (worker tué, délai dépassé) : segments `<stem>.wav` / `<stem>_chunkN.wav`,
+    enregistrement `<stem>.npy` et son fichier temporaire.
+    """
+    pattern = re.compile(re.escape(output_stem) + r'(_chunk\d+)?\.wav|' + re.escape(output_stem) + r'\.npy(\.tmp)?')
+    for filename in os.listdir(output_dir):
+        if pattern.fullmatch(filename):
+            os.remove(os.path.join(output_dir, filename))
+
+def process_wav_files(input_dir, output_dir, min_duration=10, max_duration=20, sample_rate=16000,
+                      workers=1, timeout=None, streaming=False, incremental=True, use_hash=False,
+                      force=False, output_format='wav', audio_dtype='float32', shard_size_mb=500,
+                      index_path=None, exclusions=EXCLUDED_SPEAKERS):
     """
     Traite les fichiers WAV pour un entraînement wav2vec :
-    - Exclut les fichiers contenant 'Emilie_K' ou 'Fabiano' dans leur nom
+    - Exclut les fichiers dont le nom correspond à `exclusions` (locuteurs réservés au test)
     - Coupe les fichiers en segments de 10 à 20 secondes
     - Rééchantillonne à 16 kHz si nécessaire
     - Sauvegarde les fichiers traités dans un répertoire de sortie
+
+    Avec `streaming=True`, chaque fichier est lu par blocs (mémoire bornée
+    par la taille d'un segment, utile pour les enregistrements de plusieurs heures).
+
+    Avec `workers > 1`, les fichiers sont répartis sur un pool de processus
+    (voir `worker_pool.py`). `timeout` (en secondes) borne le traitement d'un
+    fichier : un worker bloqué ou tué est compté comme un échec au lieu de
+    bloquer tout le pool, et les sorties partielles du fichier sont supprimées.
+
+    Avec `incremental=True`, un manifeste (voir `manifest.py`) permet de sauter
+    les fichiers inchangés depuis la dernière exécution et de supprimer les
+    sorties dont la source a disparu. `use_hash` ajoute une empreinte du contenu,
+    `force` retraite tout le corpus.
+
+    Avec `output_format='arrow'`, les segments sont écrits dans des shards Arrow
+    d'environ `shard_size_mb` Mo (voir `arrow_shards.py`) au lieu d'un WAV par
+    segment ; le répertoire de sortie se charge alors directement avec
+    `datasets.load_from_disk` (utilisé par `train_wav2vec.py`). Ce format est
+    reconstruit à chaque exécution et n'utilise pas le manifeste.
+
+    Avec `index_path`, un index d'empreintes (voir `corpus_index.py`) écarte,
+    avant tout traitement, les doublons (copies, y compris réencodées ou
+    rééchantillonnées) et les copies des fichiers exclus. Les sorties déjà
+    produites pour ces fichiers sont supprimées par le manifeste.
+
+    Avec `output_format='npy'`, chaque enregistrement est écrit entier, sans
+    découpage ni recouvrement, dans un fichier `.npy` : `train_wav2vec.py` en
+    tire alors des extraits aléatoires à chaque époque (voir `wav2vec_data.py`).
     """
     # Crée le répertoire de sortie s'il n'existe pas
     os.makedirs(output_dir, exist_ok=True)
-    
+
     processed_files = 0  # Compteur de fichiers traités
     excluded_files = 0   # Compteur de fichiers exclus
-    
-    # Parcours récursif du répertoire d’entrée
-    for root, _, files in os.walk(input_dir):
-        for filename in files:
-            if filename.lower().endswith('.wav'):
-                # Ignore les fichiers contenant les noms exclus
-                if 'Emilie_K' in filename or 'Fabiano' in filename:
-                    excluded_files += 1
-                    continue
-                
-                input_path = os.path.join(root, filename)
-                
-                try:
-                    # Charge le fichier audio avec librosa
-                    audio, sr = librosa.load(input_path, sr=None, mono=True)
-                    
-                    # Rééchantillonne à 16 kHz si ce n’est pas déjà le cas
-                    if sr != sample_rate:
-                        audio = librosa.resample(audio, orig_sr=sr, target_sr=sample_rate)
-                    
-                    # Calcule la durée en secondes
-                    duration = len(audio) / sample_rate
-                    
-                    if duration <= max_duration:
-                        # Si le fichier est plus court que max_duration, l’enregistre tel quel
-                        output_path = os.path.join(output_dir, f"{os.path.splitext(filename)[0]}.wav")
-                        sf.write(output_path, audio, sample_rate)
-                        processed_files += 1
-                    else:
-                        # Sinon, le découpe en segments de longueur maximale
-                        chunk_size = sample_rate * max_duration  # Taille d’un segment en échantillons
-                        overlap = sample_rate * 2  # Recouvrement de 2 secondes
-                        start = 0
-                        chunk_num = 0
-                        
-                        while start + chunk_size <= len(audio):
-                            end = start + chunk_size
-                            chunk = audio[start:end]
-                            
-                            # Vérifie si le segment respecte la durée minimale
-                            if len(chunk) / sample_rate >= min_duration:
-                                output_path = os.path.join(
-                                    output_dir, 
-                                    f"{os.path.splitext(filename)[0]}_chunk{chunk_num}.wav"
-                                )
-                                sf.write(output_path, chunk, sample_rate)
-                                processed_files += 1
-                                chunk_num += 1
-                            
-                            # Décale le point de départ en prenant en compte le recouvrement
-                            start = end - overlap
-                
-                except Exception as e:
-                    print(f"Erreur lors du traitement de {filename} : {str(e)}")
+    failed_files = 0     # Compteur de fichiers en erreur
+    skipped_files = 0    # Compteur de fichiers inchangés (mode incrémental)
+
+    files = collect_wav_files(input_dir)
+
+    # Exclusions et doublons écartés avant tout décodage coûteux
+    _, ignored = filter_corpus([input_path for input_path, _ in files], index_path, exclusions, workers)
+    excluded_files += sum(reason == 'excluded' for reason, _ in ignored.values())
+    duplicate_files = len(ignored) - excluded_files
+    files = [(input_path, output_stem) for input_path, output_stem in files if input_path not in ignored]
+    manifest = None
+    keys = {}  # Chemin d'entrée -> (clé du manifeste, nom de base de sortie)
+
+    if output_format == 'arrow':
+        if ArrowShardWriter is None:
+            raise ImportError("Dépendances manquantes pour la sortie Arrow. "
+                              "Veuillez les installer avec : pip install pyarrow datasets")
+        # Supprime les shards d'une exécution précédente (leur nombre peut changer)
+        for filename in os.listdir(output_dir):
+            if filename.startswith('data-') and filename.endswith('.arrow'):
+                os.remove(os.path.join(output_dir, filename))
+
+        groups = group_into_shards(files, shard_size_mb, sample_rate, audio_dtype)
+        tasks = [
+            (os.path.join(output_dir, shard_filename(index, len(groups))), group,
+             min_duration, max_duration, sample_rate, streaming, audio_dtype)
+            for index, group in enumerate(groups)
+        ]
+        task_fn = _process_shard_task
+    else:
+        if incremental:
+            params = {
+                'sample_rate': sample_rate,
+                'min_duration': min_duration,
+                'max_duration': max_duration,
+                'overlap': 2,
+            }
+            if output_format == 'npy':
+                params.update(output_format=output_format, audio_dtype=audio_dtype)
+            manifest = Manifest(output_dir, params=params, use_hash=use_hash, force=force)
+
+        tasks = []
+        for input_path, output_stem in files:
+            key = os.path.relpath(input_path, input_dir)
+            keys[input_path] = (key, output_stem)
+            if manifest is not None:
+                if manifest.is_up_to_date(key, input_path, stem=output_stem):
+                    skipped_files += 1
                     continue
-    
+                # Les anciennes sorties sont supprimées avant tout nouveau traitement
+                manifest.forget(key)
+            tasks.append((input_path, output_stem, output_dir, min_duration, max_duration, sample_rate, streaming,
+                          output_format, audio_dtype))
+        task_fn = _process_task
+
+        if manifest is not None:
+            removed = manifest.prune(key for key, _ in keys.values())
+            if removed:
+                print(f"{removed} fichiers sources disparus : sorties correspondantes supprimées.")
+
+    shards = []  # Shards Arrow écrits jusqu'au bout
+    try:
+        # max_tasks_per_child limite l'accumulation de mémoire dans chaque worker
+        for task, result, error in run_tasks(task_fn, tasks, workers, timeout, max_tasks_per_child=50):
+            if error is not None:
+                print(f"Erreur lors du traitement de {os.path.basename(task[0])} : {error}")
+                if output_format != 'arrow':
+                    remove_partial_outputs(output_dir, task[1])
+                result = (0, 0, 1, [])
+            processed, excluded, failed, outputs = result
+            processed_files += processed
+            excluded_files += excluded
+            failed_files += failed
+            if output_format == 'arrow':
+                shards.extend(outputs)
+            elif manifest is not None and not excluded:
+                input_path = task[0]
+                key, output_stem = keys[input_path]
+                manifest.record(key, input_path, outputs, stem=output_stem, complete=not failed)
+    finally:
+        # Sauvegarde même en cas d'interruption : le travail déjà fait n'est pas perdu
+        if manifest is not None:
+            manifest.save()
+
+    if output_format == 'arrow':
+        # Un shard interrompu (worker tué, délai dépassé) serait illisible : il est écarté
+        for task in tasks:
+            if task[0] not in shards and os.path.exists(task[0]):
+                os.remove(task[0])
+        if not write_dataset_metadata(output_dir, [os.path.basename(path) for path in shards],
+                                      audio_dtype, sample_rate):
+            print(f"Aucun shard écrit : {output_dir} ne contient pas de dataset chargeable avec load_from_disk.")
+
     # Affiche un résumé du traitement
-    print(f"Traitement terminé. {processed_files} fichiers traités, {excluded_files} fichiers exclus.")
+    print(f"Traitement terminé. {processed_files} fichiers traités, {excluded_files} fichiers exclus, "
+          f"{duplicate_files} doublons ignorés, {failed_files} fichiers en erreur, "
+          f"{skipped_files} fichiers inchangés ignorés.")
+    return processed_files, excluded_files, failed_files
 
 if __name__ == "__main__":
     # Définit les arguments en ligne de commande attendus
@@ -100,11 +392,46 @@ if __name__ == "__main__":
                        help='Répertoire d’entrée contenant les fichiers WAV')
     parser.add_argument('--output_dir', type=str, required=True,
                        help='Répertoire de sortie pour les fichiers traités')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Nombre de processus parallèles (1 = traitement séquentiel)')
+    parser.add_argument('--timeout', type=float, default=None,
+                       help='Durée maximale de traitement d’un fichier en secondes (mode --workers)')
+    parser.add_argument('--streaming', action='store_true',
+                       help='Lit et rééchantillonne les fichiers par blocs (mémoire bornée)')
+    parser.add_argument('--output_format', choices=['wav', 'arrow', 'npy'], default='wav',
+                       help='wav : un fichier par segment ; arrow : shards chargeables avec datasets.load_from_disk ; '
+                            'npy : un tableau par enregistrement entier, découpé à la volée par train_wav2vec.py')
+    parser.add_argument('--audio_dtype', choices=['float32', 'int16'], default='float32',
+                       help='Type des échantillons en sortie Arrow ou npy (int16 divise la taille par deux)')
+    parser.add_argument('--shard_size_mb', type=int, default=500,
+                       help='Taille cible des shards Arrow en Mo')
+    parser.add_argument('--hash', action='store_true',
+                       help='Compare aussi le contenu des fichiers (SHA-1) pour détecter les changements')
+    parser.add_argument('--force', action='store_true',
+                       help='Retraite tous les fichiers sans tenir compte du manifeste')
+    parser.add_argument('--no_manifest', action='store_true',
+                       help='Désactive le manifeste de relance incrémentale')
+    parser.add_argument('--index', type=str, default=None,
+                       help='Index d’empreintes du corpus (créé ou réutilisé) : ignore les doublons')
+    parser.add_argument('--exclude_list', type=str, default=None,
+                       help='Fichier de motifs d’exclusion, un par ligne (par défaut : '
+                            + ', '.join(EXCLUDED_SPEAKERS) + ')')
+    parser.add_argument('--exclude', action='append', default=[],
+                       help='Motif d’exclusion supplémentaire (sous-chaîne ou motif *, ?)')
+    instrumentation.add_arguments(parser)
     args = parser.parse_args()
-    
+    instrumentation.configure(args.profile_log, args.cprofile)
+
+    exclusions = (load_exclusions(args.exclude_list) if args.exclude_list else EXCLUDED_SPEAKERS) \
+        + tuple(args.exclude)
+
     try:
         check_dependencies()
         print("Toutes les dépendances sont installées.")
-        process_wav_files(args.input_dir, args.output_dir)
+        process_wav_files(args.input_dir, args.output_dir, workers=args.workers, timeout=args.timeout,
+                          streaming=args.streaming, incremental=not args.no_manifest,
+                          use_hash=args.hash, force=args.force, output_format=args.output_format,
+                          audio_dtype=args.audio_dtype, shard_size_mb=args.shard_size_mb,
+                          index_path=args.index, exclusions=exclusions)
     except ImportError as e:
         print(e)
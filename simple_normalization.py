@@ -8,42 +8,146 @@ Objectif : homogénéiser les transcriptions pour faciliter l'entraînement et l
 - Ajout d'espaces entre les mots si besoin
 - Nettoyage des espaces superflus
 
+Le même moteur sert partout (préparation des labels Whisper, calcul du WER,
+prompts de post-correction Gervasio) pour que toutes les étapes voient un
+texte identique. La normalisation se fait en un seul `str.translate` : la
+table de correspondance est remplie à la demande, une fois par caractère
+rencontré, puis les espaces sont fusionnés par `split` / `join`.
+
+Utilisation :
+    python simple_normalization.py --input whisper_kriol_cm.csv --output whisper_kriol_cm_normalized.csv
+    python simple_normalization.py --input corpus.csv --output corpus_norm.csv --workers 8
+
+Le CSV est lu et écrit par blocs de lignes : la mémoire utilisée ne dépend pas
+de la taille du fichier.
+
 Auteur : Daphne Teixeira
 """
 
+import argparse
 import csv
+import multiprocessing
 import re
 
 # === PARAMÈTRES ===
 INPUT_CSV = 'whisper_kriol_cm.csv'  # Fichier d'entrée
 OUTPUT_CSV = 'whisper_kriol_cm_normalized.csv'  # Fichier de sortie
 COLUMN_NAME = 'text'
+PUNCTUATION = '.,!?;:'  # Ponctuation conservée, isolée par des espaces
+CHUNK_SIZE = 10000  # Lignes par bloc en mode flux
+
+# === TABLE DE CORRESPONDANCE ===
+class _NormalizationTable(dict):
+    """
+    Table pour `str.translate`, remplie à la demande : chaque caractère est
+    classé une seule fois (ponctuation isolée, caractère de mot conservé,
+    espace unifié, tout le reste supprimé), puis lu directement dans le dict.
+    """
+
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        if char in PUNCTUATION:
+            value = f" {char} "
+        elif char.isalnum() or char in "_'":
+            value = char
+        elif char.isspace():
+            value = " "
+        else:
+            value = None  # Caractère supprimé
+        self[codepoint] = value
+        return value
+
+_TABLE = _NormalizationTable()
 
 # === FONCTION DE NORMALISATION ===
 def normalize_text(text):
+    return " ".join(text.lower().translate(_TABLE).split())
+
+def normalize_text_regex(text):
+    """Version d'origine en trois `re.sub`, conservée comme référence (voir benchmark_normalization.py)"""
     text = text.lower()
     text = re.sub(r"([.,!?;:])", r" \1 ", text)  # Isoler la ponctuation
     text = re.sub(r"[^\w\s.,!?;:']", "", text)  # Enlever tout autre caractère indésirable
     text = re.sub(r"\s+", " ", text)  # Nettoyer les espaces multiples
     return text.strip()
 
+def normalize_batch(texts):
+    """
+    Normalise une liste de textes, ou une colonne Arrow (`pyarrow.Array` ou
+    `ChunkedArray`, renvoyée sous forme de `pyarrow.Array`). Les valeurs
+    manquantes (None) sont conservées.
+    """
+    if hasattr(texts, 'to_pylist'):
+        import pyarrow as pa
+        return pa.array([None if t is None else normalize_text(t) for t in texts.to_pylist()], type=pa.string())
+    return [None if t is None else normalize_text(t) for t in texts]
+
 # === TRAITEMENT ===
-def normalize_corpus(input_csv, output_csv):
+def _normalize_rows(rows, index):
+    """Normalise la colonne `index` d'un bloc de lignes CSV (exécuté dans les workers)"""
+    for row in rows:
+        if index < len(row):
+            row[index] = normalize_text(row[index])
+    return rows
+
+def _read_chunks(reader, chunk_size):
+    chunk = []
+    for row in reader:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def normalize_corpus(input_csv, output_csv, column=COLUMN_NAME, workers=1, chunk_size=CHUNK_SIZE):
+    """
+    Normalise la colonne `column` d'un CSV, par blocs de `chunk_size` lignes.
+    Avec `workers > 1`, les blocs sont répartis sur un pool de processus ; au
+    plus deux blocs par worker sont en attente, et l'ordre des lignes est conservé.
+    """
+    rows_written = 0
     with open(input_csv, newline='', encoding='utf-8') as f_in, \
          open(output_csv, 'w', newline='', encoding='utf-8') as f_out:
 
-        reader = csv.DictReader(f_in)
-        fieldnames = reader.fieldnames
-        writer = csv.DictWriter(f_out, fieldnames=fieldnames)
-        writer.writeheader()
+        reader = csv.reader(f_in)
+        writer = csv.writer(f_out)
+        header = next(reader)
+        if column not in header:
+            raise ValueError(f"Colonne {column} absente de {input_csv} (colonnes : {', '.join(header)})")
+        index = header.index(column)
+        writer.writerow(header)
 
-        for row in reader:
-            original = row[COLUMN_NAME]
-            row[COLUMN_NAME] = normalize_text(original)
-            writer.writerow(row)
+        chunks = _read_chunks(reader, chunk_size)
+        if workers <= 1:
+            for chunk in chunks:
+                writer.writerows(_normalize_rows(chunk, index))
+                rows_written += len(chunk)
+        else:
+            with multiprocessing.Pool(processes=workers) as pool:
+                pending = []
+                for chunk in chunks:
+                    pending.append(pool.apply_async(_normalize_rows, (chunk, index)))
+                    # Fenêtre bornée : la lecture attend que les blocs les plus anciens soient écrits
+                    while len(pending) >= 2 * workers:
+                        rows = pending.pop(0).get()
+                        writer.writerows(rows)
+                        rows_written += len(rows)
+                for result in pending:
+                    rows = result.get()
+                    writer.writerows(rows)
+                    rows_written += len(rows)
 
-    print(f"Corpus normalisé sauvegardé dans : {output_csv}")
+    print(f"Corpus normalisé sauvegardé dans : {output_csv} ({rows_written} lignes)")
 
 # === EXÉCUTION ===
 if __name__ == '__main__':
-    normalize_corpus(INPUT_CSV, OUTPUT_CSV)
+    parser = argparse.ArgumentParser(description="Normalisation orthographique d'un CSV de transcriptions Kriol")
+    parser.add_argument('--input', type=str, default=INPUT_CSV, help="CSV d'entrée")
+    parser.add_argument('--output', type=str, default=OUTPUT_CSV, help="CSV de sortie")
+    parser.add_argument('--column', type=str, default=COLUMN_NAME, help="Colonne à normaliser")
+    parser.add_argument('--workers', type=int, default=1, help="Nombre de processus")
+    parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE, help="Lignes par bloc")
+    args = parser.parse_args()
+
+    normalize_corpus(args.input, args.output, args.column, args.workers, args.chunk_size)
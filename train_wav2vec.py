@@ -1,71 +1,124 @@
 # Importation des bibliothèques nécessaires
+# transformers et datasets ne sont importés qu'à l'exécution (voir plus bas) :
+# importer ce module ne charge ni modèle ni bibliothèque lourde
+import argparse
 import os
-from transformers import (
-    Wav2Vec2Config,              # Pour configurer le modèle Wav2Vec2
-    Wav2Vec2ForPreTraining,      # Modèle Wav2Vec2 prêt pour l'entraînement auto-supervisé
-    Trainer,                     # Classe pour gérer l’entraînement
-    TrainingArguments,           # Classe pour spécifier les arguments d'entraînement
-    set_seed                     # Pour fixer une graine aléatoire et garantir la reproductibilité
-)
-from datasets import load_from_disk  # Pour charger un jeu de données sauvegardé localement
-import torch
+import numpy as np
 
-# 1. Configuration
-# Fixe la graine aléatoire pour assurer la reproductibilité (résultats constants)
-set_seed(42)
+import instrumentation
+from instrumentation import stage
+
+# Répertoires par défaut (cluster)
+DATA_DIR = "/home/dgoncalves/wav_files/processed_16k"  # Enregistrements .npy ou dataset prétraité (pre-process.py)
+OUTPUT_DIR = "/home/dgoncalves/wav2vec_output"          # Répertoire de sortie pour le modèle sauvegardé
 
+# 1. Configuration
 # Création d'une configuration personnalisée pour le modèle Wav2Vec2
-config = Wav2Vec2Config(
-    hidden_size=768,                 # Taille des vecteurs cachés (représentations internes)
-    num_hidden_layers=12,           # Nombre de couches de transformeurs dans l'encodeur
-    num_attention_heads=12,         # Nombre de têtes d'attention par couche
-    intermediate_size=3072,         # Taille de la couche intermédiaire dans le feed-forward
-    hidden_act="gelu",              # Fonction d'activation utilisée dans les couches cachées
-    hidden_dropout=0.1,             # Pourcentage de dropout appliqué aux couches cachées
-    mask_time_prob=0.065,           # Proportion du signal audio à masquer pendant l'entraînement
-    mask_time_length=10,            # Longueur des blocs à masquer (en trames audio)
-    num_negatives=100,              # Nombre d'exemples négatifs utilisés pour la perte contrastive
-    contrastive_logits_temperature=0.1  # Température pour la distribution des logits contrastifs
-)
-
-# 2. Initialisation du modèle
-# Instancie le modèle Wav2Vec2 avec la configuration définie ci-dessus
-model = Wav2Vec2ForPreTraining(config)
+def build_config():
+    from transformers import Wav2Vec2Config
+
+    return Wav2Vec2Config(
+        hidden_size=768,                 # Taille des vecteurs cachés (représentations internes)
+        num_hidden_layers=12,           # Nombre de couches de transformeurs dans l'encodeur
+        num_attention_heads=12,         # Nombre de têtes d'attention par couche
+        intermediate_size=3072,         # Taille de la couche intermédiaire dans le feed-forward
+        hidden_act="gelu",              # Fonction d'activation utilisée dans les couches cachées
+        hidden_dropout=0.1,             # Pourcentage de dropout appliqué aux couches cachées
+        mask_time_prob=0.065,           # Proportion du signal audio à masquer pendant l'entraînement
+        mask_time_length=10,            # Longueur des blocs à masquer (en trames audio)
+        num_negatives=100,              # Nombre d'exemples négatifs utilisés pour la perte contrastive
+        contrastive_logits_temperature=0.1  # Température pour la distribution des logits contrastifs
+    )
 
 # 3. Préparation du jeu de données
-# Fonction pour charger un dataset depuis le disque (prétraité au format HuggingFace)
+# Convertit à la volée les segments stockés en PCM 16 bits vers des flottants dans [-1, 1]
+def int16_to_float32(batch):
+    batch["input_values"] = [np.asarray(x, dtype=np.float32) / 32767.0 for x in batch["input_values"]]
+    return batch
+
+# Fonction pour charger un dataset de segments depuis le disque (prétraité au format HuggingFace,
+# par exemple avec `pre-process.py --output_format arrow`)
 def prepare_dataset(data_dir):
-    dataset = load_from_disk(data_dir)  # Charge le dataset à partir du répertoire donné
+    from datasets import load_from_disk  # Pour charger un jeu de données sauvegardé localement
+
+    dataset = load_from_disk(data_dir)  # Charge le dataset à partir du répertoire donné (memory-map, sans copie)
+    features = dataset.features.get("input_values")
+    if features is not None and getattr(features.feature, "dtype", None) == "int16":
+        dataset.set_transform(int16_to_float32)
     return dataset
 
 # 4. Définition des arguments d'entraînement
-training_args = TrainingArguments(
-    output_dir="/home/dgoncalves/wav2vec_output",         # Répertoire de sortie pour le modèle sauvegardé
-    logging_dir="/home/dgoncalves/wav2vec_output/logs",   # Répertoire de logs (pour TensorBoard, etc.)
-    per_device_train_batch_size=16,                       # Taille du batch par GPU (ou CPU si pas de GPU)
-    gradient_accumulation_steps=2,                        # Nombre d'étapes d'accumulation de gradient avant mise à jour
-    learning_rate=5e-5,                                   # Taux d’apprentissage initial
-    warmup_steps=1000,                                    # Nombre d'étapes pour le *warmup* du taux d'apprentissage
-    max_steps=50000,                                      # Nombre total d’étapes d'entraînement
-    save_steps=10000,                                     # Fréquence de sauvegarde du modèle
-    logging_steps=100,                                    # Fréquence d'enregistrement des logs
-    fp16=True,                                            # Active le calcul en précision mixte (float16) pour accélérer l'entraînement
-    dataloader_num_workers=8,                             # Nombre de workers pour charger les données en parallèle
-    report_to="tensorboard",                              # Spécifie l’outil de suivi utilisé (ici TensorBoard)
-    remove_unused_columns=False                           # Ne supprime pas les colonnes inutilisées du dataset
-)
+def build_training_args(output_dir):
+    from transformers import TrainingArguments
+
+    return TrainingArguments(
+        output_dir=output_dir,                                # Répertoire de sortie pour le modèle sauvegardé
+        logging_dir=os.path.join(output_dir, "logs"),         # Répertoire de logs (pour TensorBoard, etc.)
+        per_device_train_batch_size=16,                       # Taille du batch par GPU (segments ; les extraits aléatoires sont groupés par --batch_seconds)
+        gradient_accumulation_steps=2,                        # Nombre d'étapes d'accumulation de gradient avant mise à jour
+        learning_rate=5e-5,                                   # Taux d’apprentissage initial
+        warmup_steps=1000,                                    # Nombre d'étapes pour le *warmup* du taux d'apprentissage
+        max_steps=50000,                                      # Nombre total d’étapes d'entraînement
+        save_steps=10000,                                     # Fréquence de sauvegarde du modèle
+        logging_steps=100,                                    # Fréquence d'enregistrement des logs
+        fp16=True,                                            # Active le calcul en précision mixte (float16) pour accélérer l'entraînement
+        dataloader_num_workers=8,                             # Nombre de workers pour charger les données en parallèle
+        dataloader_prefetch_factor=4,                         # Lots préparés d'avance par chaque worker
+        report_to="tensorboard",                              # Spécifie l’outil de suivi utilisé (ici TensorBoard)
+        remove_unused_columns=False                           # Ne supprime pas les colonnes inutilisées du dataset
+    )
 
 # 5. Lancement de l'entraînement
-print("===== DÉBUT DE L'ENTRAÎNEMENT =====")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pré-entraînement auto-supervisé de Wav2Vec2")
+    parser.add_argument("--data_dir", type=str, default=DATA_DIR,
+                        help="Enregistrements .npy (pre-process.py --output_format npy) ou dataset prétraité (load_from_disk)")
+    parser.add_argument("--output_dir", type=str, default=OUTPUT_DIR, help="Répertoire de sortie du modèle")
+    parser.add_argument("--min_crop", type=float, default=10.0, help="Durée minimale d'un extrait aléatoire (secondes)")
+    parser.add_argument("--max_crop", type=float, default=20.0, help="Durée maximale d'un extrait aléatoire (secondes)")
+    parser.add_argument("--batch_seconds", type=float, default=320.0,
+                        help="Audio par lot d'extraits aléatoires, padding compris (secondes)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args.profile_log, args.cprofile)
+
+    from transformers import Wav2Vec2ForPreTraining, set_seed
+    from wav2vec_data import CropTrainer, PretrainingCollator, RandomCropDataset
+
+    # Fixe la graine aléatoire pour assurer la reproductibilité (résultats constants)
+    set_seed(42)
+
+    # 2. Initialisation du modèle
+    # Instancie le modèle Wav2Vec2 avec la configuration définie ci-dessus
+    config = build_config()
+    with stage("load"):
+        model = Wav2Vec2ForPreTraining(config)
+
+    # Le collateur calcule les masques temporels et les négatifs à partir de la configuration
+    collator = PretrainingCollator(config)
+    if any(filename.endswith(".npy") for filename in os.listdir(args.data_dir)):
+        # Enregistrements entiers : extraits aléatoires à chaque époque, lots formés dans les workers
+        train_dataset = RandomCropDataset(args.data_dir, args.min_crop, args.max_crop, args.batch_seconds,
+                                          collator=collator)
+        data_collator = None
+        print(f"{len(train_dataset.paths)} enregistrements ({train_dataset.total_seconds() / 3600:.1f} h), "
+              f"{train_dataset.crops_per_epoch} extraits par époque")
+    else:
+        train_dataset = prepare_dataset(args.data_dir)  # Chargement du dataset de segments
+        data_collator = collator
+
+    print("===== DÉBUT DE L'ENTRAÎNEMENT =====")
 
-# Création d'une instance de Trainer, qui gère le processus d'entraînement
-trainer = Trainer(
-    model=model,                                          # Le modèle à entraîner
-    args=training_args,                                   # Les paramètres d’entraînement définis plus haut
-    train_dataset=prepare_dataset("/home/dgoncalves/wav_files/processed_16k")  # Chargement du dataset
-)
+    # Création d'une instance de Trainer, qui gère le processus d'entraînement
+    trainer = CropTrainer(
+        model=model,                                          # Le modèle à entraîner
+        args=build_training_args(args.output_dir),            # Les paramètres d’entraînement définis plus haut
+        train_dataset=train_dataset,                          # Extraits aléatoires ou segments prétraités
+        data_collator=data_collator                           # Masquage et négatifs (segments prétraités)
+    )
 
-# Démarre réellement l'entraînement du modèle
-trainer.train()
+    # Démarre réellement l'entraînement du modèle
+    with stage("train"):
+        trainer.train()
 
-print("===== ENTRAÎNEMENT TERMINÉ =====")
+    print("===== ENTRAÎNEMENT TERMINÉ =====")
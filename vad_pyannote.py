@@ -1,71 +1,541 @@
 import os
-import torch
 import argparse
+import collections
 import numpy as np
 import soundfile as sf
-import librosa
-from pyannote.audio import Pipeline
-from pyannote.core import Segment, Annotation
 
-# Charger le pipeline VAD
-pipeline = Pipeline.from_pretrained("pyannote/voice-activity-detection",
-                                    use_auth_token=True)
+import instrumentation
+from audio_stream import load_audio, read_resampled_blocks
+from corpus_index import filter_corpus, load_exclusions
+from instrumentation import stage, track_file
+from manifest import Manifest, unique_stems
+from worker_pool import run_tasks
 
-def write_rttm(filename, annotation):
-    """Écrit les segments dans un fichier RTTM"""
-    with open(filename, 'w') as f:
-        for turn, _, speaker in annotation.itertracks(yield_label=True):
-            f.write(f"SPEAKER {os.path.splitext(os.path.basename(filename))[0]} 1 {turn.start:.3f} {turn.duration:.3f} <NA> <NA> {speaker} <NA> <NA>\n")
+# Modèle VAD pyannote
+VAD_MODEL = "pyannote/voice-activity-detection"
 
-def apply_vad(input_dir, output_dir, sample_rate=16000, min_segment_duration=0.5):
+# Backends de détection :
+# - pyannote : modèle neuronal sur tout le signal (jeton Hugging Face requis)
+# - energy : seuils d'énergie et de passage par zéro, NumPy seul, sans modèle
+# - hybrid : la VAD par énergie repère les régions candidates, pyannote ne tourne que sur elles
+VAD_BACKENDS = ("pyannote", "energy", "hybrid")
+
+# Paramètres de la VAD par énergie
+FRAME_DURATION = 0.03     # Durée d'une trame d'analyse (secondes)
+HOP_DURATION = 0.01       # Pas entre deux trames (secondes)
+HIGH_MARGIN_DB = 12.0     # Seuil de déclenchement, au-dessus du bruit de fond
+LOW_MARGIN_DB = 6.0       # Seuil de maintien (hystérésis), au-dessus du bruit de fond
+ZCR_MARGIN_DB = 3.0       # Énergie minimale des trames sourdes (fricatives) retenues par leur ZCR
+ZCR_THRESHOLD = 0.25      # Taux de passage par zéro (par échantillon) d'une trame sourde
+FLOOR_PERCENTILE = 10     # Percentile des énergies de trames pris comme bruit de fond
+FLOOR_RANGE_DB = (-70.0, -40.0)  # Bornes du bruit de fond estimé (dBFS)
+HANGOVER = 0.3            # Maintien après la dernière trame active (secondes)
+PREROLL = 0.1             # Marge ajoutée avant chaque région (attaques faibles)
+PREFILTER_PADDING = 1.0   # Contexte ajouté autour des régions candidates passées à pyannote (mode hybrid)
+
+# Le pipeline est chargé à la demande, une seule fois par processus (voir get_pipeline)
+_pipeline = None
+
+def get_pipeline():
+    """Charge le pipeline VAD au premier appel puis le réutilise"""
+    global _pipeline
+    if _pipeline is None:
+        # Import différé : le backend energy n'a besoin ni de torch, ni de pyannote, ni d'un jeton Hugging Face
+        from pyannote.audio import Pipeline
+        _pipeline = Pipeline.from_pretrained(VAD_MODEL, use_auth_token=True)
+    return _pipeline
+
+def init_worker(num_threads):
+    """Initialise un worker : limite les threads torch pour ne pas surcharger les cœurs"""
+    if num_threads is None:  # Backend energy : torch n'est pas utilisé
+        return
+    import torch
+    torch.set_num_threads(num_threads)
+
+def write_rttm(filename, turns):
+    """Écrit les segments (étiquette, début, fin) dans un fichier RTTM (écriture atomique)"""
+    tmp_path = f"{filename}.part"
+    with open(tmp_path, 'w') as f:
+        for speaker, start, end in sorted(turns, key=lambda turn: (turn[1], turn[2])):
+            f.write(f"SPEAKER {os.path.splitext(os.path.basename(filename))[0]} 1 {start:.3f} {end - start:.3f} <NA> <NA> {speaker} <NA> <NA>\n")
+    os.replace(tmp_path, filename)
+
+def output_names(input_paths):
+    """
+    Nom du WAV filtré de chaque fichier d'entrée (le RTTM reprend le même nom
+    de base), dans l'ordre donné. Deux fichiers de même nom dans des
+    sous-dossiers différents reçoivent un suffixe `_2`, `_3`, ... (voir
+    `manifest.unique_stems`) au lieu d'écraser mutuellement leurs sorties.
+    """
+    input_paths = list(input_paths)
+    return {input_path: stem + os.path.splitext(input_path)[1]
+            for input_path, stem in zip(input_paths, unique_stems(input_paths))}
+
+def remove_partial_outputs(output_dir, filename):
+    """Supprime les sorties (finales ou `.part`) d'un fichier dont la VAD a échoué ou a été abandonnée"""
+    rttm_path = os.path.join(output_dir, "rttm", f"{os.path.splitext(filename)[0]}.rttm")
+    for path in (os.path.join(output_dir, filename), rttm_path):
+        for candidate in (path, f"{path}.part"):
+            if os.path.exists(candidate):
+                os.remove(candidate)
+
+def write_wav(filename, audio, sample_rate):
+    """Écrit un fichier WAV de façon atomique : aucun fichier à moitié écrit en cas d'interruption"""
+    tmp_path = f"{filename}.part"
+    sf.write(tmp_path, audio, sample_rate, format='WAV')
+    os.replace(tmp_path, filename)
+
+def frame_features(audio, sample_rate=16000, frame_duration=FRAME_DURATION, hop_duration=HOP_DURATION):
+    """
+    Énergie (dBFS) et taux de passage par zéro de chaque trame, calculés par
+    sommes cumulées : aucune copie des trames, coût linéaire en la durée.
+    """
+    frame = max(1, int(frame_duration * sample_rate))
+    hop = max(1, int(hop_duration * sample_rate))
+    audio = np.asarray(audio, dtype=np.float32)
+    if len(audio) < frame:
+        return np.zeros(0), np.zeros(0), hop
+    starts = np.arange(0, len(audio) - frame + 1, hop)
+
+    power = np.concatenate([[0.0], np.cumsum(np.square(audio, dtype=np.float64))])
+    energy_db = 10 * np.log10((power[starts + frame] - power[starts]) / frame + 1e-10)
+
+    crossings = np.concatenate([[0], np.cumsum(np.signbit(audio[1:]) != np.signbit(audio[:-1]))])
+    zcr = (crossings[starts + frame - 1] - crossings[starts]) / (frame - 1 if frame > 1 else 1)
+    return energy_db, zcr, hop
+
+def energy_vad(audio, sample_rate=16000, frame_duration=FRAME_DURATION, hop_duration=HOP_DURATION,
+               high_margin_db=HIGH_MARGIN_DB, low_margin_db=LOW_MARGIN_DB, hangover=HANGOVER, preroll=PREROLL):
+    """
+    VAD par énergie et passage par zéro, vectorisée avec NumPy. Renvoie les
+    régions de parole (début, fin) en secondes, triées.
+
+    Les seuils sont relatifs au bruit de fond de l'enregistrement (percentile
+    bas des énergies de trames). Hystérésis : une région est faite de trames
+    au-dessus du seuil bas (ou sourdes : ZCR élevé, énergie faible mais non
+    nulle) et doit contenir au moins une trame au-dessus du seuil haut. Les
+    régions sont prolongées de `hangover` secondes (et avancées de
+    `preroll`), ce qui recolle aussi les pauses courtes entre syllabes.
+    """
+    energy_db, zcr, hop = frame_features(audio, sample_rate, frame_duration, hop_duration)
+    if len(energy_db) == 0:
+        return []
+    floor = np.clip(np.percentile(energy_db, FLOOR_PERCENTILE), *FLOOR_RANGE_DB)
+    high = energy_db >= floor + high_margin_db
+    low = (energy_db >= floor + low_margin_db) | ((zcr >= ZCR_THRESHOLD) & (energy_db >= floor + ZCR_MARGIN_DB))
+    low |= high
+
+    # Plages continues de trames « basses », conservées si elles contiennent une trame « haute »
+    edges = np.diff(np.concatenate([[0], low.astype(np.int8), [0]]))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    high_count = np.concatenate([[0], np.cumsum(high)])
+    keep = high_count[ends] > high_count[starts]
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return []
+
+    # Maintien : prolonge les régions puis fusionne celles qui se recouvrent
+    frame_seconds = max(1, int(frame_duration * sample_rate)) / sample_rate
+    hop_seconds = hop / sample_rate
+    start_s = np.maximum(starts * hop_seconds - preroll, 0.0)
+    end_s = np.minimum((ends - 1) * hop_seconds + frame_seconds + hangover, len(audio) / sample_rate)
+    breaks = np.flatnonzero(start_s[1:] > end_s[:-1])
+    first = np.concatenate([[0], breaks + 1])
+    last = np.concatenate([breaks, [len(end_s) - 1]])
+    return [(float(s), float(e)) for s, e in zip(start_s[first], end_s[last])]
+
+def pyannote_regions(audio, sample_rate=16000):
+    """Régions de parole (début, fin) en secondes détectées par le pipeline pyannote"""
+    import torch
+    waveform = torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32)).unsqueeze(0)
+    vad_result = get_pipeline()({"waveform": waveform, "sample_rate": sample_rate})
+    return [(turn.start, turn.end) for turn in vad_result.get_timeline()]
+
+def speech_regions(audio, sample_rate=16000, backend="pyannote"):
+    """
+    Régions de parole (début, fin) en secondes, relatives au début de `audio`,
+    avec le backend choisi (voir VAD_BACKENDS). En mode `hybrid`, pyannote ne
+    reçoit que les régions candidates de `energy_vad`, élargies de
+    `PREFILTER_PADDING` secondes : les longs silences ne passent plus par le modèle.
+    """
+    if backend == "pyannote":
+        return pyannote_regions(audio, sample_rate)
+    if backend == "energy":
+        return energy_vad(audio, sample_rate)
+    if backend != "hybrid":
+        raise ValueError(f"Backend VAD inconnu : {backend} (attendu : {', '.join(VAD_BACKENDS)})")
+
+    candidates = energy_vad(audio, sample_rate, hangover=PREFILTER_PADDING, preroll=PREFILTER_PADDING)
+    regions = []
+    for start_s, end_s in candidates:
+        first, last = int(start_s * sample_rate), int(end_s * sample_rate)
+        offset = first / sample_rate
+        regions.extend((offset + start, offset + end)
+                       for start, end in pyannote_regions(audio[first:last], sample_rate))
+    return regions
+
+def detect_speech(audio, sample_rate=16000, min_segment_duration=0.5, backend="pyannote"):
+    """
+    Applique la VAD à un signal en mémoire (numpy mono) et renvoie les régions
+    de parole retenues, sous forme de triplets (étiquette, début, fin) en secondes.
+    """
+    with stage("vad", audio_seconds=len(audio) / sample_rate):
+        regions = speech_regions(audio, sample_rate, backend)
+
+    turns = []
+    for i, (start_s, end_s) in enumerate(regions):
+        start = max(0, int(start_s * sample_rate))
+        end = min(len(audio), int(end_s * sample_rate))
+        duration = (end - start) / sample_rate
+        if duration >= min_segment_duration:
+            turns.append((f"SPEAKER_{i:02d}", start_s, end_s))
+    return turns
+
+def save_vad_outputs(filename, audio, turns, output_dir, sample_rate=16000):
+    """
+    Écrit la parole concaténée (`output_dir/filename`) et le RTTM
+    (`output_dir/rttm/`) des régions `turns` ; renvoie les fichiers écrits.
+    """
+    speech_segments = []
+    for label, start_s, end_s in turns:
+        start = max(0, int(start_s * sample_rate))
+        end = min(len(audio), int(end_s * sample_rate))
+        speech_segments.append(audio[start:end])
+
+    with stage("write"):
+        # Sauvegarder audio filtré
+        output_audio_path = os.path.join(output_dir, filename)
+        write_wav(output_audio_path, np.concatenate(speech_segments), sample_rate)
+
+        # Sauvegarder le fichier RTTM
+        rttm_dir = os.path.join(output_dir, "rttm")
+        os.makedirs(rttm_dir, exist_ok=True)
+        rttm_path = os.path.join(rttm_dir, f"{os.path.splitext(filename)[0]}.rttm")
+        write_rttm(rttm_path, turns)
+
+    return [output_audio_path, rttm_path]
+
+def vad_file(input_path, output_dir, sample_rate=16000, min_segment_duration=0.5,
+             streaming=False, window_duration=120, window_overlap=10, backend="pyannote", output_name=None):
+    """
+    Applique la VAD à un seul fichier et renvoie le couple
+    (nombre de segments parlés, fichiers écrits).
+    Les sorties sont nommées `output_name` (par défaut : nom du fichier d'entrée,
+    voir `output_names`).
+    Avec `streaming=True`, délègue à `vad_file_streaming` (mémoire bornée).
+    """
+    output_name = output_name or os.path.basename(input_path)
+    with track_file(input_path):
+        if streaming:
+            return vad_file_streaming(input_path, output_dir, sample_rate, min_segment_duration,
+                                      window_duration, window_overlap, backend, output_name)
+
+        # Charger l'audio (même résultat que librosa.load(sr=sample_rate))
+        audio, sr = load_audio(input_path, sample_rate)
+        turns = detect_speech(audio, sample_rate, min_segment_duration, backend)
+        if not turns:
+            return 0, []
+
+        return len(turns), save_vad_outputs(output_name, audio, turns, output_dir, sample_rate)
+
+def vad_file_streaming(input_path, output_dir, sample_rate=16000, min_segment_duration=0.5,
+                       window_duration=120, window_overlap=10, backend="pyannote", output_name=None):
+    """
+    Variante en flux de `vad_file` pour les enregistrements de plusieurs heures.
+
+    L'audio est lu par blocs et la VAD tourne sur des fenêtres de
+    `window_duration` secondes qui se recouvrent de `window_overlap` secondes.
+    Dans chaque recouvrement, la frontière est placée au milieu : la fenêtre
+    de gauche décide avant, celle de droite après, et une région de parole
+    coupée par la frontière est recollée. Les échantillons de parole et les
+    lignes RTTM sont écrits dès qu'une région est connue ; la mémoire reste
+    bornée par la taille d'une fenêtre.
+
+    Les temps RTTM sont absolus et calculés comme dans `vad_file` ; un fichier
+    plus court qu'une fenêtre donne exactement le même résultat.
+    Renvoie le couple (nombre de segments parlés, fichiers écrits).
+    """
+    filename = output_name or os.path.basename(input_path)
+    uri = os.path.splitext(filename)[0]
+    output_audio_path = os.path.join(output_dir, filename)
+    rttm_path = os.path.join(output_dir, "rttm", f"{uri}.rttm")
+
+    window = int(window_duration * sample_rate)
+    overlap = int(window_overlap * sample_rate)
+    step = window - overlap
+    if step <= 0:
+        raise ValueError("window_overlap doit être inférieur à window_duration")
+
+    buffer = np.zeros(0, dtype=np.float32)
+    buffer_start = 0      # Position absolue (en échantillons) de buffer[0]
+    window_start = 0      # Début absolu de la prochaine fenêtre
+    total = 0             # Nombre d'échantillons lus jusqu'ici
+
+    audio_out = None      # Fichier WAV de sortie, ouvert au premier segment retenu
+    rttm_out = open(f"{rttm_path}.part", 'w')
+    state = {
+        "open": None,     # Région en cours [début, fin] en secondes, pas encore fermée
+        "written": 0,     # Premier échantillon de la région ouverte pas encore écrit
+        "turns": 0,       # Nombre de régions vues (numérotation SPEAKER_xx)
+        "kept": 0,        # Nombre de régions retenues
+    }
+
+    def write_samples(start, end):
+        nonlocal audio_out
+        if end <= start:
+            return
+        if audio_out is None:
+            audio_out = sf.SoundFile(f"{output_audio_path}.part", 'w', samplerate=sample_rate,
+                                     channels=1, format='WAV')
+        with stage("write"):
+            audio_out.write(buffer[start - buffer_start:end - buffer_start])
+
+    def confirmed(start_s, end_s):
+        # Même critère que vad_file
+        start = max(0, int(start_s * sample_rate))
+        end = min(total, int(end_s * sample_rate))
+        return (end - start) / sample_rate >= min_segment_duration
+
+    def close_region():
+        region = state["open"]
+        if region is None:
+            return
+        start_s, end_s = region
+        if confirmed(start_s, end_s):
+            start = max(state["written"], int(start_s * sample_rate))
+            write_samples(start, min(total, int(end_s * sample_rate)))
+            rttm_out.write(f"SPEAKER {uri} 1 {start_s:.3f} {end_s - start_s:.3f} <NA> <NA> "
+                           f"SPEAKER_{state['turns']:02d} <NA> <NA>\n")
+            state["kept"] += 1
+        state["turns"] += 1
+        state["open"] = None
+
+    def process_window(is_last):
+        window_audio = buffer[window_start - buffer_start:window_start - buffer_start + window]
+        with stage("vad"):
+            regions = speech_regions(window_audio, sample_rate, backend)
+
+        # Zone de décision de cette fenêtre : milieu du recouvrement de chaque côté
+        offset = window_start / sample_rate
+        commit_from = 0.0 if window_start == 0 else (window_start + overlap // 2) / sample_rate
+        commit_to = float("inf") if is_last else (window_start + step + overlap // 2) / sample_rate
+
+        for turn_start, turn_end in regions:
+            start_s = max(offset + turn_start, commit_from)
+            end_s = min(offset + turn_end, commit_to)
+            if end_s <= start_s:
+                continue
+            region = state["open"]
+            if region is not None and region[1] == commit_from and start_s == commit_from:
+                # Région coupée par la frontière entre deux fenêtres : on la recolle
+                region[1] = end_s
+            else:
+                close_region()
+                state["open"] = [start_s, end_s]
+                state["written"] = int(start_s * sample_rate)
+
+        region = state["open"]
+        if region is not None and region[1] < commit_to:
+            close_region()
+        elif region is not None and confirmed(*region):
+            # Région longue encore ouverte : ses échantillons sont écrits sans attendre
+            end = int(region[1] * sample_rate)
+            write_samples(state["written"], end)
+            state["written"] = end
+
+    try:
+        for block in read_resampled_blocks(input_path, sample_rate):
+            buffer = np.concatenate([buffer, block])
+            total += len(block)
+            while total >= window_start + window:
+                process_window(is_last=False)
+                window_start += step
+                # Ne garde que la prochaine fenêtre et la partie non écrite de la région ouverte
+                keep_from = window_start
+                if state["open"] is not None:
+                    keep_from = min(keep_from, state["written"])
+                buffer = buffer[keep_from - buffer_start:]
+                buffer_start = keep_from
+
+        if total > window_start:
+            process_window(is_last=True)
+        close_region()
+    except BaseException:
+        rttm_out.close()
+        os.remove(f"{rttm_path}.part")
+        if audio_out is not None:
+            audio_out.close()
+            os.remove(f"{output_audio_path}.part")
+        raise
+
+    rttm_out.close()
+    if audio_out is None:
+        os.remove(f"{rttm_path}.part")
+        return 0, []
+
+    # Écriture atomique : les fichiers n'apparaissent qu'une fois complets
+    audio_out.close()
+    os.replace(f"{output_audio_path}.part", output_audio_path)
+    os.replace(f"{rttm_path}.part", rttm_path)
+    return state["kept"], [output_audio_path, rttm_path]
+
+def _vad_task(args):
+    """Point d'entrée des workers : renvoie (segments, fichiers écrits, erreur éventuelle)"""
+    try:
+        num_segments, outputs = vad_file(*args)
+        return num_segments, outputs, None
+    except Exception as e:
+        return 0, [], str(e)
+
+def apply_vad(input_dir, output_dir, sample_rate=16000, min_segment_duration=0.5,
+              incremental=True, use_hash=False, force=False,
+              workers=1, threads_per_worker=None, timeout=None,
+              streaming=False, window_duration=120, window_overlap=10, backend="pyannote",
+              index_path=None, exclusions=()):
+    """
+    Applique la VAD à tous les fichiers WAV de `input_dir`.
+
+    Avec `incremental=True`, un manifeste (voir `manifest.py`) permet de sauter
+    les fichiers inchangés depuis la dernière exécution et de supprimer les
+    sorties dont la source a disparu.
+
+    Avec `workers > 1`, les fichiers sont répartis sur un pool de processus
+    (voir `worker_pool.py`) ; chaque worker charge son propre pipeline au
+    premier fichier et utilise `threads_per_worker` threads torch (par défaut :
+    cœurs / workers). `timeout` (en secondes) borne le traitement d'un
+    fichier ; un worker bloqué ou tué fait échouer son seul fichier, dont les
+    sorties partielles sont supprimées.
+
+    Les sorties portent le nom du fichier d'entrée, suffixé `_2`, `_3`, ...
+    quand plusieurs sous-dossiers contiennent le même nom (voir `output_names`).
+
+    Avec `streaming=True`, la VAD tourne sur des fenêtres glissantes
+    (voir `vad_file_streaming`) : la mémoire ne dépend plus de la durée des
+    enregistrements.
+
+    `backend` choisit la détection (voir `speech_regions`) : `energy` se
+    passe de pyannote, `hybrid` ne lui soumet que les régions candidates.
+
+    Les fichiers dont le nom correspond à `exclusions` sont ignorés. Avec
+    `index_path`, un index d'empreintes (voir `corpus_index.py`) écarte aussi
+    les doublons et les copies des fichiers exclus, avant toute VAD.
+    """
+    if backend not in VAD_BACKENDS:
+        raise ValueError(f"Backend VAD inconnu : {backend} (attendu : {', '.join(VAD_BACKENDS)})")
     os.makedirs(output_dir, exist_ok=True)
     rttm_dir = os.path.join(output_dir, "rttm")
     os.makedirs(rttm_dir, exist_ok=True)
 
-    for root, _, files in os.walk(input_dir):
-        for filename in files:
-            if not filename.lower().endswith(".wav"):
-                continue
+    manifest = None
+    if incremental:
+        params = {
+            "sample_rate": sample_rate,
+            "min_segment_duration": min_segment_duration,
+        }
+        if streaming:
+            params.update(window_duration=window_duration, window_overlap=window_overlap)
+        if backend != "pyannote":
+            params["backend"] = backend
+        manifest = Manifest(output_dir, params=params, use_hash=use_hash, force=force)
+    current_keys = []
+    skipped_files = 0
+
+    input_paths = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        input_paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(".wav"))
 
-            input_path = os.path.join(root, filename)
-            try:
-                # Charger l'audio
-                audio, sr = librosa.load(input_path, sr=sample_rate)
-                vad_result = pipeline({"waveform": torch.tensor(audio).unsqueeze(0), "sample_rate": sample_rate})
+    # Noms attribués sur toute la liste : ils ne changent pas quand un fichier est exclu
+    names = output_names(input_paths)
+    stem_counts = collections.Counter(os.path.splitext(os.path.basename(p))[0] for p in input_paths)
 
-                # Annotation pyannote pour RTTM
-                annotation = Annotation(uri=os.path.splitext(filename)[0])
+    # Exclusions et doublons écartés avant la VAD (leurs anciennes sorties sont supprimées par le manifeste)
+    _, ignored = filter_corpus(input_paths, index_path, exclusions, workers)
+    for input_path, (reason, original) in ignored.items():
+        detail = f" (copie de {os.path.basename(original)})" if original else ""
+        print(f"[~] {os.path.basename(input_path)} ignoré : {'doublon' if reason == 'duplicate' else 'exclu'}{detail}")
 
-                speech_segments = []
-                for i, turn in enumerate(vad_result.get_timeline()):
-                    start = max(0, int(turn.start * sample_rate))
-                    end = min(len(audio), int(turn.end * sample_rate))
-                    duration = (end - start) / sample_rate
-                    if duration >= min_segment_duration:
-                        speech_segments.append(audio[start:end])
-                        annotation[Segment(turn.start, turn.end)] = f"SPEAKER_{i:02d}"
+    tasks = []
+    for input_path in input_paths:
+        if input_path in ignored:
+            continue
+        key = os.path.relpath(input_path, input_dir)
+        stem = os.path.splitext(names[input_path])[0]
+        current_keys.append(key)
+        if manifest is not None:
+            entry = manifest.entries.get(key)
+            if entry is not None and "stem" not in entry and stem_counts[stem] == 1:
+                # Manifeste antérieur aux noms uniques : sans homonyme, les sorties portaient déjà ce nom
+                entry["stem"] = stem
+            if manifest.is_up_to_date(key, input_path, stem=stem):
+                skipped_files += 1
+                continue
+            manifest.forget(key)
+        tasks.append((input_path, output_dir, sample_rate, min_segment_duration,
+                      streaming, window_duration, window_overlap, backend, names[input_path]))
 
-                if not speech_segments:
-                    print(f"[!] Aucun segment valide détecté dans {filename}")
-                    continue
+    if manifest is not None:
+        removed = manifest.prune(current_keys)
+        if removed:
+            print(f"[~] {removed} fichiers sources disparus : sorties supprimées")
 
-                # Sauvegarder audio filtré
-                output_audio_path = os.path.join(output_dir, filename)
-                sf.write(output_audio_path, np.concatenate(speech_segments), sample_rate)
+    if threads_per_worker is None and workers > 1 and backend != "energy":
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
 
-                # Sauvegarder le fichier RTTM
-                rttm_path = os.path.join(rttm_dir, f"{os.path.splitext(filename)[0]}.rttm")
-                write_rttm(rttm_path, annotation)
+    def report(task, result):
+        input_path, output_name = task[0], task[-1]
+        filename = os.path.basename(input_path)
+        num_segments, outputs, error = result
+        if error is not None:
+            print(f"[X] Erreur avec {filename} : {error}")
+            remove_partial_outputs(output_dir, output_name)
+            return
+        if num_segments == 0:
+            print(f"[!] Aucun segment valide détecté dans {filename}")
+        else:
+            print(f"[✓] {filename} traité : {num_segments} segments parlés détectés")
+        if manifest is not None:
+            manifest.record(os.path.relpath(input_path, input_dir), input_path, outputs,
+                            stem=os.path.splitext(output_name)[0])
 
-                print(f"[✓] {filename} traité : {len(speech_segments)} segments parlés détectés")
+    try:
+        for task, result, error in run_tasks(_vad_task, tasks, workers, timeout,
+                                             initializer=init_worker, initargs=(threads_per_worker,)):
+            report(task, result if error is None else (0, [], error))
+    finally:
+        if manifest is not None:
+            manifest.save()
 
-            except Exception as e:
-                print(f"[X] Erreur avec {filename} : {e}")
+    if skipped_files:
+        print(f"[~] {skipped_files} fichiers inchangés ignorés")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Appliquer la détection de voix (VAD) avec pyannote-audio")
     parser.add_argument("--input_dir", type=str, required=True, help="Répertoire des fichiers WAV d'entrée")
     parser.add_argument("--output_dir", type=str, required=True, help="Répertoire de sortie pour les fichiers WAV filtrés et RTTM")
+    parser.add_argument("--workers", type=int, default=1, help="Nombre de processus parallèles (1 = traitement séquentiel)")
+    parser.add_argument("--threads_per_worker", type=int, default=None, help="Threads torch par worker (par défaut : cœurs / workers)")
+    parser.add_argument("--timeout", type=float, default=None, help="Durée maximale de traitement d'un fichier en secondes (mode --workers)")
+    parser.add_argument("--streaming", action="store_true", help="VAD par fenêtres glissantes, mémoire bornée (enregistrements longs)")
+    parser.add_argument("--window_duration", type=float, default=120, help="Durée des fenêtres VAD en secondes (mode --streaming)")
+    parser.add_argument("--window_overlap", type=float, default=10, help="Recouvrement entre fenêtres en secondes (mode --streaming)")
+    parser.add_argument("--backend", choices=VAD_BACKENDS, default="pyannote",
+                        help="pyannote : modèle sur tout le signal ; energy : seuils d'énergie, sans modèle ; "
+                             "hybrid : pyannote sur les seules régions candidates")
+    parser.add_argument("--hash", action="store_true", help="Compare aussi le contenu des fichiers (SHA-1) pour détecter les changements")
+    parser.add_argument("--force", action="store_true", help="Retraite tous les fichiers sans tenir compte du manifeste")
+    parser.add_argument("--no_manifest", action="store_true", help="Désactive le manifeste de relance incrémentale")
+    parser.add_argument("--index", type=str, default=None,
+                        help="Index d'empreintes du corpus (créé ou réutilisé) : ignore les doublons (corpus_index.py)")
+    parser.add_argument("--exclude_list", type=str, default=None, help="Fichier de motifs d'exclusion, un par ligne")
+    parser.add_argument("--exclude", action="append", default=[], help="Motif d'exclusion (sous-chaîne ou motif *, ?)")
+    instrumentation.add_arguments(parser)
     args = parser.parse_args()
+    instrumentation.configure(args.profile_log, args.cprofile)
 
-    apply_vad(args.input_dir, args.output_dir)
+    apply_vad(args.input_dir, args.output_dir, incremental=not args.no_manifest,
+              use_hash=args.hash, force=args.force, workers=args.workers,
+              threads_per_worker=args.threads_per_worker, timeout=args.timeout,
+              streaming=args.streaming, window_duration=args.window_duration,
+              window_overlap=args.window_overlap, backend=args.backend, index_path=args.index,
+              exclusions=(load_exclusions(args.exclude_list) if args.exclude_list else ()) + tuple(args.exclude))
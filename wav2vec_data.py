@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Données du pré-entraînement wav2vec2 (`train_wav2vec.py`), découpées à la volée.
+
+Les enregistrements longs sont stockés une seule fois, entiers, en tableaux
+numpy 16 kHz (`pre-process.py --output_format npy`) et projetés en mémoire
+(`np.load(mmap_mode='r')`) : seuls les échantillons des extraits tirés sont lus.
+À chaque époque, de nouveaux extraits de `min_crop` à `max_crop` secondes sont
+tirés au hasard (enregistrement choisi au prorata de sa durée, position
+uniforme) : le modèle voit des fenêtres différentes à chaque passage, sans les
+segments recouvrants dupliqués sur disque.
+
+Les extraits sont regroupés en lots selon un budget d'échantillons
+(`batch_seconds` d'audio, padding compris) : ils sont tirés par paquets, triés
+par longueur puis découpés en lots de longueur homogène, ce qui limite le
+padding. Le collateur calcule `mask_time_indices` et
+`sampled_negative_indices` à partir de la `Wav2Vec2Config` (`mask_time_prob`,
+`mask_time_length`, `num_negatives`) : tout ce travail est fait dans les
+workers du DataLoader (`dataloader_num_workers`), qui préparent
+`prefetch_factor` lots d'avance chacun.
+
+Auteur : Daphne Teixeira
+"""
+
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+from transformers import Trainer
+from transformers.models.wav2vec2.modeling_wav2vec2 import _compute_mask_indices, _sample_negative_indices
+
+# === PARAMÈTRES ===
+SAMPLE_RATE = 16000
+MIN_CROP = 10.0       # Durée minimale d'un extrait (secondes), comme les segments de pre-process.py
+MAX_CROP = 20.0       # Durée maximale d'un extrait (secondes)
+BATCH_SECONDS = 320.0  # Audio par lot, padding compris (16 extraits de 20 s)
+POOL_BATCHES = 32     # Lots tirés à la fois avant le tri par longueur
+PREFETCH_FACTOR = 4   # Lots préparés d'avance par worker
+
+
+def list_recordings(data_dir):
+    """Enregistrements `.npy` du répertoire (triés), avec leur nombre d'échantillons"""
+    recordings = []
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.endswith('.npy'):
+            path = os.path.join(data_dir, filename)
+            audio = np.load(path, mmap_mode='r')
+            if audio.ndim != 1:
+                raise ValueError(f"{filename} : signal mono attendu, forme {audio.shape}")
+            recordings.append((path, len(audio)))
+    return recordings
+
+
+def to_float32(audio):
+    """Convertit des échantillons PCM 16 bits en flottants dans [-1, 1] (inverse de `to_int16`)"""
+    if audio.dtype == np.int16:
+        return audio.astype(np.float32) / 32767.0
+    return np.asarray(audio, dtype=np.float32)
+
+
+class PretrainingCollator:
+    """
+    Assemble un lot pour `Wav2Vec2ForPreTraining` : signaux complétés par
+    des zéros, masque temporel et indices des négatifs. Accepte des signaux
+    numpy ou des exemples `{"input_values": ...}` (dataset `load_from_disk`).
+    """
+
+    def __init__(self, config):
+        self.mask_time_prob = config.mask_time_prob
+        self.mask_time_length = config.mask_time_length
+        self.mask_time_min_masks = config.mask_time_min_masks
+        self.num_negatives = config.num_negatives
+        self.conv_layers = list(zip(config.conv_kernel, config.conv_stride))
+        self.return_attention_mask = config.feat_extract_norm == "layer"
+
+    def frame_lengths(self, lengths):
+        """Nombre de trames en sortie de l'encodeur convolutif (`_get_feat_extract_output_lengths`)"""
+        lengths = np.asarray(lengths)
+        for kernel, stride in self.conv_layers:
+            lengths = (lengths - kernel) // stride + 1
+        return lengths
+
+    def __call__(self, samples):
+        samples = [to_float32(s["input_values"] if isinstance(s, dict) else s) for s in samples]
+        lengths = np.array([len(s) for s in samples])
+        input_values = np.zeros((len(samples), lengths.max()), dtype=np.float32)
+        for row, sample in zip(input_values, samples):
+            row[:len(sample)] = sample
+
+        # Masquage et négatifs sur les trames réelles seulement (pas sur le padding)
+        frames = self.frame_lengths(lengths)
+        shape = (len(samples), int(frames.max()))
+        frame_mask = torch.from_numpy((np.arange(shape[1]) < frames[:, None]).astype(np.int64))
+        mask_time_indices = _compute_mask_indices(shape, self.mask_time_prob, self.mask_time_length,
+                                                  attention_mask=frame_mask, min_masks=self.mask_time_min_masks)
+        sampled_negative_indices = _sample_negative_indices(shape, self.num_negatives, mask_time_indices)
+
+        batch = {
+            "input_values": torch.from_numpy(input_values),
+            "mask_time_indices": torch.from_numpy(mask_time_indices),
+            "sampled_negative_indices": torch.from_numpy(sampled_negative_indices.astype(np.int64)),
+        }
+        if self.return_attention_mask:
+            batch["attention_mask"] = torch.from_numpy((np.arange(input_values.shape[1]) < lengths[:, None])
+                                                       .astype(np.int64))
+        return batch
+
+
+class RandomCropDataset(IterableDataset):
+    """
+    Extraits aléatoires d'enregistrements projetés en mémoire, déjà groupés
+    en lots (et passés au collateur s'il est fourni).
+
+    Une époque compte `crops_per_epoch` extraits (par défaut : de quoi couvrir
+    la durée du corpus une fois en moyenne), répartis entre les workers. Le
+    tirage dépend de la graine que torch attribue à chaque worker et à chaque
+    époque : il change d'une époque à l'autre et reste reproductible après
+    `set_seed`.
+    """
+
+    def __init__(self, data_dir, min_crop=MIN_CROP, max_crop=MAX_CROP, batch_seconds=BATCH_SECONDS,
+                 crops_per_epoch=None, collator=None, sample_rate=SAMPLE_RATE):
+        recordings = list_recordings(data_dir)
+        if not recordings:
+            raise ValueError(f"Aucun enregistrement .npy dans {data_dir} (pre-process.py --output_format npy)")
+        self.paths = [path for path, _ in recordings]
+        self.lengths = np.array([length for _, length in recordings], dtype=np.int64)
+        self.min_crop = int(min_crop * sample_rate)
+        self.max_crop = int(max_crop * sample_rate)
+        self.batch_samples = int(batch_seconds * sample_rate)
+        if self.batch_samples < self.max_crop:
+            raise ValueError("batch_seconds doit être au moins égal à max_crop")
+        if crops_per_epoch is None:
+            crops_per_epoch = int(np.ceil(self.lengths.sum() / ((self.min_crop + self.max_crop) / 2)))
+        self.crops_per_epoch = crops_per_epoch
+        self.collator = collator
+        self._arrays = None  # Projections mémoire, ouvertes dans chaque worker
+
+    def total_seconds(self, sample_rate=SAMPLE_RATE):
+        return self.lengths.sum() / sample_rate
+
+    def sample_crops(self, rng, count):
+        """Tire `count` extraits (enregistrement, début, longueur)"""
+        weights = self.lengths / self.lengths.sum()
+        recordings = rng.choice(len(self.lengths), size=count, p=weights)
+        sizes = np.minimum(rng.integers(self.min_crop, self.max_crop + 1, size=count), self.lengths[recordings])
+        starts = (rng.random(count) * (self.lengths[recordings] - sizes + 1)).astype(np.int64)
+        return list(zip(recordings.tolist(), starts.tolist(), sizes.tolist()))
+
+    def group_batches(self, crops, rng):
+        """Lots de longueur homogène : (nombre d'extraits) x (plus long extrait) <= budget"""
+        crops = sorted(crops, key=lambda crop: -crop[2])
+        batches = []
+        batch = []
+        for crop in crops:
+            if batch and (len(batch) + 1) * batch[0][2] > self.batch_samples:
+                batches.append(batch)
+                batch = []
+            batch.append(crop)
+        if batch:
+            batches.append(batch)
+        rng.shuffle(batches)
+        return batches
+
+    def read(self, crop):
+        recording, start, size = crop
+        if self._arrays is None:
+            self._arrays = [np.load(path, mmap_mode='r') for path in self.paths]
+        return to_float32(self._arrays[recording][start:start + size])
+
+    def __iter__(self):
+        worker = get_worker_info()
+        if worker is None:
+            # Processus principal : graine tirée du générateur global de torch (change à chaque époque)
+            seed, index, count = int(torch.empty((), dtype=torch.int64).random_().item()), 0, 1
+        else:
+            seed, index, count = worker.seed, worker.id, worker.num_workers
+        rng = np.random.default_rng(seed)
+        np.random.seed(seed % 2 ** 32)  # Utilisé par _compute_mask_indices / _sample_negative_indices
+
+        remaining = self.crops_per_epoch // count + (index < self.crops_per_epoch % count)
+        pool_size = POOL_BATCHES * max(1, self.batch_samples // self.max_crop)
+        while remaining > 0:
+            crops = self.sample_crops(rng, min(pool_size, remaining))
+            remaining -= len(crops)
+            for batch in self.group_batches(crops, rng):
+                samples = [self.read(crop) for crop in batch]
+                yield self.collator(samples) if self.collator is not None else samples
+
+
+def make_dataloader(dataset, num_workers=0, prefetch_factor=PREFETCH_FACTOR, pin_memory=True):
+    """DataLoader sur des lots déjà formés (`batch_size=None`), préparés d'avance par les workers"""
+    params = {"batch_size": None, "num_workers": num_workers, "pin_memory": pin_memory}
+    if num_workers > 0:
+        params["prefetch_factor"] = prefetch_factor
+    return DataLoader(dataset, **params)
+
+
+class CropTrainer(Trainer):
+    """`Trainer` dont les lots viennent d'un `RandomCropDataset` (lots formés par budget d'échantillons)"""
+
+    def get_train_dataloader(self):
+        if not isinstance(self.train_dataset, RandomCropDataset):
+            return super().get_train_dataloader()
+        prefetch_factor = getattr(self.args, "dataloader_prefetch_factor", None) or PREFETCH_FACTOR
+        return self.accelerator.prepare(make_dataloader(self.train_dataset, self.args.dataloader_num_workers,
+                                                        prefetch_factor, self.args.dataloader_pin_memory))
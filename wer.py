@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Calcul local du taux d'erreur de mots (WER), sans accès réseau
+(remplace `evaluate.load("wer")`).
+
+La distance d'édition est calculée ligne par ligne avec NumPy : pour chaque
+mot de référence, substitutions et suppressions sont vectorisées, et la chaîne
+des insertions se ramène à un minimum cumulé (`np.minimum.accumulate`).
+
+Les scores peuvent être ventilés par groupe, par exemple par variété
+dialectale (`CM`, `GB`) telle qu'écrite par `eaf_to_csv.py`.
+
+Auteur : Daphne Teixeira
+"""
+
+import numpy as np
+
+
+def edit_distance(reference, hypothesis):
+    """Distance de Levenshtein entre deux séquences (listes de mots ou d'identifiants)"""
+    if not reference:
+        return len(hypothesis)
+    if not hypothesis:
+        return len(reference)
+
+    # Mots convertis en entiers pour des comparaisons vectorisées
+    vocabulary = {}
+    ref = np.array([vocabulary.setdefault(w, len(vocabulary)) for w in reference])
+    hyp = np.array([vocabulary.setdefault(w, len(vocabulary)) for w in hypothesis])
+
+    offsets = np.arange(len(hyp) + 1)
+    previous = offsets.copy()
+    for i, word in enumerate(ref, 1):
+        current = np.empty_like(previous)
+        current[0] = i
+        # Suppression (previous[j] + 1) ou substitution (previous[j-1] + coût)
+        current[1:] = np.minimum(previous[1:] + 1, previous[:-1] + (hyp != word))
+        # Insertions : current[j] = min(current[j], current[j-1] + 1)
+        current = np.minimum.accumulate(current - offsets) + offsets
+        previous = current
+    return int(previous[-1])
+
+
+def word_errors(reference, hypothesis, normalize=None):
+    """Renvoie (nombre d'erreurs, nombre de mots de référence) pour une paire de phrases"""
+    if normalize is not None:
+        reference, hypothesis = normalize(reference), normalize(hypothesis)
+    ref_words = reference.split()
+    return edit_distance(ref_words, hypothesis.split()), len(ref_words)
+
+
+def corpus_wer(references, hypotheses, normalize=None):
+    """WER sur l'ensemble du corpus : erreurs totales / mots de référence"""
+    errors = words = 0
+    for reference, hypothesis in zip(references, hypotheses):
+        e, n = word_errors(reference, hypothesis, normalize)
+        errors += e
+        words += n
+    return errors / words if words else 0.0
+
+
+def wer_by_group(references, hypotheses, groups, normalize=None):
+    """
+    WER global et par groupe (ex. variété dialectale). Renvoie un dictionnaire
+    {"wer": ..., "wer_CM": ..., "n_CM": ...} ; les groupes None sont comptés
+    uniquement dans le score global.
+    """
+    totals = {}
+    errors = words = 0
+    for reference, hypothesis, group in zip(references, hypotheses, groups):
+        e, n = word_errors(reference, hypothesis, normalize)
+        errors += e
+        words += n
+        if group is not None:
+            group_totals = totals.setdefault(group, [0, 0, 0])
+            group_totals[0] += e
+            group_totals[1] += n
+            group_totals[2] += 1
+
+    results = {"wer": errors / words if words else 0.0}
+    for group, (group_errors, group_words, count) in sorted(totals.items()):
+        results[f"wer_{group}"] = group_errors / group_words if group_words else 0.0
+        results[f"n_{group}"] = count
+    return results
@@ -1,56 +1,346 @@
 # -*- coding: utf-8 -*-
 """
-Script d'inférence pour tester un modèle Whisper fine-tuné sur un fichier audio Kriol.
+Script d'inférence pour un modèle Whisper fine-tuné sur des fichiers audio Kriol.
 
 Entrées :
-- Chemin vers le modèle fine-tuné (`model_dir`)
-- Fichier audio `.wav` en 16 kHz mono
+- Chemin vers le modèle fine-tuné (`--model_dir`)
+- Un ou plusieurs fichiers `.wav`, répertoires (parcourus récursivement)
+  ou listes de fichiers (`.txt`, un chemin par ligne)
+- Optionnellement, un répertoire de fichiers RTTM (`vad_pyannote.py`) pour
+  aligner les fenêtres sur les segments de parole
+
+Traitement :
+- Chaque enregistrement est découpé en fenêtres de 30 s (la taille d'entrée
+  de Whisper), ou en fenêtres regroupant les segments RTTM
+- Les fenêtres de tous les fichiers sont transcrites par lots avec un seul
+  chargement du modèle
+- Les timecodes renvoyés par `return_timestamps` sont replacés en temps absolu
 
 Sortie :
-- Transcription avec timecodes sauvegardée en fichier JSON
+- Un fichier JSON par enregistrement, avec la transcription complète et les
+  segments horodatés ; deux enregistrements de même nom dans des dossiers
+  différents reçoivent un suffixe `_2`, `_3`, ... (`manifest.unique_stems`,
+  comme les sorties de `vad_pyannote.py`)
+
+torch, torchaudio et transformers ne sont importés qu'au premier usage :
+les fonctions sans modèle (découpage, RTTM, écriture) restent légères à importer.
 
 Auteur : Daphne Teixeira
 """
 
-from transformers import WhisperProcessor, WhisperForConditionalGeneration
-import torchaudio
-import torch
+import argparse
 import json
 import os
 
+import instrumentation
+from instrumentation import add_audio, stage, track_file
+from manifest import unique_stems
+
 # === PARAMÈTRES ===
 model_dir = "whisper-kriol-finetuned"  # Dossier contenant le modèle fine-tuné
-wav_file = "sample.wav"  # Fichier audio à transcrire (mono, 16 kHz)
-output_json = "transcription_output.json"
+wav_file = "sample.wav"  # Fichier audio à transcrire par défaut
+output_dir = "."  # Dossier des fichiers JSON produits
+SAMPLE_RATE = 16000
+CHUNK_LENGTH = 30  # Durée maximale d'une fenêtre Whisper (secondes) : taille d'entrée de l'encodeur
+BATCH_SIZE = 8
+BACKENDS = ("fp32", "int8", "compile")
+
+def chunk_length_arg(value):
+    """Type argparse de `--chunk_length` : au plus 30 s, au-delà Whisper tronquerait la fenêtre"""
+    value = int(value)
+    if not 0 < value <= CHUNK_LENGTH:
+        raise argparse.ArgumentTypeError(f"durée attendue entre 1 et {CHUNK_LENGTH} secondes "
+                                         f"(fenêtre d'entrée de Whisper) : {value}")
+    return value
+
+def default_device():
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def physical_cores():
+    """
+    Cœurs physiques utilisables par le processus (affinité comprise), d'après
+    /proc/cpuinfo : un thread torch par cœur évite que deux threads de calcul
+    se partagent un cœur hyperthreadé. À défaut, nombre de processeurs logiques.
+    """
+    allowed = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else None
+    cores = set()
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            processor = physical_id = None
+            for line in f:
+                key, _, value = line.partition(":")
+                key, value = key.strip(), value.strip()
+                if key == "processor":
+                    processor = int(value)
+                elif key == "physical id":
+                    physical_id = value
+                elif key == "core id" and (allowed is None or processor in allowed):
+                    cores.add((physical_id, value))
+    except (OSError, ValueError):
+        cores = set()
+    if cores:
+        return len(cores)
+    return len(allowed) if allowed is not None else (os.cpu_count() or 1)
+
+def unsupported_backend(backend):
+    """Raison pour laquelle `backend` est inutilisable avec ce torch (None s'il est disponible)"""
+    import torch
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
+    if backend == "compile" and not hasattr(torch, "compile"):
+        return "torch.compile absent (torch 2.0 ou plus récent requis)"
+    return None
 
 # === CHARGER MODÈLE ET PROCESSOR ===
-processor = WhisperProcessor.from_pretrained(model_dir)
-model = WhisperForConditionalGeneration.from_pretrained(model_dir).to(device)
+def load_model(model_dir, device=None, backend="fp32", num_threads=None):
+    """
+    Charge le processor et le modèle avec le backend d'inférence choisi :
+    - `fp32` : modèle d'origine
+    - `int8` : quantification dynamique int8 des couches linéaires (CPU uniquement)
+    - `compile` : encodeur compilé avec `torch.compile` (taille d'entrée fixe, 30 s)
+    L'attention fusionnée `sdpa`, qui remplace BetterTransformer, est déjà
+    celle que transformers choisit par défaut pour tous les backends.
+    `num_threads` fixe le nombre de threads torch ; sur CPU, il vaut par
+    défaut le nombre de cœurs physiques (`physical_cores`).
+    """
+    import torch
+    from transformers import WhisperProcessor, WhisperForConditionalGeneration
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend inconnu : {backend} (attendu : {', '.join(BACKENDS)})")
+    reason = unsupported_backend(backend)
+    if reason:
+        raise RuntimeError(f"Backend {backend} indisponible : {reason}")
+    device = device or default_device()
+    if num_threads or device == "cpu" or backend == "int8":
+        torch.set_num_threads(num_threads or physical_cores())
+
+    processor = WhisperProcessor.from_pretrained(model_dir)
+    model = WhisperForConditionalGeneration.from_pretrained(model_dir)
+    model.eval()
+
+    if backend == "int8":
+        if device != "cpu":
+            print(f"Le backend int8 ne fonctionne que sur CPU : {device} remplacé par cpu")
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return processor, model
+    model = model.to(device)
+    if backend == "compile":
+        # Seul l'encodeur a une forme d'entrée fixe ; le décodeur recompilerait à chaque longueur
+        model.model.encoder = torch.compile(model.model.encoder)
+    return processor, model
+
+# === LISTE DES FICHIERS ===
+def collect_audio_files(inputs):
+    """Développe les entrées (fichiers, répertoires, listes .txt) en une liste de fichiers WAV"""
+    audio_files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                audio_files.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(".wav"))
+        elif path.lower().endswith(".txt"):
+            with open(path, encoding="utf-8") as f:
+                audio_files.extend(line.strip() for line in f if line.strip())
+        else:
+            audio_files.append(path)
+    return audio_files
 
 # === CHARGER L'AUDIO ===
-waveform, sample_rate = torchaudio.load(wav_file)
-if sample_rate != 16000:
-    resampler = torchaudio.transforms.Resample(orig_freq=sample_rate, new_freq=16000)
-    waveform = resampler(waveform)
+def load_audio(path):
+    """Charge un fichier en mono 16 kHz (tableau numpy)"""
+    import torchaudio
+
+    with stage("decode"):
+        waveform, sample_rate = torchaudio.load(path)
+    if sample_rate != SAMPLE_RATE:
+        with stage("resample"):
+            resampler = torchaudio.transforms.Resample(orig_freq=sample_rate, new_freq=SAMPLE_RATE)
+            waveform = resampler(waveform)
+    add_audio(waveform.shape[-1] / SAMPLE_RATE)
+    return waveform.mean(dim=0).numpy()
+
+def read_rttm(path):
+    """Lit les segments (début, fin) en secondes d'un fichier RTTM, triés"""
+    turns = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 5 and fields[0] == "SPEAKER":
+                start, duration = float(fields[3]), float(fields[4])
+                turns.append((start, start + duration))
+    return sorted(turns)
+
+# === DÉCOUPAGE EN FENÊTRES ===
+def split_windows(audio, chunk_length=CHUNK_LENGTH, turns=None):
+    """
+    Génère les fenêtres (début en secondes, signal) à transcrire.
+
+    Sans `turns`, l'audio est découpé en fenêtres consécutives de `chunk_length`
+    secondes. Avec des segments de parole `turns` (RTTM), les segments
+    consécutifs sont regroupés tant que la fenêtre ne dépasse pas
+    `chunk_length` ; un segment plus long est lui-même découpé.
+    """
+    total = len(audio) / SAMPLE_RATE
+    if turns is None:
+        spans = [(start, min(start + chunk_length, total))
+                 for start in range(0, int(total) + 1, chunk_length) if start < total]
+    else:
+        spans = []
+        for start, end in turns:
+            start, end = max(0.0, start), min(end, total)
+            if end <= start:
+                continue
+            if spans and end - spans[-1][0] <= chunk_length:
+                spans[-1] = (spans[-1][0], end)
+                continue
+            while end - start > chunk_length:
+                spans.append((start, start + chunk_length))
+                start += chunk_length
+            spans.append((start, end))
+
+    for start, end in spans:
+        yield start, audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
 
 # === TRANSCRIPTION AVEC TIME STAMPS ===
-inputs = processor(waveform.squeeze().numpy(), sampling_rate=16000, return_tensors="pt")
-input_features = inputs.input_features.to(device)
+def extract_features(windows, processor):
+    """Caractéristiques log-mel d'un lot de fenêtres [(début, signal), ...]"""
+    with stage("features", audio_seconds=sum(len(audio) for _, audio in windows) / SAMPLE_RATE, windows=len(windows)):
+        inputs = processor([audio for _, audio in windows], sampling_rate=SAMPLE_RATE, return_tensors="pt")
+    return inputs.input_features
+
+def transcribe_batch(windows, processor, model, input_features=None):
+    """
+    Transcrit un lot de fenêtres [(début, signal), ...] et renvoie, pour chacune,
+    la liste des segments {"start", "end", "text"} en temps absolu.
+    `input_features` peut être calculé à l'avance avec `extract_features`.
+    """
+    import torch
+
+    if input_features is None:
+        input_features = extract_features(windows, processor)
+    input_features = input_features.to(model.device)
+
+    audio_seconds = sum(len(audio) for _, audio in windows) / SAMPLE_RATE
+    with stage("generate", audio_seconds=audio_seconds, windows=len(windows)), torch.no_grad():
+        predicted_ids = model.generate(input_features, return_timestamps=True)
 
-with torch.no_grad():
-    predicted_ids = model.generate(input_features, return_timestamps=True)
+    decoded = processor.tokenizer.batch_decode(predicted_ids, skip_special_tokens=True, output_offsets=True)
 
-decoded = processor.batch_decode(predicted_ids, skip_special_tokens=False)
+    results = []
+    for (offset, audio), output in zip(windows, decoded):
+        window_end = offset + len(audio) / SAMPLE_RATE
+        segments = []
+        for item in output["offsets"]:
+            start, end = item["timestamp"]
+            text = item["text"].strip()
+            if not text:
+                continue
+            segments.append({
+                "start": round(offset + (start or 0.0), 2),
+                "end": round(min(offset + end, window_end) if end is not None else window_end, 2),
+                "text": text,
+            })
+        # Pas de timestamps prédits : toute la fenêtre forme un segment
+        if not segments and output["text"].strip():
+            segments.append({"start": round(offset, 2), "end": round(window_end, 2), "text": output["text"].strip()})
+        results.append(segments)
+    return results
 
 # === FORMATAGE DES SORTIES ===
-transcription_data = {
-    "audio_file": wav_file,
-    "transcription": decoded[0]
-}
+def write_transcription(audio_file, segments, output_dir, name=None):
+    """Écrit `<name>.json` (par défaut, le nom du fichier audio) et renvoie son chemin"""
+    segments = sorted(segments, key=lambda s: s["start"])
+    transcription_data = {
+        "audio_file": audio_file,
+        "transcription": " ".join(s["text"] for s in segments),
+        "segments": segments,
+    }
+    if name is None:
+        name = os.path.splitext(os.path.basename(audio_file))[0]
+    output_json = os.path.join(output_dir, f"{name}.json")
+    with open(output_json, 'w', encoding='utf-8') as f:
+        json.dump(transcription_data, f, ensure_ascii=False, indent=2)
+    return output_json
+
+def transcribe_files(audio_files, processor, model, output_dir=output_dir, batch_size=BATCH_SIZE,
+                     chunk_length=CHUNK_LENGTH, rttm_dir=None):
+    """
+    Transcrit une liste de fichiers avec un seul modèle chargé. Les fenêtres
+    de fichiers successifs partagent les mêmes lots ; le JSON d'un fichier est
+    écrit dès que toutes ses fenêtres sont transcrites. Le JSON et le RTTM
+    d'un fichier portent son nom unique (`manifest.unique_stems`).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    names = unique_stems(audio_files)
+    pending = []    # Fenêtres en attente : (indice du fichier, début, signal)
+    segments = {}   # Indice du fichier -> segments transcrits
+    remaining = {}  # Indice du fichier -> fenêtres pas encore transcrites
+
+    def finish(index):
+        with stage("write", file=audio_files[index]):
+            output_json = write_transcription(audio_files[index], segments.pop(index), output_dir, names[index])
+        del remaining[index]
+        print(f"Transcription sauvegardée dans : {output_json}")
+
+    def flush():
+        batch = pending[:]
+        pending.clear()
+        results = transcribe_batch([(start, audio) for _, start, audio in batch], processor, model)
+        for (index, _, _), window_segments in zip(batch, results):
+            segments[index].extend(window_segments)
+            remaining[index] -= 1
+            if remaining[index] == 0:
+                finish(index)
+
+    for index, audio_file in enumerate(audio_files):
+        try:
+            # Le décodage est mesuré par fichier ; features et generate le sont par lot
+            with track_file(audio_file):
+                audio = load_audio(audio_file)
+                turns = None
+                if rttm_dir is not None:
+                    rttm_path = os.path.join(rttm_dir, f"{names[index]}.rttm")
+                    if os.path.exists(rttm_path):
+                        turns = read_rttm(rttm_path)
+                windows = list(split_windows(audio, chunk_length, turns))
+        except Exception as e:
+            print(f"Erreur lors du chargement de {audio_file} : {e}")
+            continue
+
+        segments[index] = []
+        remaining[index] = len(windows)
+        if not windows:
+            finish(index)
+            continue
+        for start, window in windows:
+            pending.append((index, start, window))
+            if len(pending) == batch_size:
+                flush()
+
+    if pending:
+        flush()
 
-with open(output_json, 'w', encoding='utf-8') as f:
-    json.dump(transcription_data, f, ensure_ascii=False, indent=2)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcription longue durée avec un modèle Whisper fine-tuné")
+    parser.add_argument("inputs", nargs="*", default=[wav_file],
+                        help="Fichiers WAV, répertoires ou listes de fichiers (.txt)")
+    parser.add_argument("--model_dir", type=str, default=model_dir, help="Dossier du modèle fine-tuné")
+    parser.add_argument("--output_dir", type=str, default=output_dir, help="Dossier des fichiers JSON produits")
+    parser.add_argument("--batch_size", type=int, default=BATCH_SIZE, help="Nombre de fenêtres par appel à generate")
+    parser.add_argument("--chunk_length", type=chunk_length_arg, default=CHUNK_LENGTH,
+                        help="Durée maximale d'une fenêtre (secondes, 30 au plus)")
+    parser.add_argument("--backend", choices=BACKENDS, default="fp32",
+                        help="Backend d'inférence (int8 : quantification dynamique pour CPU)")
+    parser.add_argument("--num_threads", type=int, default=None,
+                        help="Nombre de threads torch sur CPU (par défaut : cœurs physiques)")
+    parser.add_argument("--rttm_dir", type=str, default=None,
+                        help="Répertoire RTTM (vad_pyannote.py) pour aligner les fenêtres sur la parole")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args.profile_log, args.cprofile, backend=args.backend)
 
-print(f"\nTranscription sauvegardée dans : {output_json}")
+    with stage("load"):
+        processor, model = load_model(args.model_dir, backend=args.backend, num_threads=args.num_threads)
+    transcribe_files(collect_audio_files(args.inputs), processor, model, args.output_dir,
+                     args.batch_size, args.chunk_length, args.rttm_dir)
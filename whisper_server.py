@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Serveur de transcription résident pour un modèle Whisper fine-tuné.
+
+Le modèle est chargé une seule fois au démarrage. Les requêtes sont placées
+dans une file d'attente ; un thread unique regroupe les fenêtres de 30 s en
+attente en lots (jusqu'à `--max_batch_size` fenêtres ou `--max_wait_ms`
+millisecondes d'attente) et exécute un seul appel à `generate` par lot.
+
+Points d'accès HTTP :
+- `POST /transcribe` : corps = fichier audio (WAV, FLAC...) ; renvoie le JSON
+  produit par `whisper_infer.py` (transcription et segments horodatés)
+- `GET /health` : état du serveur
+- `GET /metrics` : latence par requête, profondeur de file, taille des lots
+
+Exemple :
+    python whisper_server.py --model_dir whisper-kriol-finetuned --port 8000
+    curl --data-binary @sample.wav http://127.0.0.1:8000/transcribe
+
+Auteur : Daphne Teixeira
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import collections
+import io
+import json
+import queue
+import threading
+import time
+
+import soundfile as sf
+
+from whisper_infer import SAMPLE_RATE, CHUNK_LENGTH, BACKENDS, load_model, split_windows, transcribe_batch
+
+# === PARAMÈTRES ===
+model_dir = "whisper-kriol-finetuned"
+HOST = "127.0.0.1"
+PORT = 8000
+MAX_BATCH_SIZE = 8
+MAX_WAIT_MS = 20
+LATENCY_WINDOW = 1000  # Nombre de requêtes récentes conservées pour les percentiles
+
+
+def decode_audio(data):
+    """Décode un fichier audio reçu en octets en signal mono 16 kHz (numpy)"""
+    import torch
+    import torchaudio
+
+    audio, sample_rate = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    waveform = torch.from_numpy(audio.mean(axis=1))
+    if sample_rate != SAMPLE_RATE:
+        waveform = torchaudio.functional.resample(waveform, sample_rate, SAMPLE_RATE)
+    return waveform.numpy()
+
+
+class TranscriptionRequest:
+    """Une requête en cours : ses fenêtres sont transcrites, éventuellement dans plusieurs lots"""
+
+    def __init__(self, windows):
+        self.remaining = len(windows)
+        self.segments = []
+        self.error = None
+        self.done = threading.Event()
+        self.enqueued_at = time.perf_counter()
+        if not windows:
+            self.done.set()
+
+
+class DynamicBatcher:
+    """
+    Regroupe les fenêtres de requêtes concurrentes en lots pour `generate`.
+    Un lot part dès qu'il contient `max_batch_size` fenêtres, ou `max_wait_ms`
+    millisecondes après l'arrivée de sa première fenêtre.
+    """
+
+    def __init__(self, processor, model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                 chunk_length=CHUNK_LENGTH):
+        self.processor = processor
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.chunk_length = chunk_length
+        self.queue = queue.Queue()
+
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.failures = 0
+        self.batches = 0
+        self.batched_windows = 0
+        self.max_queue_depth = 0
+
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, audio):
+        """Transcrit un signal (bloquant) et renvoie la liste de segments horodatés"""
+        windows = list(split_windows(audio, self.chunk_length))
+        request = TranscriptionRequest(windows)
+        for start, window in windows:
+            self.queue.put((request, start, window))
+        with self.lock:
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+        request.done.wait()
+        latency = time.perf_counter() - request.enqueued_at
+        with self.lock:
+            self.requests += 1
+            self.latencies.append(latency)
+            if request.error is not None:
+                self.failures += 1
+        if request.error is not None:
+            raise RuntimeError(request.error)
+        return sorted(request.segments, key=lambda s: s["start"])
+
+    def _next_batch(self):
+        """Attend une première fenêtre puis complète le lot jusqu'à la taille ou au délai maximal"""
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = transcribe_batch([(start, window) for _, start, window in batch],
+                                           self.processor, self.model)
+            except Exception as e:
+                results = [None] * len(batch)
+                for request, _, _ in batch:
+                    request.error = str(e)
+
+            with self.lock:
+                self.batches += 1
+                self.batched_windows += len(batch)
+
+            for (request, _, _), segments in zip(batch, results):
+                if segments is not None:
+                    request.segments.extend(segments)
+                request.remaining -= 1
+                if request.remaining == 0:
+                    request.done.set()
+
+    def metrics(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            def percentile(p):
+                return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 4) if latencies else None
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "queue_depth": self.queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "batches": self.batches,
+                "mean_batch_size": round(self.batched_windows / self.batches, 2) if self.batches else None,
+                "latency_p50_s": percentile(0.50),
+                "latency_p95_s": percentile(0.95),
+                "latency_max_s": round(latencies[-1], 4) if latencies else None,
+            }
+
+
+def make_handler(batcher, model_name):
+    class TranscriptionHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok", "model": model_name, "device": str(batcher.model.device),
+                                      "queue_depth": batcher.queue.qsize()})
+            elif self.path == "/metrics":
+                self._send_json(200, batcher.metrics())
+            else:
+                self._send_json(404, {"error": "route inconnue"})
+
+        def do_POST(self):
+            if self.path != "/transcribe":
+                self._send_json(404, {"error": "route inconnue"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                audio = decode_audio(self.rfile.read(length))
+            except Exception as e:
+                self._send_json(400, {"error": f"audio illisible : {e}"})
+                return
+            try:
+                started = time.perf_counter()
+                segments = batcher.submit(audio)
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+                return
+            self._send_json(200, {
+                "transcription": " ".join(s["text"] for s in segments),
+                "segments": segments,
+                "latency_s": round(time.perf_counter() - started, 4),
+            })
+
+        def log_message(self, format, *args):
+            pass  # Les métriques remplacent le journal par requête
+
+    return TranscriptionHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serveur de transcription Whisper avec regroupement dynamique des requêtes")
+    parser.add_argument("--model_dir", type=str, default=model_dir, help="Dossier du modèle fine-tuné")
+    parser.add_argument("--host", type=str, default=HOST, help="Adresse d'écoute")
+    parser.add_argument("--port", type=int, default=PORT, help="Port d'écoute")
+    parser.add_argument("--max_batch_size", type=int, default=MAX_BATCH_SIZE, help="Nombre maximal de fenêtres par lot")
+    parser.add_argument("--backend", choices=BACKENDS, default="fp32",
+                        help="Backend d'inférence (int8 : quantification dynamique pour CPU)")
+    parser.add_argument("--num_threads", type=int, default=None,
+                        help="Nombre de threads torch sur CPU (par défaut : cœurs physiques)")
+    parser.add_argument("--max_wait_ms", type=float, default=MAX_WAIT_MS,
+                        help="Attente maximale (ms) pour compléter un lot")
+    args = parser.parse_args()
+
+    processor, model = load_model(args.model_dir, backend=args.backend, num_threads=args.num_threads)
+    batcher = DynamicBatcher(processor, model, args.max_batch_size, args.max_wait_ms)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher, args.model_dir))
+    print(f"Serveur de transcription prêt sur http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
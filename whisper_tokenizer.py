@@ -3,37 +3,177 @@
 Préparation du jeu de données Hugging Face (audio + texte) pour le fine-tuning de Whisper.
 Utilise le WhisperProcessor (feature extractor + tokenizer).
 
+Les caractéristiques log-mel sont calculées par lots, sur plusieurs processus,
+et conservées dans un cache sur disque adressé par contenu : la clé combine une
+empreinte du signal audio et la configuration du feature extractor. Chaque
+entrée est un fichier `.npy` en float16 relu en memory-map ; une nouvelle
+expérience sur le même audio ne recalcule donc aucune caractéristique.
+
+Utilisation :
+    from whisper_tokenizer import prepare_dataset
+    dataset = prepare_dataset(dataset, num_proc=8)
+
+ou en ligne de commande sur un `DatasetDict` sauvegardé avec `save_to_disk` :
+    python whisper_tokenizer.py --dataset_dir kriol_dataset --output_dir kriol_features
+
+Les datasets de segments bruts (colonne `input_values` à 16 kHz, comme les
+shards Arrow de `eaf_to_csv.py`) sont acceptés à la place d'une colonne `audio`.
+
 Auteur : Daphne Teixeira
 """
 
-from transformers import WhisperProcessor
-import torch
+import argparse
+import hashlib
+import os
+import numpy as np
+
+from simple_normalization import normalize_batch
 
 # === PARAMÈTRES ===
 WHISPER_MODEL = "openai/whisper-medium"  # Peut être changé pour 'small', 'large', etc.
 LANGUAGE = "kriol"  # Nom libre, juste pour marquage éventuel
 TASK = "transcribe"
+FEATURE_CACHE_DIR = os.path.expanduser("~/.cache/whisper_kriol_features")
+BATCH_SIZE = 64
+NUM_PROC = max(1, (os.cpu_count() or 1) // 2)
+SAMPLE_RATE = 16000  # Fréquence des colonnes `input_values`
+KEEP_COLUMNS = ("variety",)  # Colonnes conservées (évaluation par variété dialectale)
 
 # === CHARGER LE PROCESSOR ===
-processor = WhisperProcessor.from_pretrained(WHISPER_MODEL)
+# Chargé à la demande, une fois par processus (y compris dans les workers de `map`)
+_processors = {}
+
+def get_processor(model_name=WHISPER_MODEL):
+    if model_name not in _processors:
+        from transformers import WhisperProcessor
+        _processors[model_name] = WhisperProcessor.from_pretrained(model_name)
+    return _processors[model_name]
+
+# === CACHE DES CARACTÉRISTIQUES ===
+_config_digests = {}
+
+def extractor_digest(processor):
+    """Empreinte de la configuration du feature extractor (mel, fenêtre, durée...)"""
+    config = processor.feature_extractor.to_json_string()
+    if config not in _config_digests:
+        _config_digests[config] = hashlib.sha1(config.encode("utf-8")).hexdigest()
+    return _config_digests[config]
+
+def feature_cache_key(array, sampling_rate, config_digest):
+    """Clé de cache : empreinte du signal, de sa fréquence et de la configuration d'extraction"""
+    digest = hashlib.sha1(np.ascontiguousarray(array, dtype=np.float32).tobytes())
+    digest.update(f"{sampling_rate}:{config_digest}".encode("utf-8"))
+    return digest.hexdigest()
+
+def cache_path(cache_dir, key):
+    # Sous-dossiers par préfixe pour éviter des répertoires de plusieurs millions d'entrées
+    return os.path.join(cache_dir, key[:2], f"{key}.npy")
+
+def load_cached_features(cache_dir, key):
+    path = cache_path(cache_dir, key)
+    if os.path.exists(path):
+        return np.load(path, mmap_mode="r")
+    return None
+
+def save_cached_features(cache_dir, key, features):
+    """Écrit une entrée du cache en float16, de façon atomique (sûr entre processus)"""
+    path = cache_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, features.astype(np.float16, copy=False))
+    os.replace(tmp_path, path)
 
 # === FONCTION DE PRÉTRAITEMENT ===
-def prepare_example(example):
-    audio = example["audio"]
-    inputs = processor(
-        audio["array"],
-        sampling_rate=audio["sampling_rate"],
-        text=example["text"],
-        return_tensors="pt"
-    )
+def prepare_batch(batch, model_name=WHISPER_MODEL, cache_dir=FEATURE_CACHE_DIR):
+    """
+    Prépare un lot d'exemples (`dataset.map(..., batched=True)`) : caractéristiques
+    log-mel (lues dans le cache ou calculées en un seul appel par fréquence
+    d'échantillonnage) et labels tokenisés. Le texte passe par le même
+    normaliseur que le calcul du WER (`simple_normalization.py`).
+    """
+    processor = get_processor(model_name)
+    config_digest = extractor_digest(processor)
+
+    if "audio" in batch:
+        audios = batch["audio"]
+    else:
+        # Segments bruts : PCM int16 ramené dans [-1, 1]
+        audios = []
+        for values in batch["input_values"]:
+            array = np.asarray(values)
+            if array.dtype.kind == "i":
+                array = array.astype(np.float32) / 32767.0
+            audios.append({"array": array, "sampling_rate": SAMPLE_RATE})
+    features = [None] * len(audios)
+    keys = [None] * len(audios)
+    missing = {}  # Fréquence d'échantillonnage -> indices à calculer
+    for i, audio in enumerate(audios):
+        if cache_dir is not None:
+            keys[i] = feature_cache_key(audio["array"], audio["sampling_rate"], config_digest)
+            features[i] = load_cached_features(cache_dir, keys[i])
+        if features[i] is None:
+            missing.setdefault(audio["sampling_rate"], []).append(i)
+
+    for sampling_rate, indices in missing.items():
+        computed = processor.feature_extractor(
+            [audios[i]["array"] for i in indices],
+            sampling_rate=sampling_rate,
+            return_tensors="np"
+        ).input_features
+        for i, values in zip(indices, computed):
+            if cache_dir is not None:
+                # Arrondi float16 dès le premier passage : résultats identiques avec ou sans cache
+                values = values.astype(np.float16)
+                save_cached_features(cache_dir, keys[i], values)
+            features[i] = values
 
-    example["input_features"] = inputs.input_features[0]
-    example["labels"] = inputs.labels[0]
+    return {
+        "input_features": [np.asarray(values, dtype=np.float32) for values in features],
+        "labels": processor.tokenizer(normalize_batch(batch["text"])).input_ids,
+    }
+
+def prepare_example(example, model_name=WHISPER_MODEL, cache_dir=FEATURE_CACHE_DIR):
+    """Version exemple par exemple de `prepare_batch` (compatibilité)"""
+    prepared = prepare_batch({"audio": [example["audio"]], "text": [example["text"]]}, model_name, cache_dir)
+    example["input_features"] = prepared["input_features"][0]
+    example["labels"] = prepared["labels"][0]
     return example
 
 # === APPLICATION AU DATASET ===
-dataset = dataset.map(prepare_example, remove_columns=dataset["train"].column_names)
+def prepare_dataset(dataset, model_name=WHISPER_MODEL, cache_dir=FEATURE_CACHE_DIR,
+                    batch_size=BATCH_SIZE, num_proc=NUM_PROC):
+    """
+    Applique `prepare_batch` à un `Dataset` ou `DatasetDict`, par lots et sur
+    `num_proc` processus. Les colonnes de `KEEP_COLUMNS` (la variété
+    dialectale) sont conservées pour l'évaluation.
+    """
+    column_names = dataset["train"].column_names if hasattr(dataset, "keys") else dataset.column_names
+    return dataset.map(
+        prepare_batch,
+        batched=True,
+        batch_size=batch_size,
+        num_proc=num_proc if num_proc > 1 else None,
+        remove_columns=[name for name in column_names if name not in KEEP_COLUMNS],
+        fn_kwargs={"model_name": model_name, "cache_dir": cache_dir},
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extraction des caractéristiques Whisper avec cache sur disque")
+    parser.add_argument("--dataset_dir", type=str, required=True, help="DatasetDict (audio + text) sauvegardé avec save_to_disk")
+    parser.add_argument("--output_dir", type=str, required=True, help="Répertoire du dataset préparé")
+    parser.add_argument("--model_name", type=str, default=WHISPER_MODEL, help="Processor Whisper à utiliser")
+    parser.add_argument("--cache_dir", type=str, default=FEATURE_CACHE_DIR, help="Cache des caractéristiques log-mel")
+    parser.add_argument("--batch_size", type=int, default=BATCH_SIZE, help="Nombre d'exemples par lot")
+    parser.add_argument("--num_proc", type=int, default=NUM_PROC, help="Nombre de processus")
+    args = parser.parse_args()
+
+    from datasets import load_from_disk
+
+    dataset = prepare_dataset(load_from_disk(args.dataset_dir), args.model_name, args.cache_dir,
+                              args.batch_size, args.num_proc)
+    dataset.save_to_disk(args.output_dir)
 
-# === AFFICHAGE DE CONTRÔLE ===
-print("Exemple prétraité :")
-print(dataset["train"][0])
+    # === AFFICHAGE DE CONTRÔLE ===
+    print("Exemple prétraité :")
+    print(dataset["train"][0] if hasattr(dataset, "keys") else dataset[0])
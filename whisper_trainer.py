@@ -8,7 +8,8 @@ Ce script suppose que vous avez déjà :
 3. Le jeu de données est divisé en "train" et "test" (avec `train_test_split`)
 
 Entrée attendue :
-- `dataset`: un objet `datasets.DatasetDict` contenant deux sous-ensembles : `train` et `test`
+- `dataset`: un objet `datasets.DatasetDict` contenant deux sous-ensembles : `train` et `test`,
+  sauvegardé avec `save_to_disk` (ex. par `whisper_tokenizer.py`) dans `--dataset_dir`
 - Chaque exemple doit contenir les champs :
     - `input_features`: tenseurs audio préparés avec `WhisperProcessor`
     - `labels`: séquences tokenisées du texte de transcription
@@ -16,80 +17,329 @@ Entrée attendue :
 Sortie :
 - Modèle Whisper fine-tuné sauvegardé dans le répertoire `OUTPUT_DIR`
 - Processeur sauvegardé dans le même dossier
-- Score de WER calculé 
+- Score de WER calculé par génération gloutonne, global et par variété (`eval_wer.json`)
+
+L'entraînement ne démarre qu'à l'exécution du script : le collecteur, le
+sampler et l'évaluation peuvent être importés ailleurs (benchmarks, tests)
+sans charger torch ni transformers, importés seulement à l'usage.
 
 Auteur : Daphne Teixeira
 """
 
-from transformers import WhisperForConditionalGeneration, TrainingArguments, Trainer
-import torch
-import evaluate
+import argparse
+import functools
+import json
+import os
+import random
+import numpy as np
 from dataclasses import dataclass
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, Union
+
+import instrumentation
+from instrumentation import stage
+from simple_normalization import normalize_text
+from wer import wer_by_group
 
 # === PARAMÈTRES ===
 MODEL_NAME = "openai/whisper-small"
 OUTPUT_DIR = "whisper-kriol-finetuned"
-
-# === CHARGER LE MODÈLE ===
-model = WhisperForConditionalGeneration.from_pretrained(MODEL_NAME)
-
-# === ARGUMENTS D'ENTRAÎNEMENT ===
-training_args = TrainingArguments(
-    output_dir=OUTPUT_DIR,
-    per_device_train_batch_size=8,
-    per_device_eval_batch_size=8,
-    gradient_accumulation_steps=2,
-    learning_rate=1e-5,
-    warmup_steps=100,
-    max_steps=1000,
-    evaluation_strategy="epoch",
-    save_strategy="epoch",
-    logging_steps=10,
-    save_total_limit=2,
-    fp16=torch.cuda.is_available(),
-    push_to_hub=False
-)
+DATASET_DIR = "kriol_features"  # DatasetDict préparé par whisper_tokenizer.py
+MAX_TOKENS_PER_BATCH = 1024  # Budget de tokens de labels (padding compris) par lot ; None = lots fixes de 8
+MAX_BATCH_SIZE = 32          # Nombre maximal d'exemples par lot en mode budget
+PAD_TO_MULTIPLE_OF = 8       # Longueur des labels arrondie au multiple de 8 (noyaux tensor cores)
+EVAL_BATCH_SIZE = 16         # Exemples par appel à generate pendant l'évaluation
+EVAL_SUBSAMPLE = 200         # Taille du sous-échantillon fixe évalué en fin d'époque ; None = tout le jeu de test
+MAX_NEW_TOKENS = 225         # Longueur maximale des transcriptions générées
 
 # === COLLECTEUR DE DONNÉES PERSONNALISÉ ===
 @dataclass
 class DataCollatorSpeechSeq2SeqWithPadding:
     processor: Any
+    pad_to_multiple_of: Optional[int] = None  # Arrondit la longueur des labels (ex. 8)
+    pin_memory: bool = False                  # Tenseurs en mémoire épinglée (copie asynchrone vers le GPU)
 
-    def __call__(self, features: List[Dict[str, Union[List[int], torch.Tensor]]]) -> Dict[str, torch.Tensor]:
+    def __post_init__(self):
+        # Compteurs de tokens de labels, pour mesurer la part de padding
+        self.label_tokens = 0
+        self.padded_tokens = 0
+
+    def __call__(self, features: List[Dict[str, Union[List[int], "torch.Tensor"]]]) -> Dict[str, "torch.Tensor"]:
         input_features = [{"input_features": f["input_features"]} for f in features]
         label_features = [f["labels"] for f in features]
         batch = self.processor.feature_extractor.pad(input_features, return_tensors="pt")
-        labels_batch = self.processor.tokenizer.pad({"input_ids": label_features}, return_tensors="pt")
+        labels_batch = self.processor.tokenizer.pad({"input_ids": label_features}, return_tensors="pt",
+                                                    pad_to_multiple_of=self.pad_to_multiple_of)
         labels = labels_batch["input_ids"].masked_fill(labels_batch.attention_mask.ne(1), -100)
         batch["labels"] = labels
+
+        self.label_tokens += int(labels_batch.attention_mask.sum())
+        self.padded_tokens += labels.numel()
+        if self.pin_memory:
+            import torch
+
+            if torch.cuda.is_available():
+                batch = {key: value.pin_memory() for key, value in batch.items()}
         return batch
 
+    def reset_padding_stats(self):
+        """Renvoie la part de tokens de padding depuis le dernier appel, puis remet les compteurs à zéro"""
+        fraction = 1 - self.label_tokens / self.padded_tokens if self.padded_tokens else 0.0
+        self.label_tokens = self.padded_tokens = 0
+        return fraction
+
+# === LOTS PAR BUDGET DE TOKENS ===
+class TokenBudgetBatchSampler:
+    """
+    Regroupe les exemples de longueurs de labels voisines. Les indices sont
+    mélangés, découpés en groupes de `bucket_size`, triés par longueur dans
+    chaque groupe, puis coupés en lots dont le coût avec padding
+    (taille du lot × longueur maximale) ne dépasse pas `max_tokens`.
+    L'ordre des lots est mélangé à chaque époque. S'utilise comme
+    `batch_sampler` d'un `DataLoader`.
+    """
+
+    def __init__(self, lengths, max_tokens, max_batch_size=MAX_BATCH_SIZE, pad_to_multiple_of=None,
+                 bucket_size=1000, seed=42):
+        self.lengths = lengths
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.bucket_size = bucket_size
+        self.seed = seed
+        self.epoch = 0
+        self.batches = self._make_batches(self.epoch)
+
+    def _padded(self, length):
+        multiple = self.pad_to_multiple_of
+        return -(-length // multiple) * multiple if multiple else length
+
+    def _make_batches(self, epoch):
+        rng = random.Random(self.seed + epoch)
+        indices = list(range(len(self.lengths)))
+        rng.shuffle(indices)
+
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = sorted(indices[start:start + self.bucket_size], key=lambda i: self.lengths[i])
+            batch, longest = [], 0
+            for i in bucket:
+                candidate = max(longest, self._padded(self.lengths[i]))
+                if batch and (candidate * (len(batch) + 1) > self.max_tokens or len(batch) == self.max_batch_size):
+                    batches.append(batch)
+                    batch, candidate = [], self._padded(self.lengths[i])
+                batch.append(i)
+                longest = candidate
+            if batch:
+                batches.append(batch)
+        rng.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        batches, self.epoch = self.batches, self.epoch + 1
+        self.batches = self._make_batches(self.epoch)
+        return iter(batches)
+
+    def __len__(self):
+        return len(self.batches)
+
 # === ÉVALUATION — WER ===
-wer_metric = evaluate.load("wer")
-
-def compute_metrics(pred):
-    pred_ids = pred.predictions
-    label_ids = pred.label_ids
-    pred_str = processor.tokenizer.batch_decode(pred_ids, skip_special_tokens=True)
-    label_ids[label_ids == -100] = processor.tokenizer.pad_token_id
-    label_str = processor.tokenizer.batch_decode(label_ids, skip_special_tokens=True)
-    return {"wer": wer_metric.compute(predictions=pred_str, references=label_str)}
-
-# === ENTRAÎNEUR ===
-trainer = Trainer(
-    model=model,
-    args=training_args,
-    train_dataset=dataset["train"],
-    eval_dataset=dataset["test"],
-    tokenizer=processor.feature_extractor,
-    data_collator=DataCollatorSpeechSeq2SeqWithPadding(processor),
-    compute_metrics=compute_metrics
-)
-
-# === LANCEMENT ===
-trainer.train()
-
-# === SAUVEGARDE ===
-trainer.save_model(OUTPUT_DIR)
-processor.save_pretrained(OUTPUT_DIR)
+def evaluate_wer(model, processor, eval_dataset, batch_size=EVAL_BATCH_SIZE, subsample=None, seed=42,
+                 max_new_tokens=MAX_NEW_TOKENS):
+    """
+    Évalue le WER par génération gloutonne (num_beams=1), par lots.
+
+    Les exemples sont triés par longueur de référence pour que les séquences
+    d'un même lot terminent à peu près ensemble. Avec `subsample`, un
+    sous-ensemble fixe (tiré avec `seed`) est évalué, pour des contrôles
+    rapides en cours d'entraînement. Les scores sont ventilés par variété
+    (`CM`, `GB`) si la colonne `variety` est présente. `input_features` est
+    lu au format numpy : chaque lot est découpé directement en tableau, sans
+    passer par des listes Python imbriquées.
+    """
+    import torch
+
+    features = eval_dataset.with_format("numpy", columns=["input_features"], output_all_columns=True)
+    indices = list(range(len(eval_dataset)))
+    if subsample is not None and subsample < len(indices):
+        indices = random.Random(seed).sample(indices, subsample)
+    lengths = eval_dataset["labels"]
+    indices.sort(key=lambda i: len(lengths[i]), reverse=True)
+    has_variety = "variety" in eval_dataset.column_names
+
+    was_training = model.training
+    model.eval()
+    references, hypotheses, varieties = [], [], []
+    for start in range(0, len(indices), batch_size):
+        examples = features[indices[start:start + batch_size]]
+        input_features = torch.from_numpy(examples["input_features"].astype(np.float32, copy=False))
+        input_features = input_features.to(model.device, dtype=model.dtype)
+        with torch.no_grad():
+            predicted_ids = model.generate(input_features, num_beams=1, do_sample=False,
+                                           max_new_tokens=max_new_tokens)
+        hypotheses += processor.tokenizer.batch_decode(predicted_ids, skip_special_tokens=True)
+        label_ids = [[t for t in labels if t != -100] for labels in examples["labels"]]
+        references += processor.tokenizer.batch_decode(label_ids, skip_special_tokens=True)
+        varieties += examples["variety"] if has_variety else [None] * len(label_ids)
+    if was_training:
+        model.train()
+
+    return wer_by_group(references, hypotheses, varieties, normalize=normalize_text)
+
+# === ENTRAÎNEUR ET CALLBACKS ===
+@functools.lru_cache(maxsize=None)
+def trainer_classes():
+    """
+    Crée à la demande les sous-classes de `Trainer` et `TrainerCallback`
+    (torch et transformers ne sont importés qu'ici) et renvoie
+    `(LengthGroupedTrainer, PaddingStatsCallback, GenerationWERCallback)`.
+    """
+    from torch.utils.data import DataLoader
+    from transformers import Trainer, TrainerCallback
+
+    class LengthGroupedTrainer(Trainer):
+        """`Trainer` dont le chargeur d'entraînement utilise `TokenBudgetBatchSampler`"""
+
+        def __init__(self, *args, max_tokens=None, max_batch_size=MAX_BATCH_SIZE, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.max_tokens = max_tokens
+            self.max_batch_size = max_batch_size
+            # PaddingStatsCallback complète les logs avant que les intégrations (report_to) ne les lisent
+            self.callback_handler.callbacks.sort(key=lambda callback: not isinstance(callback, PaddingStatsCallback))
+
+        def get_train_dataloader(self):
+            if self.max_tokens is None:
+                return super().get_train_dataloader()
+            lengths = [len(labels) for labels in self.train_dataset["labels"]]
+            batch_sampler = TokenBudgetBatchSampler(
+                lengths, self.max_tokens, self.max_batch_size,
+                pad_to_multiple_of=getattr(self.data_collator, "pad_to_multiple_of", None),
+                seed=self.args.seed,
+            )
+            dataloader = DataLoader(
+                self.train_dataset,
+                batch_sampler=batch_sampler,
+                collate_fn=self.data_collator,
+                num_workers=self.args.dataloader_num_workers,
+                pin_memory=self.args.dataloader_pin_memory,
+            )
+            return self.accelerator.prepare(dataloader)
+
+    class PaddingStatsCallback(TrainerCallback):
+        """
+        Ajoute au journal, à chaque fin d'époque, la part de tokens de padding
+        dans les labels (`label_padding_fraction`). La valeur est ajoutée au
+        log suivant du `Trainer` (`on_log`), celui de l'évaluation de fin
+        d'époque : elle parvient ainsi aux intégrations de `report_to`
+        (TensorBoard...). Le collecteur doit tourner dans le processus
+        principal (`dataloader_num_workers=0`, valeur par défaut).
+        """
+
+        def __init__(self, collator):
+            self.collator = collator
+            self.pending = None  # Part de padding pas encore transmise aux logs
+
+        def on_epoch_begin(self, args, state, control, **kwargs):
+            # Écarte les lots d'évaluation comptés depuis la fin de l'époque précédente
+            self.collator.reset_padding_stats()
+
+        def on_epoch_end(self, args, state, control, **kwargs):
+            self.pending = self.collator.reset_padding_stats()
+            print(f"Époque {state.epoch:.2f} : {self.pending:.1%} de tokens de padding dans les labels")
+            control.should_log = True
+
+        def on_log(self, args, state, control, logs=None, **kwargs):
+            if self.pending is None or logs is None:
+                return
+            logs["label_padding_fraction"] = self.pending
+            if state.log_history:
+                state.log_history[-1]["label_padding_fraction"] = self.pending  # Copie faite avant on_log
+            self.pending = None
+
+    class GenerationWERCallback(TrainerCallback):
+        """Évalue le WER par génération sur un sous-échantillon fixe à chaque fin d'époque"""
+
+        def __init__(self, processor, eval_dataset, subsample=EVAL_SUBSAMPLE):
+            self.processor = processor
+            self.eval_dataset = eval_dataset
+            self.subsample = subsample
+
+        def on_epoch_end(self, args, state, control, model=None, **kwargs):
+            scores = evaluate_wer(model, self.processor, self.eval_dataset, subsample=self.subsample, seed=args.seed)
+            print(f"Époque {state.epoch:.2f} : " + ", ".join(
+                f"{name} = {value:.4f}" if name.startswith("wer") else f"{name} = {value}"
+                for name, value in scores.items()))
+            state.log_history.append({"epoch": state.epoch, "step": state.global_step,
+                                      **{f"eval_{name}": value for name, value in scores.items()}})
+
+    return LengthGroupedTrainer, PaddingStatsCallback, GenerationWERCallback
+
+# === EXÉCUTION ===
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fine-tuning de Whisper sur le Kriol")
+    parser.add_argument("--dataset_dir", type=str, default=DATASET_DIR, help="DatasetDict (train / test) préparé par whisper_tokenizer.py")
+    parser.add_argument("--output_dir", type=str, default=OUTPUT_DIR, help="Dossier du modèle fine-tuné")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args.profile_log, args.cprofile)
+
+    import torch
+    from datasets import load_from_disk
+    from transformers import WhisperForConditionalGeneration, WhisperProcessor, TrainingArguments
+
+    with stage("load"):
+        # === CHARGER LE DATASET ET LE PROCESSOR ===
+        dataset = load_from_disk(args.dataset_dir)
+        processor = WhisperProcessor.from_pretrained(MODEL_NAME)
+
+        # === CHARGER LE MODÈLE ===
+        model = WhisperForConditionalGeneration.from_pretrained(MODEL_NAME)
+
+    # === ARGUMENTS D'ENTRAÎNEMENT ===
+    training_args = TrainingArguments(
+        output_dir=args.output_dir,
+        per_device_train_batch_size=8,
+        per_device_eval_batch_size=8,
+        gradient_accumulation_steps=2,
+        learning_rate=1e-5,
+        warmup_steps=100,
+        max_steps=1000,
+        eval_strategy="epoch",
+        save_strategy="epoch",
+        logging_steps=10,
+        save_total_limit=2,
+        fp16=torch.cuda.is_available(),
+        dataloader_pin_memory=False,  # L'épinglage est fait par le collecteur
+        push_to_hub=False
+    )
+
+    # === ENTRAÎNEUR ===
+    LengthGroupedTrainer, PaddingStatsCallback, GenerationWERCallback = trainer_classes()
+    data_collator = DataCollatorSpeechSeq2SeqWithPadding(processor, pad_to_multiple_of=PAD_TO_MULTIPLE_OF,
+                                                         pin_memory=torch.cuda.is_available())
+
+    trainer = LengthGroupedTrainer(
+        model=model,
+        args=training_args,
+        train_dataset=dataset["train"],
+        eval_dataset=dataset["test"],
+        processing_class=processor.feature_extractor,
+        data_collator=data_collator,
+        callbacks=[PaddingStatsCallback(data_collator), GenerationWERCallback(processor, dataset["test"])],
+        max_tokens=MAX_TOKENS_PER_BATCH,
+    )
+
+    # === LANCEMENT ===
+    with stage("train"):
+        trainer.train()
+
+    # === SAUVEGARDE ===
+    with stage("write"):
+        trainer.save_model(args.output_dir)
+        processor.save_pretrained(args.output_dir)
+
+    # === ÉVALUATION FINALE SUR TOUT LE JEU DE TEST ===
+    with stage("evaluate"):
+        scores = evaluate_wer(model, processor, dataset["test"])
+    print("WER final :", scores)
+    with open(os.path.join(args.output_dir, "eval_wer.json"), "w", encoding="utf-8") as f:
+        json.dump(scores, f, indent=2)
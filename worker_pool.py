@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Exécution de tâches indépendantes sur un pool de processus, sans blocage
+quand un worker meurt ou se fige (`pre-process.py`, `vad_pyannote.py`,
+`eaf_to_csv.py`).
+
+`multiprocessing.Pool` remplace sans bruit un worker tué (OOM killer, plantage
+d'une bibliothèque native) mais perd sa tâche : l'attente de son résultat ne se
+termine jamais. Ici, le pool est un `ProcessPoolExecutor`, qui signale la mort
+d'un worker (`BrokenProcessPool`) :
+- au plus `workers` tâches sont soumises à la fois : chacune démarre dès sa
+  soumission, et son délai (`timeout`) court à partir de ce moment
+- une tâche qui dépasse son délai est abandonnée : les workers sont tués, les
+  autres tâches en cours sont resoumises à un nouveau pool
+- quand un worker meurt, les tâches qui étaient en cours sont rejouées une par
+  une dans un pool isolé : seule celle qui fait tomber son worker échoue
+- les workers sont remplacés toutes les `max_tasks_per_child` tâches (en
+  moyenne par worker), ce qui borne l'accumulation de mémoire
+
+Chaque tâche donne un triplet (tâche, résultat, erreur), dans l'ordre des
+tâches : c'est à l'appelant de nettoyer les sorties partielles d'une tâche en
+échec, dont il connaît les noms.
+
+Auteur : Daphne Teixeira
+"""
+
+import collections
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# === PARAMÈTRES ===
+TIMEOUT_ERROR = "délai dépassé"
+CRASH_ERROR = "processus interrompu (mémoire insuffisante ou plantage du worker)"
+
+
+def _stop(executor):
+    """Arrête un pool sans attendre ses tâches : les workers bloqués sont tués"""
+    kill_workers = getattr(executor, 'kill_workers', None)  # Python 3.14+
+    if kill_workers is not None:
+        kill_workers()
+    else:
+        for process in list((getattr(executor, '_processes', None) or {}).values()):
+            process.kill()
+    executor.shutdown(wait=True)
+
+
+def _run_isolated(task_fn, task, timeout, initializer, initargs):
+    """Exécute une seule tâche dans un pool d'un worker ; renvoie (résultat, erreur)"""
+    executor = ProcessPoolExecutor(max_workers=1, initializer=initializer, initargs=initargs)
+    try:
+        return executor.submit(task_fn, task).result(timeout=timeout), None
+    except FutureTimeoutError:
+        return None, TIMEOUT_ERROR
+    except BrokenProcessPool:
+        return None, CRASH_ERROR
+    except Exception as e:
+        return None, str(e)
+    finally:
+        _stop(executor)
+
+
+def run_tasks(task_fn, tasks, workers=1, timeout=None, initializer=None, initargs=(), max_tasks_per_child=None):
+    """
+    Exécute `task_fn` sur chaque tâche et génère les triplets
+    (tâche, résultat, erreur) dans l'ordre des tâches. `erreur` vaut None en
+    cas de succès ; sinon c'est un message (exception, délai dépassé, worker
+    interrompu) et le résultat vaut None.
+
+    Avec `workers <= 1`, les tâches sont exécutées dans le processus courant
+    (`initializer` y est appelé une fois, `timeout` ne s'applique pas).
+    `task_fn` doit être une fonction de niveau module (transmise aux workers).
+    """
+    tasks = list(tasks)
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in tasks:
+            try:
+                yield task, task_fn(task), None
+            except Exception as e:
+                yield task, None, str(e)
+        return
+
+    queue = collections.deque(range(len(tasks)))  # Indices des tâches à soumettre
+    suspects = []   # Tâches en cours à la mort d'un worker, rejouées une par une
+    running = {}    # Future -> (indice, échéance)
+    results = {}    # Indice -> (résultat, erreur), en attente de l'ordre des tâches
+    next_index = 0
+    executor = None
+    submitted = 0   # Tâches soumises au pool courant
+    recycle_after = workers * max_tasks_per_child if max_tasks_per_child else None
+
+    try:
+        while next_index < len(tasks):
+            if suspects and not running:
+                index = suspects.pop(0)
+                results[index] = _run_isolated(task_fn, tasks[index], timeout, initializer, initargs)
+            else:
+                if executor is not None and recycle_after and submitted >= recycle_after and not running:
+                    executor.shutdown(wait=True)
+                    executor = None
+                if executor is None:
+                    executor = ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+                    submitted = 0
+                while queue and len(running) < workers and not (recycle_after and submitted >= recycle_after):
+                    index = queue.popleft()
+                    deadline = None if timeout is None else time.monotonic() + timeout
+                    running[executor.submit(task_fn, tasks[index])] = (index, deadline)
+                    submitted += 1
+
+                deadlines = [deadline for _, deadline in running.values() if deadline is not None]
+                wait_time = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                done, _ = wait(running, timeout=wait_time, return_when=FIRST_COMPLETED)
+
+                broken = False
+                for future in done:
+                    index, _ = running.pop(future)
+                    try:
+                        results[index] = (future.result(), None)
+                    except BrokenProcessPool:
+                        broken = True
+                        suspects.append(index)
+                    except Exception as e:
+                        results[index] = (None, str(e))
+
+                now = time.monotonic()
+                expired = [future for future, (_, deadline) in running.items()
+                           if deadline is not None and deadline <= now]
+                if broken or expired:
+                    for future in expired:
+                        index, _ = running.pop(future)
+                        results[index] = (None, TIMEOUT_ERROR)
+                    interrupted = sorted(index for index, _ in running.values())
+                    running.clear()
+                    _stop(executor)
+                    executor = None
+                    if broken:
+                        # Impossible de savoir quelle tâche a fait tomber le worker : chacune est rejouée seule
+                        suspects = sorted(suspects + interrupted)
+                    else:
+                        queue.extendleft(reversed(interrupted))
+
+            while next_index in results:
+                result, error = results.pop(next_index)
+                yield tasks[next_index], result, error
+                next_index += 1
+    finally:
+        if executor is not None:
+            _stop(executor)